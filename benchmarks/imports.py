@@ -0,0 +1,111 @@
+""" Import-time benchmark for the package and its console scripts.
+
+Each scenario imports a part of ``telstra.mobile`` in a fresh interpreter,
+several times over, and reports the median time taken along with which
+heavy third-party stacks it loaded::
+
+    python benchmarks/imports.py --json after.json
+    python benchmarks/imports.py --compare after.json
+"""
+import argparse
+from collections import OrderedDict
+import json
+import subprocess
+import sys
+
+HEAVY_MODULES = ('requests', 'aiohttp', 'gsmmodem', 'serial', 'serialenum',
+                 'sqlite3')
+
+SCENARIOS = OrderedDict([
+    ('package', 'import telstra.mobile'),
+    ('parsers', 'from telstra.mobile.parse import parse_balance'),
+    ('web api', 'from telstra.mobile import TelstraWebApi'),
+    ('autodetect_account', 'from telstra.mobile import autodetect_account'),
+    ('get-balance', 'from telstra.mobile.scripts.get_balance import main'),
+    ('send-credit', 'from telstra.mobile.scripts.send_credit import main'),
+    ('modem-broker', 'from telstra.mobile.scripts.broker import main'),
+])
+
+PROBE = """
+import json, sys, time
+start = time.time()
+%s
+seconds = time.time() - start
+print(json.dumps({'seconds': seconds,
+                  'loaded': [name for name in %r if name in sys.modules]}))
+"""
+
+
+def measure(statement, repeat):
+    """ Time ``statement`` in ``repeat`` fresh interpreters.
+
+    :returns: Structure with the median ``seconds`` and the heavy modules
+        ``loaded``, or an ``error`` if the import failed.
+    """
+    results = []
+    for _ in range(repeat):
+        process = subprocess.Popen(
+            [sys.executable, '-c', PROBE % (statement, HEAVY_MODULES)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        if process.returncode:
+            return {'seconds': None, 'loaded': [],
+                    'error': stderr.decode('utf-8').strip().splitlines()[-1]}
+        results.append(json.loads(stdout.decode('utf-8')))
+    results.sort(key=lambda result: result['seconds'])
+    result = results[len(results) // 2]
+    result['error'] = None
+    return result
+
+
+def format_report(report, baseline=None):
+    lines = ['%-20s %10s  %s' % ('scenario', 'seconds', 'heavy modules')]
+    for name, result in report.items():
+        if result['error']:
+            lines.append('%-20s %10s  failed: %s' % (name, '-',
+                                                     result['error']))
+            continue
+        line = '%-20s %10.3f  %s' % (name, result['seconds'],
+                                     ', '.join(result['loaded']) or '-')
+        previous = (baseline or {}).get(name)
+        if previous and previous.get('seconds') is not None:
+            line += '   (%+.3fs)' % (result['seconds'] - previous['seconds'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Interpreters per scenario; the median is '
+                             'reported.')
+    parser.add_argument('-k', '--filter',
+                        help='Only run scenarios containing this text.')
+    parser.add_argument('--json',
+                        help='Save the report as JSON to this file.')
+    parser.add_argument('--compare',
+                        help='Compare against a report saved with --json.')
+    options = parser.parse_args(argv)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    report = OrderedDict()
+    for name, statement in SCENARIOS.items():
+        if options.filter and options.filter not in name:
+            continue
+        report[name] = measure(statement, options.repeat)
+
+    print(format_report(report, baseline))
+
+    if options.json:
+        with open(options.json, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
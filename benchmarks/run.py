@@ -0,0 +1,229 @@
+""" End-to-end benchmarks over a simulated, latency-bound Telstra network.
+
+Each scenario runs a real flow -- autodetection, balance and expiry, call
+credit balance, CreditMe2U -- against modems from
+:mod:`telstra.mobile.simulator`, and reports the wall time taken and the
+number of USSD round trips made.  Save a report with ``--json`` and pass it
+to ``--compare`` on a later run to see what a change saved::
+
+    python benchmarks/run.py --ports 12 --latency 0.2 --json before.json
+    python benchmarks/run.py --ports 12 --latency 0.2 --compare before.json
+"""
+import argparse
+from collections import OrderedDict
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from telstra.mobile import modem as modem_module
+from telstra.mobile.account import Prepaid, autodetect_account
+from telstra.mobile.discovery import DiscoveryCache
+from telstra.mobile.menu import crawl
+from telstra.mobile.simulator import SimulatedNetwork, SimulatedSim
+
+SCENARIOS = OrderedDict()
+
+
+def scenario(name):
+    """ Register a benchmark scenario.
+
+    Scenarios take the parsed options and a :class:`SimulatedNetwork`, and
+    return a callable that runs the flow being measured.  Any set up done
+    before returning is not measured.
+    """
+    def decorator(fn):
+        SCENARIOS[name] = fn
+        return fn
+    return decorator
+
+
+def build_network(options):
+    """ Build a network of ``ports`` ports, the last ``modems`` with SIMs.
+    """
+    ports = ['/dev/ttyUSB%d' % number for number in range(options.ports)]
+    sims = {}
+    for index, port in enumerate(ports[-options.modems:]):
+        sims[port] = SimulatedSim(phone_number='04000000%02d' % index,
+                                  imsi='5050100000000%02d' % index)
+    network = SimulatedNetwork(sims, ports,
+                               latency=options.latency,
+                               connect_latency=options.connect_latency,
+                               timeout=options.connect_timeout,
+                               failure_rate=options.failure_rate,
+                               timeout_rate=options.timeout_rate,
+                               seed=options.seed)
+    modem_module.GsmModem = network.modem_cls
+    modem_module.enumerate_serial = network.enumerate
+    return network
+
+
+def target_number(options):
+    return '04000000%02d' % (options.modems - 1)
+
+
+def connected_account(network, options):
+    """ Connect directly to the target SIM's modem, outside measurement.
+    """
+    modem = network.modem_cls(network.ports[-1])
+    modem.connect()
+    return Prepaid(modem)
+
+
+@scenario('autodetect_account, sequential')
+def autodetect_sequential(options, network):
+    return lambda: autodetect_account(phone_number=target_number(options))
+
+
+@scenario('autodetect_account, concurrent')
+def autodetect_concurrent(options, network):
+    return lambda: autodetect_account(phone_number=target_number(options),
+                                      workers=options.ports)
+
+
+@scenario('autodetect_account, discovery cache')
+def autodetect_cached(options, network):
+    cache = DiscoveryCache(os.path.join(options.directory, 'discovery.json'))
+    autodetect_account(phone_number=target_number(options), cache=cache)
+    return lambda: autodetect_account(phone_number=target_number(options),
+                                      cache=cache)
+
+
+@scenario('balance + expiry_date, no snapshot')
+def balance_expiry_uncached(options, network):
+    account = connected_account(network, options)
+    account.snapshot_max_age = 0
+    return lambda: (account.balance, account.expiry_date)
+
+
+@scenario('balance + expiry_date, snapshot')
+def balance_expiry(options, network):
+    account = connected_account(network, options)
+    return lambda: (account.balance, account.expiry_date)
+
+
+@scenario('balance_call_credits, stepwise')
+def call_credits_stepwise(options, network):
+    account = connected_account(network, options)
+    return account.balance_call_credits
+
+
+@scenario('balance_call_credits, menu map')
+def call_credits_mapped(options, network):
+    account = connected_account(network, options)
+    account.menu_map = crawl(account)
+    return account.balance_call_credits
+
+
+@scenario('creditme2u, stepwise')
+def creditme2u_stepwise(options, network):
+    account = connected_account(network, options)
+    return lambda: account.creditme2u('0499888777', 1)
+
+
+@scenario('creditme2u, menu map')
+def creditme2u_mapped(options, network):
+    account = connected_account(network, options)
+    account.menu_map = crawl(account)
+    return lambda: account.creditme2u('0499888777', 1)
+
+
+def run_scenario(fn, options):
+    """ Run a scenario ``repeat`` times, returning its median result.
+    """
+    results = []
+    for _ in range(options.repeat):
+        network = build_network(options)
+        flow = fn(options, network)
+        before = network.round_trips
+        start = time.time()
+        try:
+            flow()
+            error = None
+        except Exception as exc:
+            error = type(exc).__name__
+        results.append({'seconds': time.time() - start,
+                        'round_trips': network.round_trips - before,
+                        'error': error})
+    results.sort(key=lambda result: result['seconds'])
+    return results[len(results) // 2]
+
+
+def format_report(report, baseline=None):
+    lines = ['%-40s %10s %12s' % ('scenario', 'seconds', 'round trips')]
+    for name, result in report.items():
+        line = '%-40s %10.3f %12d' % (name, result['seconds'],
+                                      result['round_trips'])
+        previous = (baseline or {}).get(name)
+        if previous:
+            line += '   (%+.3fs, %+d)' % (
+                result['seconds'] - previous['seconds'],
+                result['round_trips'] - previous['round_trips'])
+        if result['error']:
+            line += '   failed: %s' % result['error']
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', '--ports', type=int, default=8,
+                        help='Number of serial ports on the system.')
+    parser.add_argument('-m', '--modems', type=int, default=2,
+                        help='Number of those ports with working modems.')
+    parser.add_argument('-l', '--latency', type=float, default=0.05,
+                        help='Seconds per USSD round trip.')
+    parser.add_argument('--connect-latency', type=float, default=0.05,
+                        help='Seconds to connect to a working modem.')
+    parser.add_argument('--connect-timeout', type=float, default=0.2,
+                        help='Seconds before a dead port times out.')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Probability a USSD round trip fails.')
+    parser.add_argument('--timeout-rate', type=float, default=0.0,
+                        help='Probability a USSD round trip times out.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for simulated failures.')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Runs per scenario; the median is reported.')
+    parser.add_argument('-k', '--filter',
+                        help='Only run scenarios containing this text.')
+    parser.add_argument('--json',
+                        help='Save the report as JSON to this file.')
+    parser.add_argument('--compare',
+                        help='Compare against a report saved with --json.')
+    options = parser.parse_args(argv)
+    options.modems = max(1, min(options.modems, options.ports))
+    logging.basicConfig(level=logging.ERROR)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    options.directory = tempfile.mkdtemp()
+    report = OrderedDict()
+    try:
+        for name, fn in SCENARIOS.items():
+            if options.filter and options.filter not in name:
+                continue
+            report[name] = run_scenario(fn, options)
+    finally:
+        shutil.rmtree(options.directory)
+
+    print(format_report(report, baseline))
+
+    if options.json:
+        settings = dict((key, value) for key, value in vars(options).items()
+                        if key not in ('json', 'compare', 'directory'))
+        with open(options.json, 'w') as report_file:
+            json.dump({'settings': settings, 'results': report}, report_file,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -52,11 +52,13 @@ setup(name='telstra.mobile',
       extras_require={
           'test': [],
           'doc': ['sphinx'],
+          'async': ['pyserial-asyncio', 'aiohttp'],
       },
       entry_points="""
       # -*- Entry points: -*-
       [console_scripts]
       send-credit = telstra.mobile.scripts.send_credit:main
       get-balance = telstra.mobile.scripts.get_balance:main
+      modem-broker = telstra.mobile.scripts.broker:main
       """,
       )
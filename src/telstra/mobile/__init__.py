@@ -1,6 +1,31 @@
-from telstra.mobile.account import Prepaid, autodetect_account
-from telstra.mobile.modem import autodetect_modem
-from telstra.mobile.web import TelstraWebApi
+import importlib
+
+# Public names are loaded on first use, so that importing the package, or
+# one light submodule such as the parsers in ``parse`` or the web API,
+# does not also load the modem (gsmmodem, pyserial) and web (requests)
+# stacks.
+_LAZY = {
+    'Prepaid': 'telstra.mobile.account',
+    'autodetect_account': 'telstra.mobile.account',
+    'autodetect_modem': 'telstra.mobile.modem',
+    'TelstraWebApi': 'telstra.mobile.web',
+}
+
+__all__ = sorted(_LAZY) + ['debug']
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError('module %r has no attribute %r' % (__name__,
+                                                                name))
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
 
 
 def debug():
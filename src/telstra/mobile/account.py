@@ -1,24 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
 import re
-from datetime import datetime
 import time
 
 from lazy import lazy
 
 from gsmmodem.exceptions import CommandError, TimeoutException
-from telstra.mobile.modem import autodetect_modem
+from telstra.mobile.config import IDENTITY_TIMEOUT, SNAPSHOT_MAX_AGE
+from telstra.mobile.discovery import check_imsi, read_imsi
+from telstra.mobile.menu import shortcode
+from telstra.mobile.parse import CREDITME2U_LABELS, AccountSnapshot, \
+    find_option, is_identity, parse_amount, parse_balance, \
+    parse_expiry_date, parse_identity, parse_menu
+from telstra.mobile.modem import autodetect_modem, autodetect_modems
+
+# The parsers live in ``parse`` and are re-exported here for compatibility
+__all__ = ['AccountSnapshot', 'CREDITME2U_LABELS', 'Postpaid', 'Prepaid',
+           'TelstraAccount', 'account_for_modem', 'autodetect_account',
+           'autodetect_accounts', 'check_phone_number', 'find_option',
+           'is_identity', 'parse_amount', 'parse_balance',
+           'parse_expiry_date', 'parse_identity', 'parse_menu']
+
+log = logging.getLogger(__name__)
 
 
 class TelstraAccount(object):
     """ Base Telstra mobile account, shared features between types.
     """
 
-    def __init__(self, modem, pin=None):
+    def __init__(self, modem, pin=None, snapshot_max_age=SNAPSHOT_MAX_AGE,
+                 menu_map=None):
         """ Initialise Telstra account with a modem inteface.
 
         :param modem: Instance of :class:`gsmmodem.GsmModem`
+        :param snapshot_max_age: Seconds a main menu snapshot may be reused
+            before ``#100#`` is dialled again.  ``0`` disables reuse.
+        :param menu_map: Optional :class:`telstra.mobile.menu.MenuMap`
+            allowing :meth:`navigate` to jump straight to menu nodes.
         """
         self.modem = modem
         self.pin = pin
+        self.snapshot_max_age = snapshot_max_age
+        self.menu_map = menu_map
+        self._snapshot = None
 
     def close(self):
         """ Close the underlying modem interface.
@@ -40,39 +64,187 @@ class TelstraAccount(object):
         :returns: A numerically-keyed structure representing menu options.
         :rtype: dict
         """
-        menu_items = ussd.message.split('\r\n')
-        menu = {}
-        for item in menu_items:
-            item_details = re.match('(\d+)\.\s+(.*)', item)
-            if item_details:
-                results = item_details.groups()
-                menu[results[1]] = results[0]
-
-        return menu
+        return parse_menu(ussd.message)
 
     def main_menu(self):
         """ Load a USSD session to the main #100# menu.
         """
         return self.modem.sendUssd('#100#')
 
-    def main_menu_parsed(self):
+    def snapshot(self, max_age=None, refresh=False):
+        """ Obtain a main menu snapshot, dialling ``#100#`` only if needed.
+
+        :param max_age: Seconds an existing snapshot may be reused for.
+            Defaults to the account's ``snapshot_max_age``.
+        :param refresh: Always dial for a new snapshot if True.
+        :rtype: :class:`AccountSnapshot`
+        """
+        if max_age is None:
+            max_age = self.snapshot_max_age
+        if refresh or self._snapshot is None or \
+                self._snapshot.age >= max_age:
+            response = self.main_menu()
+            response.cancel()
+            self._snapshot = AccountSnapshot(response.message)
+        return self._snapshot
+
+    def set_snapshot(self, snapshot):
+        """ Replace the main menu snapshot, such as with one taken within a
+        :class:`telstra.mobile.session.MenuSession`.
+
+        :param snapshot: :class:`AccountSnapshot`
+        """
+        self._snapshot = snapshot
+
+    def invalidate_snapshot(self):
+        """ Discard any main menu snapshot, so the next read dials again.
+        """
+        self._snapshot = None
+
+    @property
+    def last_snapshot(self):
+        """ Most recent main menu snapshot, however old, without dialling.
+
+        :rtype: :class:`AccountSnapshot` or ``None``
+        """
+        return self._snapshot
+
+    def main_menu_parsed(self, refresh=False):
         """ Load and parse the main menu ino a numerically-keyed structure.
 
+        :param refresh: Dial for a new main menu rather than using a recent
+            snapshot.
         :rtype: dict
         """
-        menu = self.main_menu()
-        menu.cancel()
-        return self.parse_menu(menu)
+        return dict(self.snapshot(refresh=refresh).menu)
+
+    def navigate(self, labels):
+        """ Open a USSD session at the menu node reached by ``labels``.
+
+        :param labels: Sequence of menu labels to follow from the main
+            menu.  Each item is either a label or a tuple of alternative
+            labels for the same level.
+        :returns: USSD response for the node.
+
+        If the account has a :attr:`menu_map` containing the node, a single
+        compound shortcode (such as ``#100*1*7#``) is dialled.  Should that
+        fail or land somewhere unexpected, the menu is walked one level at
+        a time from ``#100#`` instead.  A map that no longer matches the
+        main menu is discarded.
+        """
+        if self.menu_map is not None:
+            node = self.menu_map.lookup(labels)
+            if node:
+                code = shortcode(node['path'])
+                try:
+                    response = self.modem.sendUssd(code)
+                    if self.menu_map.matches(response,
+                                             self.parse_menu(response),
+                                             node['signature']):
+                        return response
+                    response.cancel()
+                except (CommandError, TimeoutException):
+                    pass
+                log.info('Shortcode %s failed; walking menu instead.' % code)
+
+        response = self.main_menu()
+        if self.menu_map is not None and \
+                not self.menu_map.is_current(self.parse_menu(response)):
+            log.info('Main menu has changed; discarding menu map.')
+            self.menu_map = None
+
+        for alternatives in labels:
+            if not isinstance(alternatives, (tuple, list)):
+                alternatives = (alternatives,)
+            option = find_option(self.parse_menu(response), alternatives)
+            if not option:
+                raise ValueError('Could not detect %s as being available.' %
+                                 alternatives[0])
+            response = response.reply(option)
+        return response
+
+    def iter_pages(self, ussd):
+        """ Yield each page of a USSD response, following ``More`` options.
+
+        Each page is only requested once the previous one has been
+        consumed.  If the consumer stops early, by closing the generator,
+        the USSD session is cancelled.
+        """
+        response = ussd
+        try:
+            while True:
+                yield response
+                option = self.parse_menu(response).get('More')
+                if not option:
+                    break
+                response = response.reply(option)
+        except GeneratorExit:
+            try:
+                response.cancel()
+            except CommandError:
+                pass
+            raise
+
+    def search_pages(self, ussd, pattern):
+        """ Search the pages of a USSD response, stopping at the first match.
+
+        :param pattern: Regular expression to search each page for.
+        :returns: Match object, or ``None`` if no page matched.
+
+        The USSD session is cancelled once the search finishes.
+        """
+        pages = self.iter_pages(ussd)
+        try:
+            for page in pages:
+                match = re.search(pattern, page.message)
+                if match:
+                    return match
+            try:
+                page.cancel()
+            except CommandError:
+                pass
+        finally:
+            pages.close()
 
     def process_response_more(self, ussd):
-        """ Recursively process a USSD response for more Telstra info.
+        """ Process a USSD response and all its further pages of Telstra info.
+
+        :returns: Text of all pages, concatenated.
+        :rtype: str
         """
-        menu = self.parse_menu(ussd)
-        if 'More' in menu:
-            response = ussd.reply(menu['More'])
-            return ussd.message + self.process_response_more(response)
-        else:
-            return ussd.message
+        return ''.join(page.message for page in self.iter_pages(ussd))
+
+    def identity(self, timeout=IDENTITY_TIMEOUT, interval=1):
+        """ Determine the phone and account numbers with one ``#150#`` dial.
+
+        :param timeout: Seconds to keep redialling for while the network
+            responds with something other than the service's identity.
+        :param interval: Initial delay, in seconds, between dials.  The
+            delay doubles after each attempt.
+        :returns: Tuple of phone number and account number.
+        :rtype: tuple
+
+        Both :attr:`phone_number` and :attr:`account_number` are filled
+        from the response, so reading either afterwards costs nothing.
+
+        :raises gsmmodem.exceptions.TimeoutException: If the network has
+            not reported the identity by the deadline.
+        """
+        deadline = time.time() + timeout
+        while True:
+            response = self.modem.sendUssd('#150#')
+            if is_identity(response.message):
+                break
+            if time.time() + interval > deadline:
+                raise TimeoutException(
+                    'No identity from #150#: %r' % response.message)
+            response.cancel()
+            time.sleep(interval)
+            interval *= 2
+
+        self.phone_number, self.account_number = \
+            parse_identity(response.message)
+        return self.phone_number, self.account_number
 
     @lazy
     def phone_number(self):
@@ -80,13 +252,7 @@ class TelstraAccount(object):
 
         :rtype: str
         """
-        response = self.modem.sendUssd('#150#')
-        if 'your mobile' not in response.message.lower():
-            response.cancel()
-            time.sleep(2)
-            response = self.modem.sendUssd('#150#')
-
-        return response.message.split('\r\n')[1]
+        return self.identity()[0]
 
     @lazy
     def account_number(self):
@@ -94,13 +260,7 @@ class TelstraAccount(object):
 
         :rtype: str
         """
-        response = self.modem.sendUssd('#150#')
-        if 'your mobile' not in response.message.lower():
-            response.cancel()
-            time.sleep(2)
-            response = self.modem.sendUssd('#150#')
-
-        return response.message.split('\r\n')[-1]
+        return self.identity()[1]
 
     @lazy
     def is_prepaid(self):
@@ -128,19 +288,11 @@ class Prepaid(TelstraAccount):
 
     @property
     def balance(self):
-        response = self.main_menu()
-        response.cancel()
-        balance = re.search('\$(.*?)\s', response.message)
-        if balance:
-            return float(balance.groups()[0].replace(',', ''))
+        return self.snapshot().balance
 
     @property
     def expiry_date(self):
-        response = self.main_menu()
-        response.cancel()
-        expiry = re.search('Exp.*?\s(.*?)\r\n', response.message)
-        if expiry:
-            return datetime.strptime(expiry.groups()[0], '%d %b %Y')
+        return self.snapshot().expiry_date
 
     def balance_plus_packs(self):
         pass
@@ -151,27 +303,13 @@ class Prepaid(TelstraAccount):
         This method attempts to detect the Call Credits availability for
         this service before proceeding.
         """
-        response = self.main_menu()
-        menu = self.parse_menu(response)
-
-        # Try accessing the Recharge section
-        option = menu.get('Bal Details')
-        if not option:
-            raise ValueError('Could not detect Bal Details as being available.')
+        balance_page1 = self.navigate(['Bal Details', 'Call Cred Bal'])
 
-        response = response.reply(option)
-
-        if not 'Call Cred Bal' in response.message:
-            raise ValueError('Call credits are not available on this service.')
-
-        balance_page1 = response.reply('2')
-        call_credit_text = self.process_response_more(balance_page1)
-
-        balance = re.search('\$(.*?)\s', call_credit_text)
+        balance = self.search_pages(balance_page1, '\$(.*?)\s')
         if balance:
             return float(balance.groups()[0])
 
-    def creditme2u(self, phone_number, amount):
+    def creditme2u(self, phone_number, amount, response=None):
         """ Performs the Credit Me2U action for your service.
 
         :param phone_number: String-based phone number that you want to send
@@ -180,34 +318,21 @@ class Prepaid(TelstraAccount):
             writing, only whole-dollar amounts between $1 and $10 are
             supported, up to a maximum of $10 in total per day. Enter this
             value as either an integer or string equivalent.
+        :param response: USSD response already at the CreditMe2U phone
+            number prompt, such as from a
+            :class:`telstra.mobile.session.MenuSession`.  By default, the
+            prompt is navigated to.
         :returns: Successful USSD message string indicating actions taken.
 
         This method attempts to detect the CreditMe2U functionality.
         """
-        amount = int(str(amount).replace('$', ''))
-        if amount < 1 or amount > 10:
-            raise ValueError("Could not parse the amount specified.")
-        amount = str(amount)
-
-        response = self.main_menu()
-        menu = self.parse_menu(response)
+        amount = parse_amount(amount)
 
-        # Try accessing the Recharge section
-        option = menu.get('Recharge')
-        if not option:
-            raise ValueError('Could not detect Recharge as being available.')
+        # Jump to the Recharge > CreditMe2U prompt
+        if response is None:
+            response = self.navigate(['Recharge', CREDITME2U_LABELS])
 
-        # Traverse to Recharge option
-        response = response.reply(option)
-        menu = self.parse_menu(response)
-
-        option = menu.get('CreditMe2U',
-                          menu.get('CredMe2U',
-                                   menu.get('Credit Me2U')))
-        if not option:
-            raise ValueError('Could not detect Credit Me2U functionality.')
-
-        confirmation = response.reply(option).reply(phone_number).reply(amount)
+        confirmation = response.reply(phone_number).reply(amount)
         if str(phone_number) in confirmation.message and \
                 '$%s' % amount in confirmation.message:
             response = confirmation.reply('1')
@@ -221,6 +346,7 @@ class Prepaid(TelstraAccount):
             except CommandError:
                 pass
             raise ValueError("Did not receive CreditMe2U confirmation correctly.")
+        self.invalidate_snapshot()
         return response
 
 
@@ -236,11 +362,33 @@ def check_phone_number(modem, phone_number):
     return account.phone_number == phone_number
 
 
-def autodetect_account(phone_number=None, pin=None, check=None):
+def account_for_modem(modem, pin=None, prepaid=None):
+    """ Wrap a connected modem in the correct Telstra account type.
+
+    :param modem: Connected modem instance.
+    :param pin: The security PIN for the SIM, if required.
+    :param prepaid: Known account type, if any.  When ``None``, the type is
+        determined by dialling ``#125#``.
+    :returns: Instance of :class:`Prepaid` or :class:`Postpaid`.
+    """
+    if prepaid is None:
+        try:
+            prepaid = TelstraAccount(modem, pin=pin).is_prepaid
+        except TimeoutException:
+            prepaid = True
+    return Prepaid(modem, pin=pin) if prepaid else Postpaid(modem, pin=pin)
+
+
+def autodetect_account(phone_number=None, pin=None, check=None, workers=None,
+                       cache=None):
     """ Autodetect a suitable Telstra account on a cellular modem.
 
     :param phone_number: The phone number of the SIM to detect in the system.
     :param pin: The security PIN for the SIM, if required.
+    :param workers: Number of serial ports to probe concurrently.  See
+        :func:`telstra.mobile.modem.autodetect_modem`.
+    :param cache: Optional :class:`telstra.mobile.discovery.DiscoveryCache`
+        used to remember which port holds the SIM for ``phone_number``.
     :returns: Instance of :class:`Prepaid` or :class:`Postpaid`, depending
               on detected account type.
 
@@ -249,6 +397,12 @@ def autodetect_account(phone_number=None, pin=None, check=None):
     given ``phone_number`` parameter to the SIM's registered phone number
     (determined by ``#150#``).
 
+    If a ``cache`` is given and holds a fresh entry for ``phone_number``,
+    only the cached port is tried first, and the SIM is confirmed by its
+    IMSI rather than over USSD.  A full scan is only made when the cache
+    misses or the cached port no longer holds the expected SIM; its result
+    is then written back to the cache.
+
     Once the correct device and account have been detected, this method
     also coerces the account into the correct type -- Prepaid or Postpaid --
     depending on the outcome of dialling ``#125#``. Post-paid mobile
@@ -257,18 +411,83 @@ def autodetect_account(phone_number=None, pin=None, check=None):
     The final account is returned and is ready for interaction with the
     network.
     """
+    use_cache = cache is not None and phone_number and not check
+
+    if use_cache:
+        entry = cache.get(phone_number)
+        if entry:
+            modem = autodetect_modem(
+                pin=pin, ports=[entry['port']],
+                check_fn=lambda modem: check_imsi(modem, entry['imsi']))
+            if modem:
+                log.debug('Found %s on cached port %s' % (phone_number,
+                                                          entry['port']))
+                account = account_for_modem(modem, pin=pin,
+                                            prepaid=entry.get('prepaid'))
+                account.phone_number = phone_number
+                return account
+            log.info('Cached port for %s is stale; rescanning.' %
+                     phone_number)
+            cache.remove(phone_number)
+
     if phone_number and not check:
         # Simple equality check on phone number
         check = lambda modem: check_phone_number(modem, phone_number)
 
-    modem = autodetect_modem(pin=pin, check_fn=check)
+    modem = autodetect_modem(pin=pin, check_fn=check, workers=workers)
     if modem:
-        account = TelstraAccount(modem, pin=pin)
+        account = account_for_modem(modem, pin=pin)
+        if use_cache:
+            imsi = read_imsi(modem)
+            if imsi:
+                cache.set(phone_number, modem.port, imsi,
+                          prepaid=isinstance(account, Prepaid))
+        return account
+
+
+def autodetect_accounts(phone_numbers=None, pin=None, workers=None):
+    """ Autodetect every Telstra account on the system's cellular modems.
+
+    :param phone_numbers: Phone numbers of the SIMs to detect.  If given,
+        modems holding any other SIM are closed and left out of the result.
+    :param pin: The security PIN for the SIMs, if required.
+    :param workers: Number of serial ports to probe, and of modems to
+        identify, concurrently.
+    :returns: List of :class:`Prepaid` or :class:`Postpaid` instances, in
+        port order, each with its ``phone_number`` already determined.
+        Modems whose account cannot be identified are closed and left out.
+    :rtype: list
+    """
+    def identify(modem):
         try:
-            if account.is_prepaid:
-                return Prepaid(modem, pin=pin)
-            else: 
-                return Postpaid(modem, pin=pin)
-        except TimeoutException:
-            return Prepaid(modem, pin=pin)
-            
+            account = account_for_modem(modem, pin=pin)
+            account.phone_number
+            return account
+        except Exception as exc:
+            # One unresponsive SIM should not cost every other account
+            log.warning('Failed to identify account at %s: %s' %
+                        (modem.port, exc))
+            modem.close()
+
+    modems = autodetect_modems(pin=pin, workers=workers)
+    if workers and workers > 1 and len(modems) > 1:
+        executor = ThreadPoolExecutor(max_workers=min(workers, len(modems)))
+        try:
+            identified = list(executor.map(identify, modems))
+        finally:
+            executor.shutdown()
+    else:
+        identified = [identify(modem) for modem in modems]
+
+    accounts = []
+    for account in identified:
+        if account is None:
+            continue
+        modem = account.modem
+        if phone_numbers and account.phone_number not in phone_numbers:
+            log.debug('Ignoring %s at %s' % (account.phone_number,
+                                            modem.port))
+            account.close()
+        else:
+            accounts.append(account)
+    return accounts
@@ -0,0 +1,454 @@
+""" asyncio variants of the modem, account and autodetection APIs.
+
+These allow a single event loop to drive many modems at once, rather than
+needing a thread per modem.  The modem speaks AT commands directly over a
+non-blocking serial transport provided by ``pyserial-asyncio``; install
+``telstra.mobile[async]`` to use it.
+"""
+import asyncio
+import logging
+import re
+
+from gsmmodem.exceptions import CommandError, TimeoutException
+from serial import SerialException
+
+from telstra.mobile.account import AccountSnapshot, TelstraAccount, \
+    CREDITME2U_LABELS, find_option, parse_amount, parse_identity
+from telstra.mobile.parse import is_identity
+from telstra.mobile.config import IDENTITY_TIMEOUT, SNAPSHOT_MAX_AGE
+from telstra.mobile.modem import enumerate_serial
+
+try:
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+log = logging.getLogger(__name__)
+
+CUSD_REGEX = re.compile(r'^\+CUSD:\s*(\d)(?:,"(.*)",(\d+))?$', re.DOTALL)
+FINAL_RESPONSES = ('OK', 'ERROR')
+ERROR_PREFIXES = ('+CME ERROR', '+CMS ERROR')
+
+
+async def open_serial_connection(port, **options):
+    """ Open ``port`` as an asyncio stream reader and writer pair.
+    """
+    if serial_asyncio is None:
+        raise ImportError('pyserial-asyncio is required for asyncio modem '
+                          'support.')
+    return await serial_asyncio.open_serial_connection(url=port, **options)
+
+
+class AsyncUssd(object):
+    """ USSD message and session, mirroring :class:`gsmmodem.modem.Ussd`.
+    """
+
+    def __init__(self, modem, session_active, message):
+        self.modem = modem
+        self.sessionActive = session_active
+        self.message = message
+
+    async def reply(self, message):
+        """ Reply within this USSD session.
+
+        :rtype: :class:`AsyncUssd`
+        """
+        if not self.sessionActive:
+            raise CommandError('USSD session is inactive')
+        return await self.modem.sendUssd(message)
+
+    async def cancel(self):
+        """ Cancel this USSD session, if it is still active.
+        """
+        if self.sessionActive:
+            await self.modem.write('AT+CUSD=2')
+            self.sessionActive = False
+
+
+class AsyncModem(object):
+    """ Minimal GSM modem speaking AT commands over an asyncio transport.
+
+    Only the features needed by the Telstra accounts are supported: SIM
+    unlocking and USSD sessions.
+    """
+
+    open_connection = staticmethod(open_serial_connection)
+
+    def __init__(self, port, **options):
+        """ Initialise the modem.
+
+        :param port: Serial port the modem is attached to.
+        :param options: Keyword arguments for the serial connection, such
+            as ``baudrate``.
+        """
+        self.port = port
+        self.options = options
+        self.reader = None
+        self.writer = None
+        self._lock = asyncio.Lock()
+        self._reader_task = None
+        self._response = None
+        self._response_future = None
+        self._cusd_lines = None
+        self._ussd_future = None
+
+    async def connect(self, pin=None, timeout=10):
+        """ Open the serial port and initialise the modem.
+
+        :param pin: Security PIN to unlock the SIM, if required.
+        """
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                self.open_connection(self.port, **self.options), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutException()
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+
+        await self.write('ATZ', timeout=timeout)
+        await self.write('ATE0', timeout=timeout)
+        await self.write('AT+CMEE=1', timeout=timeout)
+        status = await self.write('AT+CPIN?', timeout=timeout)
+        if any('SIM PIN' in line for line in status):
+            if not pin:
+                raise CommandError('AT+CPIN?', 'CME', 11)
+            await self.write('AT+CPIN="%s"' % pin, timeout=timeout)
+
+    async def close(self):
+        """ Stop reading from and close the serial port.
+        """
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    async def _read_loop(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            self._handle_line(line.decode('utf-8', 'replace').rstrip('\r\n'))
+
+    def _handle_line(self, line):
+        if self._cusd_lines is not None or line.startswith('+CUSD:'):
+            self._cusd_lines = (self._cusd_lines or []) + [line]
+            match = CUSD_REGEX.match('\r\n'.join(self._cusd_lines))
+            if match:
+                self._cusd_lines = None
+                self._handle_cusd(match)
+        elif not line:
+            return
+        elif self._response is not None:
+            self._response.append(line)
+            if line in FINAL_RESPONSES or line.startswith(ERROR_PREFIXES):
+                lines, self._response = self._response, None
+                if not self._response_future.done():
+                    self._response_future.set_result(lines)
+        else:
+            log.debug('Unsolicited line from %s: %s' % (self.port, line))
+
+    def _handle_cusd(self, match):
+        status, message, _ = match.groups()
+        future = self._ussd_future
+        if future is None or future.done():
+            log.debug('Unexpected USSD from %s: %s' % (self.port, message))
+            return
+        if message is None:
+            future.set_exception(CommandError('USSD session terminated'))
+        else:
+            future.set_result(AsyncUssd(self, status == '1', message))
+
+    async def write(self, command, timeout=10):
+        """ Write an AT command and wait for its final result.
+
+        :returns: Response lines, including the final result code.
+        :rtype: list
+        """
+        async with self._lock:
+            future = asyncio.get_running_loop().create_future()
+            self._response = []
+            self._response_future = future
+            self.writer.write((command + '\r').encode('utf-8'))
+            try:
+                await self.writer.drain()
+                lines = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutException()
+            finally:
+                self._response = None
+
+        if lines[-1] != 'OK':
+            raise CommandError(command)
+        return lines
+
+    async def sendUssd(self, ussd_string, response_timeout=15):
+        """ Send a USSD string and wait for the network's response.
+
+        :rtype: :class:`AsyncUssd`
+        """
+        self._ussd_future = asyncio.get_running_loop().create_future()
+        try:
+            await self.write('AT+CUSD=1,"%s",15' % ussd_string,
+                             timeout=response_timeout)
+            return await asyncio.wait_for(self._ussd_future, response_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutException()
+        finally:
+            self._ussd_future = None
+
+
+class AsyncTelstraAccount(object):
+    """ asyncio counterpart of :class:`telstra.mobile.account.TelstraAccount`.
+
+    Network lookups are coroutine methods; results for the phone number,
+    account number and account type are remembered after the first call.
+    """
+
+    parse_menu = TelstraAccount.parse_menu
+
+    def __init__(self, modem, pin=None, snapshot_max_age=SNAPSHOT_MAX_AGE):
+        """ Initialise Telstra account with an asyncio modem interface.
+
+        :param modem: Instance of :class:`AsyncModem`
+        :param snapshot_max_age: Seconds a main menu snapshot may be reused.
+        """
+        self.modem = modem
+        self.pin = pin
+        self.snapshot_max_age = snapshot_max_age
+        self._snapshot = None
+        self._identity = None
+        self._is_prepaid = None
+
+    async def close(self):
+        """ Close the underlying modem interface.
+        """
+        await self.modem.close()
+
+    async def main_menu(self):
+        """ Load a USSD session to the main #100# menu.
+        """
+        return await self.modem.sendUssd('#100#')
+
+    async def snapshot(self, max_age=None, refresh=False):
+        """ Obtain a main menu snapshot, dialling ``#100#`` only if needed.
+
+        See :meth:`telstra.mobile.account.TelstraAccount.snapshot`.
+        """
+        if max_age is None:
+            max_age = self.snapshot_max_age
+        if refresh or self._snapshot is None or \
+                self._snapshot.age >= max_age:
+            response = await self.main_menu()
+            await response.cancel()
+            self._snapshot = AccountSnapshot(response.message)
+        return self._snapshot
+
+    def invalidate_snapshot(self):
+        """ Discard any main menu snapshot, so the next read dials again.
+        """
+        self._snapshot = None
+
+    async def main_menu_parsed(self, refresh=False):
+        """ Load and parse the main menu into a numerically-keyed structure.
+
+        :rtype: dict
+        """
+        return dict((await self.snapshot(refresh=refresh)).menu)
+
+    async def identity(self, timeout=IDENTITY_TIMEOUT, interval=1):
+        """ Determine the phone and account numbers with one ``#150#`` dial.
+
+        See :meth:`telstra.mobile.account.TelstraAccount.identity`.
+        """
+        if self._identity is None:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while True:
+                response = await self.modem.sendUssd('#150#')
+                if is_identity(response.message):
+                    break
+                if loop.time() + interval > deadline:
+                    raise TimeoutException(
+                        'No identity from #150#: %r' % response.message)
+                await response.cancel()
+                await asyncio.sleep(interval)
+                interval *= 2
+            self._identity = parse_identity(response.message)
+        return self._identity
+
+    async def phone_number(self):
+        """ Determine the phone number for the given service.
+
+        :rtype: str
+        """
+        return (await self.identity())[0]
+
+    async def account_number(self):
+        """ Determine the Telstra account number for the service.
+
+        :rtype: str
+        """
+        return (await self.identity())[1]
+
+    async def is_prepaid(self):
+        """ Determine if the given service is pre- or post-paid.
+
+        :rtype: bool
+        """
+        if self._is_prepaid is None:
+            response = await self.modem.sendUssd('#125#')
+            await response.cancel()
+            self._is_prepaid = 'Bal:' in response.message and \
+                'Exp:' in response.message
+        return self._is_prepaid
+
+
+class AsyncPostpaid(AsyncTelstraAccount):
+    """ asyncio counterpart of :class:`telstra.mobile.account.Postpaid`.
+    """
+    pass
+
+
+class AsyncPrepaid(AsyncTelstraAccount):
+    """ asyncio counterpart of :class:`telstra.mobile.account.Prepaid`.
+    """
+
+    async def balance(self):
+        return (await self.snapshot()).balance
+
+    async def expiry_date(self):
+        return (await self.snapshot()).expiry_date
+
+    async def creditme2u(self, phone_number, amount):
+        """ Performs the Credit Me2U action for your service.
+
+        See :meth:`telstra.mobile.account.Prepaid.creditme2u`.
+        """
+        amount = parse_amount(amount)
+
+        response = await self.main_menu()
+        option = self.parse_menu(response).get('Recharge')
+        if not option:
+            raise ValueError('Could not detect Recharge as being available.')
+
+        response = await response.reply(option)
+        option = find_option(self.parse_menu(response), CREDITME2U_LABELS)
+        if not option:
+            raise ValueError('Could not detect Credit Me2U functionality.')
+
+        response = await response.reply(option)
+        response = await response.reply(phone_number)
+        confirmation = await response.reply(amount)
+        if str(phone_number) in confirmation.message and \
+                '$%s' % amount in confirmation.message:
+            self.invalidate_snapshot()
+            return await confirmation.reply('1')
+        elif 'Insufficient credit' in confirmation.message:
+            raise ValueError("Insufficient credit account to send credit.")
+        elif 'transfer limit' in confirmation.message:
+            raise ValueError(confirmation.message)
+        else:
+            try:
+                await confirmation.cancel()
+            except CommandError:
+                pass
+            raise ValueError("Did not receive CreditMe2U confirmation correctly.")
+
+
+async def probe_port(port, pin=None, check_fn=None,
+                     modem_options={'baudrate': 9600}):
+    """ Attempt to connect to and check a single modem port.
+
+    ``check_fn``, if given, is a coroutine function taking the modem.
+
+    :returns: Connected :class:`AsyncModem`, or ``None``.
+    """
+    modem = AsyncModem(port, **modem_options)
+    try:
+        log.debug('Attempting to connect to modem at %s' % port)
+        await modem.connect(pin=pin)
+        if not check_fn or await check_fn(modem):
+            log.debug('Successfully detected modem at %s' % port)
+            return modem
+    except (SerialException, OSError):
+        log.warning('Serial communication problem for port %s' % port)
+    except TimeoutException:
+        log.warning('Timeout detected on port %s' % port)
+    except CommandError as exc:
+        log.warning('Command error on port %s: %s' % (port, exc))
+    except asyncio.CancelledError:
+        await modem.close()
+        raise
+
+    log.debug('Closing modem at %s' % port)
+    await modem.close()
+
+
+async def autodetect_modem(pin=None, check_fn=None,
+                           modem_options={'baudrate': 9600}, ports=None,
+                           concurrency=None):
+    """ Autodetect a suitable cellular modem, probing ports concurrently.
+
+    :param concurrency: Maximum number of ports probed at once; all ports
+        are probed together if ``None``.
+
+    Otherwise as per :func:`telstra.mobile.modem.autodetect_modem`: the
+    first suitable modem in port order is returned, and the remaining
+    probes are cancelled and their modems closed.
+    """
+    if ports is None:
+        ports = enumerate_serial()
+    if not ports:
+        log.error('No modem ports detected on system.')
+        return
+
+    semaphore = asyncio.Semaphore(concurrency or len(ports))
+
+    async def bounded_probe(port):
+        async with semaphore:
+            return await probe_port(port, pin=pin, check_fn=check_fn,
+                                    modem_options=modem_options)
+
+    tasks = [asyncio.ensure_future(bounded_probe(port)) for port in ports]
+    modem = None
+    try:
+        for task in tasks:
+            modem = await task
+            if modem:
+                return modem
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None \
+                    and task.result() and task.result() is not modem:
+                await task.result().close()
+
+
+async def account_for_modem(modem, pin=None):
+    """ Wrap a connected modem in the correct asyncio account type.
+    """
+    try:
+        prepaid = await AsyncTelstraAccount(modem, pin=pin).is_prepaid()
+    except TimeoutException:
+        prepaid = True
+    cls = AsyncPrepaid if prepaid else AsyncPostpaid
+    return cls(modem, pin=pin)
+
+
+async def autodetect_account(phone_number=None, pin=None, check=None,
+                             concurrency=None):
+    """ Autodetect a suitable Telstra account on a cellular modem.
+
+    asyncio counterpart of :func:`telstra.mobile.account.autodetect_account`.
+    """
+    if phone_number and not check:
+        async def check(modem):
+            account = AsyncTelstraAccount(modem)
+            return await account.phone_number() == phone_number
+
+    modem = await autodetect_modem(pin=pin, check_fn=check,
+                                   concurrency=concurrency)
+    if modem:
+        return await account_for_modem(modem, pin=pin)
@@ -0,0 +1,382 @@
+""" asyncio variant of the web API, for polling many logins at once.
+
+An :class:`AsyncWebPool` shares one pool of HTTP connections between any
+number of :class:`AsyncTelstraWebApi` logins, each with its own cookies,
+and limits how many requests are made to each host at once.  Logins and
+credit summary fetches for every account then run concurrently on a
+single event loop::
+
+    async with AsyncWebPool() as pool:
+        async for result in pool.fetch_summaries(credentials):
+            print(result['username'], result['balance'])
+
+Requires ``aiohttp``; install ``telstra.mobile[async]`` to use it.
+"""
+import asyncio
+from collections import OrderedDict
+import codecs
+import ipaddress
+import logging
+import time
+from urllib.parse import urlsplit
+
+from telstra.mobile.config import WEB_CACHE_TTL, WEB_CONCURRENCY_PER_HOST
+from telstra.mobile.poll import POLL_FIELDS
+from telstra.mobile.scrape import PukParser
+from telstra.mobile.web import CONTACT_DETAILS_URL, CREDIT_SUMMARY_URL, \
+    LOGIN_URL, LOGOUT_URL, PLAN_DETAILS_URL, SERVICES_URL, SIGNON_URL, \
+    STREAM_CHUNK_SIZE, PrepaidSummary, ServiceListError, login_form, \
+    normalise_phone_number
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+log = logging.getLogger(__name__)
+
+LOCAL_SUFFIXES = ('.localhost', '.local', '.test')
+
+
+def is_local_origin(origin):
+    """ Whether ``origin`` is a loopback, private or test host, rather
+    than one of Telstra's.
+    """
+    host = urlsplit(origin).hostname or ''
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return host == 'localhost' or host.endswith(LOCAL_SUFFIXES)
+    return address.is_loopback or address.is_private
+
+
+class AsyncTelstraWebApi(object):
+    """ asyncio counterpart of :class:`telstra.mobile.web.TelstraWebApi`.
+
+    Obtain instances from :meth:`AsyncWebPool.api` so they share the
+    pool's connections.  The first request logs in, and an expired session
+    is logged in again once.
+    """
+
+    def __init__(self, username, password, session, origins=None,
+                 cache_ttl=WEB_CACHE_TTL):
+        """ Initialise the API without logging in.
+
+        :param session: ``aiohttp.ClientSession`` holding this login's
+            cookies.
+        :param origins: Mapping of Telstra origins, such as
+            ``https://www.my.telstra.com.au``, to replacements, for use
+            with a proxy or local server.
+        :param cache_ttl: Seconds to reuse a JSON response for.  ``0``
+            disables caching.
+        """
+        self.username = username
+        self.password = password
+        self.session = session
+        self.origins = origins or {}
+        self.cache_ttl = cache_ttl
+        self.logged_in = False
+        self.index = {}
+        self._service_ids = {}
+        self._cache = {}
+        self._login_lock = asyncio.Lock()
+
+    def _url(self, url):
+        for origin, replacement in self.origins.items():
+            if url.startswith(origin):
+                return replacement + url[len(origin):]
+        return url
+
+    async def login(self):
+        """ Log in to Telstra's web services.
+        """
+        async with self.session.get(self._url(LOGIN_URL)) as response:
+            response.raise_for_status()
+        async with self.session.post(
+                self._url(SIGNON_URL),
+                data=login_form(self.username, self.password)) as response:
+            response.raise_for_status()
+        self.logged_in = True
+
+    async def logout(self):
+        async with self.session.get(self._url(LOGOUT_URL)):
+            pass
+        self.logged_in = False
+        self.invalidate()
+
+    def invalidate(self, url=None):
+        """ Discard the cached response for ``url``, or all of them.
+        """
+        if url is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(url, None)
+
+    async def _ensure_logged_in(self):
+        async with self._login_lock:
+            if not self.logged_in:
+                await self.login()
+                return True
+        return False
+
+    async def _get_json(self, url):
+        retry = not await self._ensure_logged_in()
+        while True:
+            async with self.session.get(self._url(url)) as response:
+                content_type = response.headers.get('content-type') or ''
+                if str(response.url) == self._url(url) and \
+                        'json' in content_type:
+                    return await response.json(content_type=None)
+            if not retry:
+                break
+            # A redirect or HTML page means the session has expired
+            log.info('Web session for %s expired; logging in again.' %
+                     self.username)
+            retry = False
+            self.logged_in = False
+            await self._ensure_logged_in()
+        log.critical('Could not retrieve service metadata. '
+                     'Content type is %s.' % content_type)
+        return {}
+
+    async def _get_cached_json(self, url, refresh=False):
+        cached = self._cache.get(url)
+        if cached and not refresh and time.time() - cached[0] < self.cache_ttl:
+            return cached
+        timestamp = time.time()
+        data = await self._get_json(url)
+        if data and self.cache_ttl:
+            self._cache[url] = (timestamp, data)
+        return timestamp, data
+
+    async def services(self, refresh=False):
+        """ List the services under this login.
+
+        See :meth:`telstra.mobile.web.TelstraWebApi.services`.
+        """
+        data = (await self._get_cached_json(SERVICES_URL, refresh=refresh))[1]
+        if isinstance(data, dict):
+            data = data.get('result') or []
+        return [{'phone_number': normalise_phone_number(
+                     service.get('serviceNumber')),
+                 'service_id': service.get('serviceId'),
+                 'type': service.get('serviceType')}
+                for service in data]
+
+    async def _service_summary(self, service_id, refresh=False):
+        timestamp, data = await self._get_cached_json(
+            '%s?serviceId=%s' % (CREDIT_SUMMARY_URL, service_id),
+            refresh=refresh)
+        return PrepaidSummary(data, timestamp)
+
+    async def prepaid_summaries(self, refresh=False):
+        """ Fetch the credit summary of every service under this login at
+        once.
+
+        See :meth:`telstra.mobile.web.TelstraWebApi.prepaid_summaries`.
+
+        :returns: Mapping of phone numbers to
+            :class:`telstra.mobile.web.PrepaidSummary`.
+        :rtype: collections.OrderedDict
+        """
+        services = await self.services(refresh=refresh)
+        results = await asyncio.gather(*[
+            self._service_summary(service['service_id'], refresh=refresh)
+            for service in services])
+        summaries = OrderedDict(
+            (service['phone_number'], summary)
+            for service, summary in zip(services, results))
+        self._service_ids = dict(
+            (service['phone_number'], service['service_id'])
+            for service in services)
+        self.index = dict((phone_number, summary)
+                          for phone_number, summary in summaries.items()
+                          if summary.data)
+        return summaries
+
+    async def prepaid_summary(self, phone_number=None, refresh=False):
+        """ Obtain the balance, expiry, offer and bonus packs together.
+
+        :param phone_number: Service to summarise, in any format.  The
+            login's default service is used if ``None``.
+        :param refresh: Fetch a new summary even if one is cached.
+        :rtype: :class:`telstra.mobile.web.PrepaidSummary`
+        """
+        if phone_number is None:
+            timestamp, data = await self._get_cached_json(CREDIT_SUMMARY_URL,
+                                                          refresh=refresh)
+            return PrepaidSummary(data, timestamp)
+
+        phone_number = normalise_phone_number(phone_number)
+        summary = self.index.get(phone_number)
+        if summary is not None and not refresh and \
+                summary.age < self.cache_ttl:
+            return summary
+        if phone_number not in self._service_ids:
+            # Unknown or new number: list and fetch every service at once
+            summary = (await self.prepaid_summaries()).get(phone_number)
+            if summary is not None and not refresh:
+                return summary
+        service_id = self._service_ids.get(phone_number)
+        if not self._service_ids:
+            log.error('Could not list the services under this login.')
+            return PrepaidSummary({})
+        elif service_id is None:
+            log.warning('No service %s under this login.' % phone_number)
+            return PrepaidSummary({})
+        summary = await self._service_summary(service_id, refresh=refresh)
+        if summary.data:
+            self.index[phone_number] = summary
+        return summary
+
+    async def prepaid_expiry(self, phone_number=None):
+        return (await self.prepaid_summary(phone_number)).expiry_date
+
+    async def prepaid_balance(self, phone_number=None):
+        return (await self.prepaid_summary(phone_number)).balance
+
+    async def prepaid_offer(self, phone_number=None):
+        return (await self.prepaid_summary(phone_number)).offer
+
+    async def prepaid_bonuspacks(self, phone_number=None):
+        return (await self.prepaid_summary(phone_number)).bonuspacks
+
+    async def contact_details(self):
+        """ Obtains account holder contact details on file.
+        """
+        return await self._get_json(CONTACT_DETAILS_URL)
+
+    async def _service_id(self, phone_number):
+        phone_number = normalise_phone_number(phone_number)
+        if phone_number not in self._service_ids:
+            services = await self.services()
+            if not services:
+                raise ServiceListError(
+                    'Could not list the services under this login.')
+            self._service_ids = dict(
+                (service['phone_number'], service['service_id'])
+                for service in services)
+        return self._service_ids.get(phone_number)
+
+    async def prepaid_puk(self, phone_number=None):
+        """ Get the PUK for the given account via scraping HTML.
+
+        See :meth:`telstra.mobile.web.TelstraWebApi.prepaid_puk`.
+        """
+        url = PLAN_DETAILS_URL
+        if phone_number is not None:
+            service_id = await self._service_id(phone_number)
+            if service_id is None:
+                log.warning('No service %s under this login.' % phone_number)
+                return None
+            url += '?serviceId=%s' % service_id
+        await self._ensure_logged_in()
+        parser = PukParser()
+        async with self.session.get(self._url(url)) as response:
+            decoder = codecs.getincrementaldecoder(
+                response.charset or 'utf-8')('replace')
+            async for chunk in response.content.iter_chunked(
+                    STREAM_CHUNK_SIZE):
+                parser.feed(decoder.decode(chunk))
+                if parser.puk is not None:
+                    break
+        return parser.puk
+
+
+async def fetch_summary(api, fields=POLL_FIELDS):
+    """ Log in if needed and read ``fields`` from the credit summary.
+
+    :returns: Structure with ``username``, ``summary``, ``elapsed`` and
+        ``error`` keys, plus one key per field, as per
+        :func:`telstra.mobile.poll.poll_account`.
+    :rtype: dict
+    """
+    result = {'username': api.username, 'summary': None, 'error': None}
+    start = time.time()
+    try:
+        summary = await api.prepaid_summary()
+        if not summary.data:
+            raise ValueError('Credit summary is unavailable.')
+        result['summary'] = summary
+        for field in fields:
+            result[field] = getattr(summary, field, None)
+    except Exception as exc:
+        log.warning('Failed to fetch summary for %s: %s' % (api.username,
+                                                          exc))
+        result['error'] = str(exc) or type(exc).__name__
+        for field in fields:
+            result.setdefault(field, None)
+    result['elapsed'] = time.time() - start
+    return result
+
+
+class AsyncWebPool(object):
+    """ Shared, per-host limited connection pool for many web logins.
+
+    Create and use the pool within a running event loop.
+    """
+
+    def __init__(self, limit_per_host=WEB_CONCURRENCY_PER_HOST, origins=None,
+                 cache_ttl=WEB_CACHE_TTL):
+        """ Initialise the pool.
+
+        :param limit_per_host: Maximum concurrent connections to each host,
+            across every login.
+        :param origins: Replacement origins passed to each
+            :class:`AsyncTelstraWebApi`.
+        :param cache_ttl: Seconds each login reuses a JSON response for.
+        """
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for the asyncio web API.')
+        self.origins = origins
+        self.cache_ttl = cache_ttl
+        self.connector = aiohttp.TCPConnector(limit_per_host=limit_per_host)
+        self._sessions = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def api(self, username, password):
+        """ Create a login sharing this pool's connections.
+
+        :rtype: :class:`AsyncTelstraWebApi`
+        """
+        # Each login keeps its own cookies.  Only a local server, which
+        # may be addressed by IP, needs a jar accepting cookies from IPs.
+        unsafe = any(is_local_origin(replacement)
+                     for replacement in (self.origins or {}).values())
+        session = aiohttp.ClientSession(
+            connector=self.connector, connector_owner=False,
+            cookie_jar=aiohttp.CookieJar(unsafe=unsafe))
+        self._sessions.append(session)
+        return AsyncTelstraWebApi(username, password, session,
+                                  origins=self.origins,
+                                  cache_ttl=self.cache_ttl)
+
+    async def fetch_summaries(self, credentials, fields=POLL_FIELDS):
+        """ Log in and fetch credit summaries for many accounts at once.
+
+        :param credentials: ``(username, password)`` pairs, or
+            :class:`AsyncTelstraWebApi` instances from :meth:`api`.
+        :returns: Async generator of structures from :func:`fetch_summary`,
+            in order of completion.
+        """
+        apis = [credential if isinstance(credential, AsyncTelstraWebApi)
+                else self.api(*credential) for credential in credentials]
+        tasks = [asyncio.ensure_future(fetch_summary(api, fields))
+                 for api in apis]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def close(self):
+        for session in self._sessions:
+            await session.close()
+        del self._sessions[:]
+        await self.connector.close()
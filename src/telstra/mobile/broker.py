@@ -0,0 +1,333 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from datetime import datetime
+
+from telstra.mobile.config import BROKER_SOCKET_PATH
+from telstra.mobile.refresh import SnapshotRefresher
+
+log = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class BrokerError(Exception):
+    """ The broker could not complete a request.
+    """
+
+
+def check_socket_owner(path):
+    """ Check that the socket at ``path`` belongs to the current user.
+
+    :raises BrokerError: If another user owns it, and so could answer
+        requests in place of a genuine broker.
+    """
+    if hasattr(os, 'getuid') and os.lstat(path).st_uid != os.getuid():
+        raise BrokerError('Broker socket %s is owned by another user.' %
+                          path)
+
+
+class ModemBroker(object):
+    """ Keep Telstra accounts connected and serve requests against them.
+
+    Each account's modem stays connected for the life of the broker, so a
+    request only costs the USSD round trips for the operation itself.
+    Requests for the same account are serialised, as a modem can only hold
+    one USSD session at a time; different accounts are served in parallel.
+
+    Requests and responses are single lines of JSON.  A request names an
+    ``op`` and, optionally, the ``phone_number`` of the account to use::
+
+        {"op": "balance", "phone_number": "0412345678"}
+
+    and is answered with either ``{"result": ...}`` or
+    ``{"error": "...", "type": "ValueError"}``.
+
+    The ``snapshot`` operation answers from each account's last main menu
+    snapshot without waiting for the modem, refreshing it in the
+    background when older than the ``max_age`` requested.
+    """
+
+    #: Operations answered without waiting for the account's modem.
+    UNLOCKED_OPS = ('accounts', 'snapshot')
+
+    def __init__(self, accounts, refresh_interval=None):
+        """ Initialise the broker.
+
+        :param accounts: Connected :class:`telstra.mobile.account.TelstraAccount`
+            instances to serve.
+        :param refresh_interval: Seconds between background refreshes of
+            each account's snapshot while serving.  ``None`` only refreshes
+            snapshots on demand.
+        """
+        self.accounts = []
+        self._by_number = {}
+        self._locks = {}
+        for account in accounts:
+            self.accounts.append(account)
+            self._by_number[account.phone_number] = account
+            self._locks[account.phone_number] = threading.Lock()
+        self.refresher = SnapshotRefresher(self.accounts, refresh_interval,
+                                           locks=self._locks)
+        self.server = None
+        #: Set once :meth:`serve` is accepting connections.
+        self.ready = threading.Event()
+
+    def close(self):
+        """ Stop serving and close all account modems.
+        """
+        self.refresher.stop()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for account in self.accounts:
+            account.close()
+
+    def account(self, phone_number=None):
+        """ Obtain the served account for ``phone_number``.
+
+        With no ``phone_number``, the first account is used.
+        """
+        if not self.accounts:
+            raise BrokerError('No accounts are available.')
+        if phone_number is None:
+            return self.accounts[0]
+        try:
+            return self._by_number[phone_number]
+        except KeyError:
+            raise BrokerError('No account for %s.' % phone_number)
+
+    def op_accounts(self, account):
+        return [served.phone_number for served in self.accounts]
+
+    def op_balance(self, account):
+        return account.balance
+
+    def op_expiry_date(self, account):
+        expiry = account.expiry_date
+        return expiry.strftime(DATE_FORMAT) if expiry else None
+
+    def op_identity(self, account):
+        return {'phone_number': account.phone_number,
+                'account_number': account.account_number}
+
+    def op_snapshot(self, account, max_age=None):
+        snapshot = self.refresher.get(account.phone_number, max_age)
+        expiry = snapshot.expiry_date
+        return {'balance': snapshot.balance,
+                'expiry_date': expiry.strftime(DATE_FORMAT) if expiry
+                else None,
+                'timestamp': snapshot.timestamp,
+                'age': snapshot.age,
+                'stale': max_age is not None and snapshot.age > max_age}
+
+    def op_creditme2u(self, account, to_number, amount):
+        return account.creditme2u(to_number, amount).message
+
+    def handle(self, request):
+        """ Process a single decoded request.
+
+        :param request: Request structure.
+        :type request: dict
+        :returns: Response structure.
+        :rtype: dict
+        """
+        params = dict(request)
+        op = getattr(self, 'op_%s' % params.pop('op', ''), None)
+        if op is None:
+            return {'error': 'Unknown operation %r.' % request.get('op'),
+                    'type': 'BrokerError'}
+
+        try:
+            account = self.account(params.pop('phone_number', None))
+            if request.get('op') in self.UNLOCKED_OPS:
+                return {'result': op(account, **params)}
+            with self._locks[account.phone_number]:
+                return {'result': op(account, **params)}
+        except Exception as exc:
+            log.exception('Request %r failed' % request)
+            return {'error': str(exc), 'type': type(exc).__name__}
+
+    def serve(self, path=BROKER_SOCKET_PATH):
+        """ Serve requests on a Unix-domain socket until :meth:`close`.
+
+        The socket is only accessible to the current user.  A socket left
+        at ``path`` by a broker that has since exited is replaced.
+
+        :raises BrokerError: If another broker is listening at ``path``,
+            or another user owns the socket there.
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if os.path.lexists(path):
+            check_socket_owner(path)
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except socket.error:
+                log.info('Removing stale broker socket %s' % path)
+                try:
+                    os.unlink(path)
+                except OSError as exc:
+                    raise BrokerError('Could not remove stale socket %s: %s'
+                                      % (path, exc))
+            else:
+                raise BrokerError('A broker is already listening at %s.' %
+                                  path)
+            finally:
+                probe.close()
+
+        broker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        response = {'error': 'Malformed request.',
+                                    'type': 'BrokerError'}
+                    else:
+                        response = broker.handle(request)
+                    self.wfile.write(json.dumps(response).encode('utf-8')
+                                     + b'\n')
+
+        # Create the socket without group or other access, rather than
+        # restricting it after others may already have connected
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(path,
+                                                                 Handler)
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+        self.refresher.start()
+        self.ready.set()
+        log.info('Broker serving %d account(s) on %s' % (len(self.accounts),
+                                                         path))
+        self.server.serve_forever()
+
+
+class BrokerClient(object):
+    """ Client for a :class:`ModemBroker` listening on a local socket.
+    """
+
+    def __init__(self, path=BROKER_SOCKET_PATH, timeout=120):
+        self.path = path
+        self.timeout = timeout
+
+    def call(self, op, **params):
+        """ Send one request to the broker and return its result.
+
+        Errors raised by the account within the broker are re-raised as
+        ``ValueError`` where that was their original type, and
+        :class:`BrokerError` otherwise.  A socket owned by another user is
+        never connected to.
+        """
+        request = dict(params, op=op)
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            if os.path.lexists(self.path):
+                check_socket_owner(self.path)
+            connection.connect(self.path)
+            connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            response = connection.makefile('rb').readline()
+        except socket.error as exc:
+            raise BrokerError('Could not reach broker at %s: %s' % (self.path,
+                                                                  exc))
+        finally:
+            connection.close()
+
+        if not response:
+            raise BrokerError('Broker closed the connection.')
+        response = json.loads(response.decode('utf-8'))
+        if 'error' in response:
+            if response.get('type') == 'ValueError':
+                raise ValueError(response['error'])
+            raise BrokerError(response['error'])
+        return response['result']
+
+    def accounts(self):
+        """ List the phone numbers served by the broker.
+        """
+        return self.call('accounts')
+
+    def account(self, phone_number=None, max_age=None):
+        """ Obtain a proxy for a served account.
+
+        :param max_age: See :class:`BrokerAccount`.
+        :rtype: :class:`BrokerAccount`
+        """
+        if phone_number is None:
+            accounts = self.accounts()
+            if not accounts:
+                raise BrokerError('Broker has no accounts.')
+            phone_number = accounts[0]
+        return BrokerAccount(self, phone_number, max_age=max_age)
+
+
+class BrokerAccount(object):
+    """ Stand-in for a :class:`telstra.mobile.account.Prepaid` account that
+    is held by a :class:`ModemBroker`.
+
+    With a ``max_age``, balance and expiry are read from the broker's
+    snapshot immediately, however old, and the broker refreshes snapshots
+    older than ``max_age`` seconds in the background.
+    """
+
+    def __init__(self, client, phone_number, max_age=None):
+        self.client = client
+        self.phone_number = phone_number
+        self.max_age = max_age
+
+    def close(self):
+        """ Nothing to close; the broker owns the modem.
+        """
+
+    def _call(self, op, **params):
+        return self.client.call(op, phone_number=self.phone_number, **params)
+
+    @property
+    def account_number(self):
+        return self._call('identity')['account_number']
+
+    def snapshot(self, max_age=None):
+        """ Read the broker's snapshot for this account.
+
+        :returns: Structure with ``balance``, ``expiry_date``,
+            ``timestamp``, ``age`` and ``stale`` keys.
+        :rtype: dict
+        """
+        snapshot = self._call('snapshot', max_age=max_age)
+        if snapshot['expiry_date']:
+            snapshot['expiry_date'] = datetime.strptime(
+                snapshot['expiry_date'], DATE_FORMAT)
+        return snapshot
+
+    @property
+    def balance(self):
+        if self.max_age is not None:
+            return self.snapshot(self.max_age)['balance']
+        return self._call('balance')
+
+    @property
+    def expiry_date(self):
+        if self.max_age is not None:
+            return self.snapshot(self.max_age)['expiry_date']
+        expiry = self._call('expiry_date')
+        return datetime.strptime(expiry, DATE_FORMAT) if expiry else None
+
+    def creditme2u(self, phone_number, amount):
+        """ Send credit via the broker.
+
+        :returns: Final USSD message from the network.
+        :rtype: str
+        """
+        return self._call('creditme2u', to_number=phone_number,
+                          amount=amount)
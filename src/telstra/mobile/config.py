@@ -1,2 +1,41 @@
+import os
 
 LOG_FORMAT = '%(asctime)s %(levelname)-5.5s [%(name)s][%(threadName)s] %(message)s'
+
+DISCOVERY_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache',
+                                    'telstra.mobile', 'discovery.json')
+DISCOVERY_CACHE_TTL = 24 * 60 * 60
+
+MENU_MAP_PATH = os.path.join(os.path.expanduser('~'), '.cache',
+                             'telstra.mobile', 'menu.json')
+
+SNAPSHOT_MAX_AGE = 30
+
+CREDITME2U_DAILY_LIMIT = 10
+
+LEDGER_PATH = os.path.join(os.path.expanduser('~'), '.cache',
+                           'telstra.mobile', 'ledger.json')
+LEDGER_BALANCE_MAX_AGE = 60 * 60
+
+STORE_PATH = os.path.join(os.path.expanduser('~'), '.local', 'share',
+                          'telstra.mobile', 'observations.sqlite')
+
+IDENTITY_TIMEOUT = 5
+
+REFRESH_INTERVAL = 5 * 60
+
+ROUTER_FAILURE_THRESHOLD = 3
+ROUTER_COOLDOWN = 60
+ROUTER_STATE_PATH = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'telstra.mobile', 'router.json')
+
+WEB_SESSION_PATH = os.path.join(os.path.expanduser('~'), '.cache',
+                                'telstra.mobile', 'web-session.json')
+WEB_CACHE_TTL = 60
+WEB_CONCURRENCY_PER_HOST = 8
+
+# A per-user directory, so other local users cannot claim the socket first
+BROKER_SOCKET_PATH = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or
+    os.path.join(os.path.expanduser('~'), '.cache', 'telstra.mobile'),
+    'telstra.mobile.sock')
@@ -0,0 +1,128 @@
+from contextlib import contextmanager
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from gsmmodem.exceptions import CommandError, TimeoutException
+
+from telstra.mobile.config import DISCOVERY_CACHE_PATH, DISCOVERY_CACHE_TTL
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+@contextmanager
+def file_lock(path):
+    """ Hold an exclusive lock on the sidecar file ``path + '.lock'``.
+
+    Other processes taking the same lock wait until it is released, so a
+    read-modify-write of ``path`` within it cannot lose their updates.
+    Without ``fcntl``, as on Windows, nothing is locked.
+    """
+    if fcntl is None:
+        yield
+        return
+    directory = os.path.dirname(path) or '.'
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class DiscoveryCache(object):
+    """ On-disk cache mapping phone numbers to the serial port of their SIM.
+
+    Each entry records the serial port, the SIM's IMSI and whether the
+    service is prepaid, along with the time it was discovered.  Entries
+    older than ``ttl`` seconds are treated as missing.
+
+    The cache is a small JSON document; writes replace the file atomically
+    so concurrent scripts never see a partially written cache, and hold a
+    lock file so they never overwrite each other's entries.
+    """
+
+    def __init__(self, path=DISCOVERY_CACHE_PATH, ttl=DISCOVERY_CACHE_TTL):
+        """ Initialise the cache.
+
+        :param path: Location of the JSON cache file.
+        :param ttl: Maximum age, in seconds, of usable entries.
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        directory = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'w') as cache_file:
+            json.dump(entries, cache_file, indent=2, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    def get(self, phone_number):
+        """ Obtain a fresh cache entry for ``phone_number``.
+
+        :returns: Entry with ``port``, ``imsi``, ``prepaid`` and
+            ``timestamp`` keys, or ``None`` if missing or stale.
+        :rtype: dict
+        """
+        entry = self._load().get(phone_number)
+        if entry and time.time() - entry.get('timestamp', 0) <= self.ttl:
+            return entry
+
+    def set(self, phone_number, port, imsi, prepaid=None):
+        """ Record the port and SIM identity discovered for ``phone_number``.
+        """
+        with self._lock, file_lock(self.path):
+            entries = self._load()
+            entries[phone_number] = {'port': port,
+                                     'imsi': imsi,
+                                     'prepaid': prepaid,
+                                     'timestamp': time.time()}
+            self._save(entries)
+
+    def remove(self, phone_number):
+        """ Forget any entry for ``phone_number``.
+        """
+        with self._lock, file_lock(self.path):
+            entries = self._load()
+            if entries.pop(phone_number, None) is not None:
+                self._save(entries)
+
+
+def read_imsi(modem):
+    """ Read the SIM's IMSI from ``modem`` without touching the network.
+
+    :returns: IMSI string, or ``None`` if the modem could not report it.
+    """
+    try:
+        return modem.imsi
+    except (CommandError, TimeoutException):
+        log.warning('Could not read IMSI from modem at %s' % modem.port)
+
+
+def check_imsi(modem, imsi):
+    """ Check that ``modem`` holds the SIM with the given ``imsi``.
+
+    :rtype: bool
+    """
+    return imsi is not None and read_imsi(modem) == imsi
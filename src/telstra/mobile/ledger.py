@@ -0,0 +1,220 @@
+""" Local ledger of CreditMe2U transfers and balances, per source number.
+
+The network only refuses a transfer that exceeds the daily limit or the
+available balance after the whole Recharge > CreditMe2U dialogue has been
+walked.  The ledger remembers what each source number has sent today and
+its last known balance, so such transfers are refused before any dial::
+
+    ledger = TransferLedger()
+    ledger.creditme2u(account, '0499888777', 5)
+
+When the network disagrees with the ledger, the ledger defers to it: a
+transfer limit message marks the day as used up, and an insufficient
+credit message caps the amounts allowed until a fresh balance is seen.
+"""
+from datetime import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from telstra.mobile.parse import parse_amount
+from telstra.mobile.config import CREDITME2U_DAILY_LIMIT, \
+    LEDGER_BALANCE_MAX_AGE, LEDGER_PATH
+from telstra.mobile.discovery import file_lock
+
+log = logging.getLogger(__name__)
+
+
+class TransferRejected(ValueError):
+    """ The ledger refused a transfer that the network would refuse.
+    """
+
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp).date().isoformat()
+
+
+class TransferLedger(object):
+    """ On-disk record of transfers and balances, keyed by source number.
+
+    Like :class:`telstra.mobile.discovery.DiscoveryCache`, the ledger is a
+    small JSON document replaced atomically on every write, under a lock
+    file shared with other processes.  Transfers from previous days are
+    pruned as entries are saved.
+    """
+
+    def __init__(self, path=LEDGER_PATH, limit=CREDITME2U_DAILY_LIMIT,
+                 balance_max_age=LEDGER_BALANCE_MAX_AGE):
+        """ Initialise the ledger.
+
+        :param path: Location of the JSON ledger file.
+        :param limit: Dollars each source may transfer per day.
+        :param balance_max_age: Seconds for which a recorded balance is
+            trusted.  Older balances are refreshed before a transfer.
+        """
+        self.path = path
+        self.limit = limit
+        self.balance_max_age = balance_max_age
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as ledger_file:
+                return json.load(ledger_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        directory = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'w') as ledger_file:
+            json.dump(entries, ledger_file, indent=2, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    def _update(self, source, fn):
+        """ Apply ``fn`` to the entry for ``source`` and save it.
+        """
+        with self._lock, file_lock(self.path):
+            entries = self._load()
+            entry = entries.setdefault(source, {})
+            today = _day(time.time())
+            entry['transfers'] = [
+                transfer for transfer in entry.get('transfers', [])
+                if _day(transfer['timestamp']) == today]
+            fn(entry)
+            self._save(entries)
+
+    def entry(self, source):
+        """ Obtain the raw ledger entry for ``source``.
+
+        :returns: Structure with optional ``balance``, ``balance_timestamp``,
+            ``transfers``, ``limit_day`` and ``insufficient`` keys.
+        :rtype: dict
+        """
+        return self._load().get(source, {})
+
+    def sent_today(self, source):
+        """ Dollars transferred from ``source`` so far today.
+
+        A day the network has declared used up counts as the full limit.
+        """
+        entry = self.entry(source)
+        today = _day(time.time())
+        if entry.get('limit_day') == today:
+            return self.limit
+        return sum(transfer['amount'] for transfer in entry.get('transfers', [])
+                   if _day(transfer['timestamp']) == today)
+
+    def balance(self, source):
+        """ Last known balance of ``source``, or ``None`` if unknown or stale.
+        """
+        entry = self.entry(source)
+        if entry.get('balance') is not None and \
+                time.time() - entry['balance_timestamp'] <= \
+                self.balance_max_age:
+            return entry['balance']
+
+    def record_balance(self, source, balance):
+        """ Record a balance seen for ``source``.
+
+        This lifts any cap left by an insufficient credit response.
+        """
+        def update(entry):
+            entry['balance'] = balance
+            entry['balance_timestamp'] = time.time()
+            entry.pop('insufficient', None)
+        self._update(source, update)
+
+    def record_transfer(self, source, phone_number, amount):
+        """ Record a successful transfer from ``source``.
+        """
+        def update(entry):
+            entry['transfers'].append({'to': phone_number,
+                                       'amount': int(amount),
+                                       'timestamp': time.time()})
+            if entry.get('balance') is not None:
+                entry['balance'] -= int(amount)
+        self._update(source, update)
+
+    def reconcile(self, source, amount, error):
+        """ Bring the ledger in line with a transfer the network refused.
+
+        :param error: Exception raised by ``creditme2u``.
+        """
+        message = str(error)
+
+        def update(entry):
+            if 'transfer limit' in message:
+                log.info('Network reports %s has reached its transfer '
+                         'limit; ledger had $%d sent today.' % (
+                             source, sum(transfer['amount'] for transfer
+                                         in entry['transfers'])))
+                entry['limit_day'] = _day(time.time())
+            elif 'Insufficient credit' in message:
+                log.info('Network reports %s has under $%s available.' % (
+                    source, amount))
+                entry['insufficient'] = int(amount)
+                entry.pop('balance', None)
+        self._update(source, update)
+
+    def check(self, source, amount):
+        """ Refuse a transfer the network would refuse.
+
+        :raises TransferRejected: If ``amount`` would exceed today's limit,
+            the known balance or an amount already refused for
+            insufficient credit.
+        """
+        amount = int(parse_amount(amount))
+        entry = self.entry(source)
+        sent = self.sent_today(source)
+        if sent + amount > self.limit:
+            raise TransferRejected(
+                'Sending $%d from %s would exceed the $%d daily transfer '
+                'limit; $%d already sent today.' % (
+                    amount, source, self.limit, sent))
+
+        balance = self.balance(source)
+        if balance is not None and amount > balance:
+            raise TransferRejected(
+                'Insufficient credit: %s has $%.2f, less than $%d.' % (
+                    source, balance, amount))
+        if entry.get('insufficient') is not None and \
+                amount >= entry['insufficient']:
+            raise TransferRejected(
+                'Insufficient credit: %s could not send $%d earlier.' % (
+                    source, entry['insufficient']))
+
+    def creditme2u(self, account, phone_number, amount, send=None):
+        """ Send CreditMe2U from ``account`` unless the ledger refuses it.
+
+        When no recent balance is recorded and the account reports one, it
+        is read first; a main menu snapshot is far cheaper than a refused
+        transfer.
+
+        :param send: Function taking the phone number and amount that
+            sends the transfer, such as
+            :meth:`telstra.mobile.session.MenuSession.creditme2u`.
+            Defaults to ``account.creditme2u``.
+        :returns: As for ``send``.
+        :raises TransferRejected: See :meth:`check`.
+        """
+        source = account.phone_number
+        self.check(source, amount)
+        if self.balance(source) is None:
+            balance = getattr(account, 'balance', None)
+            if balance is not None:
+                self.record_balance(source, balance)
+                self.check(source, amount)
+
+        try:
+            response = (send or account.creditme2u)(phone_number, amount)
+        except ValueError as exc:
+            self.reconcile(source, amount, exc)
+            raise
+        self.record_transfer(source, phone_number, parse_amount(amount))
+        return response
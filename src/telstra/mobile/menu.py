@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+from gsmmodem.exceptions import CommandError, TimeoutException
+
+from telstra.mobile.parse import CREDITME2U_LABELS
+
+log = logging.getLogger(__name__)
+
+SEPARATOR = '/'
+SKIP_LABELS = ('Home', 'Back', 'More', 'Hlp', 'Help')
+
+# Menu options known to only display information or reach a prompt, and so
+# safe to select while crawling
+CRAWL_LABELS = ('Recharge', 'Voucher', 'Bal Details', 'Main Bal',
+                'Call Cred Bal', 'Call Credits', 'My Offer',
+                'History') + CREDITME2U_LABELS
+
+
+def shortcode(path):
+    """ Build the compound ``#100#`` shortcode for a path of menu options.
+
+    For example, ``['2', '2']`` gives ``#100*2*2#``.
+    """
+    return '#100%s#' % ''.join('*%s' % option for option in path)
+
+
+def menu_version(menu):
+    """ Compute a version stamp for a parsed main menu.
+
+    Only the option labels and numbers contribute, so dynamic text like
+    the balance does not change the version.
+    """
+    digest = hashlib.sha1(json.dumps(sorted(menu.items())).encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+def menu_signature(response, menu):
+    """ Describe a menu node well enough to recognise it again.
+
+    Menus are identified by their option labels; prompts and other leaves
+    by their first line of text.
+    """
+    if menu:
+        return {'labels': sorted(menu)}
+    return {'text': response.message.split('\r\n')[0]}
+
+
+class MenuMap(object):
+    """ Map of ``#100#`` menu labels to option paths.
+
+    Each node is keyed by its labels from the main menu, joined with
+    ``/`` (for example ``Recharge/CredMe2U``), and records the option
+    numbers that reach it along with a signature used to confirm that a
+    compound shortcode arrived at the expected node.
+
+    The map is stamped with the :func:`menu_version` of the main menu it
+    was crawled from, so that it can be discarded when Telstra changes
+    the menu.
+    """
+
+    def __init__(self, version, nodes=None, timestamp=None):
+        self.version = version
+        self.nodes = nodes or {}
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def add(self, labels, path, signature):
+        self.nodes[SEPARATOR.join(labels)] = {'path': list(path),
+                                              'signature': signature}
+
+    def lookup(self, labels):
+        """ Find the node reached by ``labels``.
+
+        :param labels: Sequence of menu labels, where each item is either
+            a label or a tuple of alternative labels for the same level.
+        :returns: Node structure with ``path`` and ``signature`` keys, or
+            ``None`` if the map has no such node.
+        """
+        keys = ['']
+        for alternatives in labels:
+            if not isinstance(alternatives, (tuple, list)):
+                alternatives = (alternatives,)
+            keys = [key + SEPARATOR + label if key else label
+                    for key in keys for label in alternatives]
+        for key in keys:
+            if key in self.nodes:
+                return self.nodes[key]
+
+    def is_current(self, menu):
+        """ Check the map was crawled from the given parsed main menu.
+        """
+        return menu_version(menu) == self.version
+
+    @staticmethod
+    def matches(response, menu, signature):
+        """ Check that a response is the node described by ``signature``.
+        """
+        if 'labels' in signature:
+            return sorted(menu) == signature['labels']
+        return response.message.split('\r\n')[0] == signature['text']
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as map_file:
+            json.dump({'version': self.version,
+                       'timestamp': self.timestamp,
+                       'nodes': self.nodes}, map_file, indent=2,
+                      sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as map_file:
+            data = json.load(map_file)
+        return cls(data['version'], data['nodes'], data['timestamp'])
+
+
+def crawl(account, max_depth=2, skip=SKIP_LABELS, follow=CRAWL_LABELS):
+    """ Walk the ``#100#`` menu tree and map every node's option path.
+
+    :param account: :class:`telstra.mobile.account.TelstraAccount` to crawl
+        with.
+    :param max_depth: How many levels below the main menu to visit.
+    :param skip: Labels that are never followed, such as navigation
+        options.
+    :param follow: The only labels that are followed, or ``None`` to
+        follow every label not skipped.
+    :rtype: :class:`MenuMap`
+
+    Each node is reached by a fresh stepwise walk from ``#100#``, so the
+    crawl itself costs several sessions; it is meant to be run once and its
+    result saved.
+
+    Selecting an option can itself act, such as confirming a purchase, so
+    by default only options in :data:`CRAWL_LABELS`, which display
+    information or reach a prompt, are followed.  Passing ``follow=None``
+    selects every option in the tree and may confirm actions.
+    """
+    def followed(label):
+        return label not in skip and (follow is None or label in follow)
+
+    response = account.main_menu()
+    menu = account.parse_menu(response)
+    response.cancel()
+
+    menu_map = MenuMap(menu_version(menu))
+    pending = [((label,), (option,)) for label, option in menu.items()
+               if followed(label)]
+
+    while pending:
+        labels, path = pending.pop(0)
+        try:
+            response = account.main_menu()
+            for option in path:
+                response = response.reply(option)
+        except (CommandError, TimeoutException):
+            log.warning('Could not reach menu node %s' %
+                        SEPARATOR.join(labels))
+            continue
+
+        menu = account.parse_menu(response)
+        menu_map.add(labels, path, menu_signature(response, menu))
+        log.debug('Mapped %s to %s' % (SEPARATOR.join(labels),
+                                       shortcode(path)))
+        try:
+            response.cancel()
+        except CommandError:
+            pass
+
+        if len(path) < max_depth:
+            pending.extend((labels + (label,), path + (option,))
+                           for label, option in menu.items()
+                           if followed(label))
+
+    return menu_map
@@ -1,13 +1,97 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
 from serialenum import enumerate as enumerate_serial
 from gsmmodem.modem import GsmModem
 from gsmmodem.exceptions import TimeoutException
 from serial import SerialException
 
+from telstra.mobile.stats import InstrumentedModem, get_stats
+
 log = logging.getLogger(__name__)
 
 
-def autodetect_modem(pin=None, check_fn=None, modem_options={'baudrate': 9600}):
+def probe_port(port, pin=None, check_fn=None,
+               modem_options={'baudrate': 9600}, cancelled=None):
+    """ Attempt to connect to and check a single modem port.
+
+    :param port: Serial port to connect to.
+    :param pin: Security PIN to unlock the SIM.
+    :param check_fn: Callable that should take a single ``modem`` argument
+        and return True if the modem instance is suitable.
+    :param modem_options: Structure to pass as keyword arguments to
+        ``GsmModem`` initialisation.
+    :param cancelled: Optional :class:`threading.Event`.  If set before or
+        during the probe, the probe is abandoned and the modem closed.
+    :returns: Connected modem instance, or ``None`` if the port was
+        unsuitable.
+
+    Any unsuccessful or abandoned connection is closed before returning.
+    """
+    if cancelled is not None and cancelled.is_set():
+        return
+
+    modem = GsmModem(port, **modem_options)
+    stats = get_stats()
+    if stats is not None:
+        modem = InstrumentedModem(modem, stats)
+    try:
+        log.debug('Attempting to connect to modem at %s' % port)
+        modem.connect(pin=pin)
+        if cancelled is not None and cancelled.is_set():
+            log.debug('Probe of %s cancelled' % port)
+        elif not check_fn or check_fn and check_fn(modem):
+            log.debug('Successfully detected modem at %s' % port)
+            return modem
+    except SerialException:
+        log.warn('Serial communication problem for port %s' % port)
+    except TimeoutException:
+        log.warn('Timeout detected on port %s' % port)
+
+    log.debug('Closing modem at %s' % port)
+    modem.close()
+
+
+def _close_probe(future):
+    """ Close the modem from a completed probe that is no longer wanted.
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    modem = future.result()
+    if modem:
+        log.debug('Closing surplus modem at %s' % modem.port)
+        modem.close()
+
+
+def _autodetect_concurrent(ports, workers, **probe_options):
+    """ Probe ``ports`` over a pool of ``workers`` threads.
+
+    Results are consumed in port order so the modem chosen is the same one
+    that a sequential scan would have returned.  Once a modem is chosen,
+    pending probes are cancelled and any probes still running close their
+    modems as soon as they complete.
+    """
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(probe_port, port, cancelled=cancelled,
+                               **probe_options)
+               for port in ports]
+    try:
+        for index, future in enumerate(futures):
+            modem = future.result()
+            if modem:
+                return modem
+    finally:
+        cancelled.set()
+        for future in futures[index + 1:]:
+            if not future.cancel():
+                future.add_done_callback(_close_probe)
+        executor.shutdown(wait=False)
+
+
+def autodetect_modem(pin=None, check_fn=None, modem_options={'baudrate': 9600},
+                     workers=None, ports=None):
     """ Autodetect a suitable cellular modem connected to the system.
 
     :param pin: Security PIN to unlock the SIM.
@@ -16,6 +100,10 @@ def autodetect_modem(pin=None, check_fn=None, modem_options={'baudrate': 9600}):
     :param modem_options: Structure to pass as keyword arguments to
         ``GsmModem`` initialisation.
     :type modem_options: dict-like
+    :param workers: Number of ports to probe concurrently.  ``None`` or
+        ``1`` probes each port in turn.
+    :param ports: Serial ports to probe.  Defaults to all serial ports
+        detected on the system.
     :returns: Connected modem instance
     :rtype: :class:`gsmmodem.modem.GsmModem`
 
@@ -24,30 +112,62 @@ def autodetect_modem(pin=None, check_fn=None, modem_options={'baudrate': 9600}):
     port that connects successfully, and passes the ``check_fn(modem)`` call
     (if ``check_fn`` is specified), will be returned.
 
+    When ``workers`` is greater than one, ports are connected and checked
+    in parallel, but the modem returned is still the first suitable one in
+    port order, exactly as for the sequential scan.  ``check_fn`` must be
+    safe to call from multiple threads at once.
+
     All other unsuccessful connections will be closed during the process.
 
     This method will return ``None`` if no modems could be detected.
     """
-    ports = enumerate_serial()
+    if ports is None:
+        ports = enumerate_serial()
     if not ports:
         log.error('No modem ports detected on system.')
         return
 
-    modem = None
+    probe_options = {'pin': pin,
+                     'check_fn': check_fn,
+                     'modem_options': modem_options}
+
+    if workers and workers > 1 and len(ports) > 1:
+        return _autodetect_concurrent(ports, workers, **probe_options)
 
     for port in ports:
-        modem = GsmModem(port, **modem_options)
-        try:
-            log.debug('Attempting to connect to modem at %s' % port)
-            modem.connect(pin=pin)
-            if not check_fn or check_fn and check_fn(modem):
-                log.debug('Successfully detected modem at %s' % port)
-                return modem
-        except SerialException:
-            log.warn('Serial communication problem for port %s' % port)
-        except TimeoutException:
-            log.warn('Timeout detected on port %s' % port)
+        modem = probe_port(port, **probe_options)
+        if modem:
+            return modem
 
-        log.debug('Closing modem at %s' % port)
-        modem.close()
 
+def autodetect_modems(pin=None, check_fn=None,
+                      modem_options={'baudrate': 9600}, workers=None,
+                      ports=None):
+    """ Autodetect every suitable cellular modem connected to the system.
+
+    Takes the same arguments as :func:`autodetect_modem`, but rather than
+    stopping at the first suitable modem, every port is probed and all
+    suitable modems are returned, connected, in port order.
+
+    :rtype: list
+    """
+    if ports is None:
+        ports = enumerate_serial()
+    if not ports:
+        log.error('No modem ports detected on system.')
+        return []
+
+    probe_options = {'pin': pin,
+                     'check_fn': check_fn,
+                     'modem_options': modem_options}
+
+    if workers and workers > 1 and len(ports) > 1:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            modems = list(executor.map(
+                lambda port: probe_port(port, **probe_options), ports))
+        finally:
+            executor.shutdown()
+    else:
+        modems = [probe_port(port, **probe_options) for port in ports]
+    return [modem for modem in modems if modem]
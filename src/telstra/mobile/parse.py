@@ -0,0 +1,123 @@
+""" Parsers for Telstra USSD messages.
+
+These only need the standard library, so scripts and library users that
+just parse messages do not load the modem stack.  They are also available
+from :mod:`telstra.mobile.account`.
+"""
+from datetime import datetime
+import re
+import time
+
+from telstra.mobile.stats import timed
+
+
+CREDITME2U_LABELS = ('CreditMe2U', 'CredMe2U', 'Credit Me2U')
+
+
+@timed('parse_balance')
+def parse_balance(message):
+    """ Parse the credit balance from a ``#100#`` main menu message.
+
+    :rtype: float
+    """
+    balance = re.search('\$(.*?)\s', message)
+    if balance:
+        return float(balance.groups()[0].replace(',', ''))
+
+
+@timed('parse_expiry_date')
+def parse_expiry_date(message):
+    """ Parse the credit expiry date from a ``#100#`` main menu message.
+
+    :rtype: :class:`datetime.datetime`
+    """
+    expiry = re.search('Exp.*?\s(.*?)\r\n', message)
+    if expiry:
+        return datetime.strptime(expiry.groups()[0], '%d %b %Y')
+
+
+@timed('parse_identity')
+def parse_identity(message):
+    """ Parse the phone and account numbers from a ``#150#`` message.
+
+    :returns: Tuple of phone number and account number.
+    :rtype: tuple
+    """
+    lines = message.split('\r\n')
+    return lines[1], lines[-1]
+
+
+def is_identity(message):
+    """ Check whether a ``#150#`` message holds the service's numbers,
+    rather than a notice such as the service being busy.
+    """
+    lines = message.split('\r\n')
+    return len(lines) > 1 and \
+        re.match(r'\+?[\d ]+$', lines[1].strip()) is not None
+
+
+def parse_amount(amount):
+    """ Validate a CreditMe2U amount, given as an integer or string.
+
+    :returns: Whole-dollar amount as a string, ready to send.
+    :rtype: str
+    """
+    amount = int(str(amount).replace('$', ''))
+    if amount < 1 or amount > 10:
+        raise ValueError("Could not parse the amount specified.")
+    return str(amount)
+
+
+@timed('parse_menu')
+def parse_menu(message):
+    """ Parse the numbered options of a USSD menu message.
+
+    :returns: Structure mapping option labels to their numbers.
+    :rtype: dict
+    """
+    menu = {}
+    for item in message.split('\r\n'):
+        item_details = re.match('(\d+)\.\s+(.*)', item)
+        if item_details:
+            results = item_details.groups()
+            menu[results[1]] = results[0]
+    return menu
+
+
+def find_option(menu, labels):
+    """ Find the option number for the first of ``labels`` in ``menu``.
+
+    :param menu: Parsed menu, as per :func:`parse_menu`.
+    :param labels: Alternate labels for the same menu item.
+    :returns: Option number, or ``None`` if no label is present.
+    """
+    for label in labels:
+        if label in menu:
+            return menu[label]
+
+
+class AccountSnapshot(object):
+    """ Balance, expiry and menu options from a single ``#100#`` dial.
+
+    Prepaid balance and expiry both appear in the main menu text, so one
+    snapshot answers both without dialling again.
+    """
+
+    def __init__(self, message, timestamp=None):
+        """ Initialise a snapshot from the main menu message.
+
+        :param message: Main menu USSD message text.
+        :param timestamp: Unix time the message was received; defaults to
+            now.
+        """
+        self.message = message
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.balance = parse_balance(message)
+        self.expiry_date = parse_expiry_date(message)
+        self.menu = parse_menu(message)
+
+    @property
+    def age(self):
+        """ Seconds since this snapshot was taken.
+        """
+        return time.time() - self.timestamp
@@ -0,0 +1,65 @@
+""" Concurrent balance and expiry polling across many accounts.
+
+Each account is polled on its own worker, so the total time taken
+approaches that of the slowest modem rather than the sum of them all, and
+results are yielded as each account finishes::
+
+    for result in poll_accounts(autodetect_accounts(workers=8)):
+        print(result['phone_number'], result['balance'])
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+POLL_FIELDS = ('balance', 'expiry_date')
+
+
+def poll_account(account, fields=POLL_FIELDS):
+    """ Read ``fields`` from ``account``.
+
+    :returns: Structure with ``phone_number``, ``port``, ``elapsed`` and
+        ``error`` keys, plus one key per field.  A field the account does
+        not offer, such as the balance of a postpaid service, is ``None``.
+    :rtype: dict
+    """
+    modem = getattr(account, 'modem', None)
+    result = {'phone_number': account.phone_number,
+              'port': getattr(modem, 'port', None),
+              'error': None}
+    start = time.time()
+    try:
+        for field in fields:
+            result[field] = getattr(account, field, None)
+    except Exception as exc:
+        log.warning('Failed to poll %s: %s' % (account.phone_number, exc))
+        result['error'] = str(exc) or type(exc).__name__
+        for field in fields:
+            result.setdefault(field, None)
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def poll_accounts(accounts, fields=POLL_FIELDS, workers=None):
+    """ Poll ``accounts`` concurrently, yielding results as they finish.
+
+    :param accounts: Accounts to poll, each on its own modem.
+    :param fields: Account attributes to read.
+    :param workers: Number of accounts to poll at once.  Defaults to one
+        worker per account.
+    :returns: Generator of structures from :func:`poll_account`, in order
+        of completion.
+    """
+    accounts = list(accounts)
+    if not accounts:
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers or len(accounts))
+    try:
+        futures = [executor.submit(poll_account, account, fields)
+                   for account in accounts]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        executor.shutdown()
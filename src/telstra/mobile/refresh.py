@@ -0,0 +1,129 @@
+""" Background refresh of account snapshots, serving stale while revalidating.
+
+A :class:`SnapshotRefresher` answers balance and expiry reads straight
+from each account's last main menu snapshot.  A snapshot older than the
+reader will accept is still returned at once, and a refresh is started in
+the background so the next reader gets a fresh one.  Optionally, every
+snapshot is also refreshed on a fixed schedule, so readers such as
+dashboards rarely see a stale one at all.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotRefresher(object):
+    """ Keep main menu snapshots fresh for a set of accounts.
+    """
+
+    def __init__(self, accounts, interval=None, locks=None):
+        """ Initialise the refresher.
+
+        :param accounts: :class:`telstra.mobile.account.TelstraAccount`
+            instances, each with its ``phone_number`` determined.
+        :param interval: Seconds between scheduled refreshes of each
+            snapshot once :meth:`start` is called.  ``None`` only refreshes
+            on demand.
+        :param locks: Mapping of phone numbers to the locks that guard
+            each account's modem, when shared with other users of the
+            accounts.
+        """
+        self.accounts = dict((account.phone_number, account)
+                             for account in accounts)
+        self.interval = interval
+        self._locks = locks or dict((phone_number, threading.Lock())
+                                    for phone_number in self.accounts)
+        self._refreshing = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def refresh(self, phone_number):
+        """ Take a new snapshot for ``phone_number`` now, waiting for it.
+
+        :rtype: :class:`telstra.mobile.account.AccountSnapshot`
+        """
+        account = self.accounts[phone_number]
+        with self._locks[phone_number]:
+            return account.snapshot(refresh=True)
+
+    def refresh_async(self, phone_number):
+        """ Start refreshing the snapshot for ``phone_number`` in the
+        background, unless a refresh is already under way.
+
+        :returns: The thread doing the refresh.
+        :rtype: :class:`threading.Thread`
+        """
+        with self._lock:
+            thread = self._refreshing.get(phone_number)
+            if thread is not None and thread.is_alive():
+                return thread
+
+            def run():
+                try:
+                    self.refresh(phone_number)
+                except Exception:
+                    log.exception('Failed to refresh snapshot for %s' %
+                                  phone_number)
+                finally:
+                    with self._lock:
+                        self._refreshing.pop(phone_number, None)
+
+            thread = threading.Thread(target=run,
+                                      name='refresh-%s' % phone_number)
+            thread.daemon = True
+            self._refreshing[phone_number] = thread
+            thread.start()
+            return thread
+
+    def get(self, phone_number, max_age=None):
+        """ Obtain the snapshot for ``phone_number`` without waiting on the
+        modem, unless no snapshot has been taken yet.
+
+        :param max_age: Seconds old a snapshot may be before a background
+            refresh is started.  The existing snapshot is returned either
+            way.  ``None`` never starts a refresh.
+        :rtype: :class:`telstra.mobile.account.AccountSnapshot`
+        """
+        snapshot = self.accounts[phone_number].last_snapshot
+        if snapshot is None:
+            return self.refresh(phone_number)
+        if max_age is not None and snapshot.age > max_age:
+            self.refresh_async(phone_number)
+        return snapshot
+
+    def _run(self):
+        scheduled = {}
+        while not self._stopped.is_set():
+            now = time.time()
+            for phone_number, account in self.accounts.items():
+                snapshot = account.last_snapshot
+                if snapshot is not None:
+                    # Reads and other refreshes count towards the schedule
+                    scheduled[phone_number] = max(
+                        scheduled.get(phone_number, 0), snapshot.timestamp)
+                if now - scheduled.get(phone_number, 0) >= self.interval:
+                    scheduled[phone_number] = now
+                    self.refresh_async(phone_number)
+            due = min(scheduled.values()) + self.interval - time.time()
+            self._stopped.wait(max(due, 0))
+
+    def start(self):
+        """ Refresh every snapshot each ``interval`` seconds until
+        :meth:`stop` is called.
+        """
+        if self.interval is None or not self.accounts or \
+                self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='refresher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,241 @@
+""" Record and replay modem USSD traffic.
+
+A :class:`RecordingModem` wraps a real modem and captures every connection,
+USSD dial, reply and cancellation, with its timing, into a
+:class:`Transcript`.  A :class:`ReplayModem` later serves that transcript
+back to the accounts, with the original or scaled latency, so that flows
+can be benchmarked and regression-tested without hardware::
+
+    from telstra.mobile import modem
+    from telstra.mobile.replay import Transcript, replay_modem_cls
+
+    modem.GsmModem = replay_modem_cls(Transcript.load('creditme2u.jsonl'))
+    account = autodetect_account('0412345678')
+"""
+from collections import deque
+import json
+import time
+
+from gsmmodem.exceptions import CommandError, InvalidStateException, \
+    TimeoutException
+from serial import SerialException
+
+ERRORS = dict((error.__name__, error) for error in (
+    CommandError, InvalidStateException, SerialException, TimeoutException))
+
+
+class ReplayError(Exception):
+    """ The modem was used differently from the recorded transcript.
+    """
+
+
+class Transcript(object):
+    """ Ordered record of modem operations, across one or more ports.
+
+    Each event is a structure with ``port``, ``op`` (one of ``connect``,
+    ``imsi``, ``dial``, ``reply`` or ``cancel``), the USSD ``code`` sent,
+    the ``message`` and ``active`` session state received, the ``elapsed``
+    seconds taken and the name of any ``error`` raised.
+    """
+
+    def __init__(self, events=None):
+        self.events = list(events or [])
+
+    def record(self, port, op, code=None, message=None, active=None,
+               elapsed=0.0, error=None):
+        self.events.append({'port': port,
+                            'op': op,
+                            'code': code,
+                            'message': message,
+                            'active': active,
+                            'elapsed': elapsed,
+                            'error': error})
+
+    def ports(self):
+        """ List the ports in the transcript, in order of first use.
+        """
+        ports = []
+        for event in self.events:
+            if event['port'] not in ports:
+                ports.append(event['port'])
+        return ports
+
+    def events_for(self, port):
+        return [event for event in self.events if event['port'] == port]
+
+    def save(self, path):
+        """ Write the transcript as JSON lines.
+        """
+        with open(path, 'w') as transcript_file:
+            for event in self.events:
+                transcript_file.write(json.dumps(event, sort_keys=True) + '\n')
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as transcript_file:
+            return cls(json.loads(line) for line in transcript_file
+                       if line.strip())
+
+
+class _Recorder(object):
+
+    def _record(self, op, fn, code=None):
+        start = time.time()
+        try:
+            result = fn()
+        except Exception as exc:
+            self._transcript.record(self._port, op, code=code,
+                                    elapsed=time.time() - start,
+                                    error=type(exc).__name__)
+            raise
+        elapsed = time.time() - start
+        return result, elapsed
+
+
+class RecordingUssd(_Recorder):
+    """ Proxy for a USSD response that records replies and cancellation.
+    """
+
+    def __init__(self, ussd, port, transcript):
+        self._ussd = ussd
+        self._port = port
+        self._transcript = transcript
+
+    def __getattr__(self, name):
+        return getattr(self._ussd, name)
+
+    def reply(self, message):
+        response, elapsed = self._record(
+            'reply', lambda: self._ussd.reply(message), code=message)
+        self._transcript.record(self._port, 'reply', code=message,
+                                message=response.message,
+                                active=getattr(response, 'sessionActive',
+                                               None),
+                                elapsed=elapsed)
+        return RecordingUssd(response, self._port, self._transcript)
+
+    def cancel(self):
+        result, elapsed = self._record('cancel', self._ussd.cancel)
+        self._transcript.record(self._port, 'cancel', elapsed=elapsed)
+        return result
+
+
+class RecordingModem(_Recorder):
+    """ Proxy for a modem that records its operations to a transcript.
+    """
+
+    def __init__(self, modem, transcript):
+        self._modem = modem
+        self._port = modem.port
+        self._transcript = transcript
+
+    def __getattr__(self, name):
+        return getattr(self._modem, name)
+
+    def connect(self, *args, **kwargs):
+        result, elapsed = self._record(
+            'connect', lambda: self._modem.connect(*args, **kwargs))
+        self._transcript.record(self._port, 'connect', elapsed=elapsed)
+        return result
+
+    @property
+    def imsi(self):
+        imsi, elapsed = self._record('imsi', lambda: self._modem.imsi)
+        self._transcript.record(self._port, 'imsi', message=imsi,
+                                elapsed=elapsed)
+        return imsi
+
+    def sendUssd(self, code, *args, **kwargs):
+        response, elapsed = self._record(
+            'dial', lambda: self._modem.sendUssd(code, *args, **kwargs),
+            code=code)
+        self._transcript.record(self._port, 'dial', code=code,
+                                message=response.message,
+                                active=getattr(response, 'sessionActive',
+                                               None),
+                                elapsed=elapsed)
+        return RecordingUssd(response, self._port, self._transcript)
+
+
+def recording_modem_cls(modem_cls, transcript):
+    """ Wrap a modem class so every instance records to ``transcript``.
+
+    The result can stand in for ``GsmModem`` during autodetection.
+    """
+    def factory(port, *args, **kwargs):
+        return RecordingModem(modem_cls(port, *args, **kwargs), transcript)
+    return factory
+
+
+class ReplayUssd(object):
+    """ USSD response served from a transcript.
+    """
+
+    def __init__(self, modem, event):
+        self.modem = modem
+        self.message = event['message']
+        self.sessionActive = event['active']
+
+    def reply(self, message):
+        return ReplayUssd(self.modem, self.modem._next('reply', message))
+
+    def cancel(self):
+        self.modem._next('cancel')
+
+
+class ReplayModem(object):
+    """ Modem that serves a recorded transcript for its port.
+
+    :param scale: Multiplier applied to the recorded latency of each
+        operation; ``0`` replays as fast as possible.
+
+    Operations must arrive in the same order and with the same USSD codes
+    as when recorded, otherwise :class:`ReplayError` is raised.  Recorded
+    errors are raised again in the same place.
+    """
+
+    def __init__(self, port, transcript, scale=1.0, **options):
+        self.port = port
+        self.options = options
+        self.scale = scale
+        self.events = deque(transcript.events_for(port))
+        self.closed = False
+
+    def _next(self, op, code=None):
+        if not self.events:
+            if op == 'connect':
+                raise SerialException('No transcript for port %s' % self.port)
+            raise ReplayError('Transcript for %s exhausted at %s %s' % (
+                self.port, op, code or ''))
+
+        event = self.events.popleft()
+        if event['op'] != op or event['code'] != code:
+            raise ReplayError('Expected %s %s on %s, but got %s %s' % (
+                event['op'], event['code'] or '', self.port, op, code or ''))
+
+        if self.scale:
+            time.sleep(event['elapsed'] * self.scale)
+        if event['error']:
+            raise ERRORS.get(event['error'], ReplayError)(event['error'])
+        return event
+
+    def connect(self, pin=None):
+        self._next('connect')
+
+    def close(self):
+        self.closed = True
+
+    @property
+    def imsi(self):
+        return self._next('imsi')['message']
+
+    def sendUssd(self, code, responseTimeout=15):
+        return ReplayUssd(self, self._next('dial', code))
+
+
+def replay_modem_cls(transcript, scale=1.0):
+    """ Build a stand-in for ``GsmModem`` that replays ``transcript``.
+    """
+    def factory(port, *args, **kwargs):
+        return ReplayModem(port, transcript, scale=scale, **kwargs)
+    return factory
@@ -0,0 +1,344 @@
+""" Cost-aware routing of balance and expiry reads between backends.
+
+Balance and expiry can be read over USSD, which is slow and keeps the
+modem from sending transfers, or from the web API, which is fast but
+flaky.  A :class:`ReadRouter` answers each read from whichever backend is
+currently cheapest:
+
+* a reading already held by any backend, such as a recent main menu
+  snapshot or cached credit summary, costs nothing if it is fresh enough;
+* otherwise each backend's cost is its measured latency, scaled by its
+  weight and by the retries its recent error rate implies, and the
+  cheapest healthy backend is read;
+* failures fail over to the next backend, and a backend that keeps
+  failing is skipped for a cooldown period unless nothing else works.
+
+::
+
+    router = ReadRouter([web_backend(api), ussd_backend(load_account)])
+    reading = router.read(max_age=300)
+    print(reading.balance, reading.source)
+
+Latency and error rate estimates live in memory, so each process starts
+from the initial estimates unless the router is given a state file to keep
+them in between runs.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from telstra.mobile.config import ROUTER_COOLDOWN, ROUTER_FAILURE_THRESHOLD
+from telstra.mobile.stats import get_stats
+
+log = logging.getLogger(__name__)
+
+USSD = 'ussd'
+WEB = 'web'
+
+# Initial latency estimates in seconds, used until a backend is measured
+USSD_LATENCY = 5.0
+WEB_LATENCY = 1.0
+
+# USSD reads cost more than their time alone, as they hold up the modem
+USSD_WEIGHT = 2.0
+
+SMOOTHING = 0.3
+MIN_SUCCESS_RATE = 0.05
+
+
+class ReadError(Exception):
+    """ No backend could provide a reading.
+    """
+
+
+class Reading(object):
+    """ Balance and expiry date from one backend at one point in time.
+    """
+
+    def __init__(self, source, balance, expiry_date, timestamp=None):
+        self.source = source
+        self.balance = balance
+        self.expiry_date = expiry_date
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @property
+    def age(self):
+        """ Seconds since this reading was taken.
+        """
+        return time.time() - self.timestamp
+
+    def __repr__(self):
+        return '<Reading %s $%s %s>' % (self.source, self.balance,
+                                        self.expiry_date)
+
+
+class Backend(object):
+    """ One source of readings, with its measured latency and error rate.
+    """
+
+    def __init__(self, name, fetch, last=None, latency=1.0, weight=1.0):
+        """ Initialise a backend.
+
+        :param fetch: Callable taking ``max_age``, the oldest data in
+            seconds the read may be answered from, or ``None`` for the
+            backend's default, and returning a :class:`Reading`.
+        :param last: Callable returning the backend's latest
+            :class:`Reading` without any I/O, or ``None`` if it has none.
+        :param latency: Initial latency estimate in seconds.
+        :param weight: Multiplier applied to this backend's cost.
+        """
+        self.name = name
+        self._fetch = fetch
+        self._last = last
+        self.latency = latency
+        self.weight = weight
+        self.error_rate = 0.0
+        self.failures = 0
+        self.failed_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def cost(self):
+        """ Expected seconds, weighted, to obtain a successful reading.
+        """
+        success_rate = max(1 - self.error_rate, MIN_SUCCESS_RATE)
+        return self.weight * self.latency / success_rate
+
+    def healthy(self, failure_threshold=ROUTER_FAILURE_THRESHOLD,
+                cooldown=ROUTER_COOLDOWN):
+        """ Whether this backend is worth trying: it has failed fewer than
+        ``failure_threshold`` times in a row, or not for ``cooldown``
+        seconds.
+        """
+        return self.failures < failure_threshold or \
+            time.time() - self.failed_at >= cooldown
+
+    def record(self, seconds, error=None):
+        """ Update the latency and error rate estimates after a read.
+        """
+        with self._lock:
+            self.error_rate += SMOOTHING * ((error is not None) -
+                                            self.error_rate)
+            if error is None:
+                self.latency += SMOOTHING * (seconds - self.latency)
+                self.failures = 0
+            else:
+                # Failures often take as long as a timeout; only count
+                # them towards the latency if they were slower still.
+                self.latency = max(self.latency, self.latency + SMOOTHING *
+                                   (seconds - self.latency))
+                self.failures += 1
+                self.failed_at = time.time()
+        stats = get_stats()
+        if stats is not None:
+            stats.observe('read', seconds, backend=self.name)
+            if error is not None:
+                stats.error('read', error, backend=self.name)
+
+    def last(self):
+        """ Latest reading held by this backend, without any I/O.
+        """
+        if self._last is None:
+            return None
+        reading = self._last()
+        if reading is None or (reading.balance is None and
+                               reading.expiry_date is None):
+            return None
+        return reading
+
+    def fetch(self, max_age=None):
+        """ Obtain a reading, measuring how long it takes.
+
+        :raises ReadError: If the reading has neither a balance nor an
+            expiry date.
+        """
+        start = time.time()
+        try:
+            reading = self._fetch(max_age)
+            if reading.balance is None and reading.expiry_date is None:
+                raise ReadError('%s returned no balance or expiry.' %
+                                self.name)
+        except Exception as exc:
+            self.record(time.time() - start, exc)
+            raise
+        self.record(time.time() - start)
+        return reading
+
+    def __repr__(self):
+        return '<Backend %s cost=%.2f error_rate=%.2f>' % (
+            self.name, self.cost, self.error_rate)
+
+
+def ussd_backend(load_account, latency=USSD_LATENCY, weight=USSD_WEIGHT):
+    """ Backend reading an account's main menu over USSD.
+
+    :param load_account: Callable returning the
+        :class:`telstra.mobile.account.TelstraAccount` or
+        :class:`telstra.mobile.broker.BrokerAccount`, or ``None`` if there
+        is none.  It is called once, when this backend is first read, so
+        the modem is only opened if it is needed.
+    """
+    loaded = []
+
+    def account():
+        if not loaded:
+            loaded.append(load_account())
+        if loaded[0] is None:
+            raise ReadError("Couldn't detect a suitable modem or account.")
+        return loaded[0]
+
+    def fetch(max_age):
+        current = account()
+        if hasattr(current, 'last_snapshot'):
+            snapshot = current.snapshot(max_age)
+            return Reading(USSD, snapshot.balance, snapshot.expiry_date,
+                           snapshot.timestamp)
+        elif max_age is not None:
+            # The broker answers from its snapshot, refreshing it in the
+            # background once older than max_age
+            snapshot = current.snapshot(max_age)
+            return Reading(USSD, snapshot['balance'],
+                           snapshot['expiry_date'], snapshot['timestamp'])
+        return Reading(USSD, current.balance, current.expiry_date)
+
+    def last():
+        snapshot = getattr(loaded[0], 'last_snapshot', None) \
+            if loaded else None
+        if snapshot is not None:
+            return Reading(USSD, snapshot.balance, snapshot.expiry_date,
+                           snapshot.timestamp)
+
+    return Backend(USSD, fetch, last, latency=latency, weight=weight)
+
+
+def web_backend(api, phone_number=None, latency=WEB_LATENCY, weight=1.0):
+    """ Backend reading credit summaries from the web API.
+
+    :param api: :class:`telstra.mobile.web.TelstraWebApi`.
+    :param phone_number: Service to read; the login's default service if
+        ``None``.
+    """
+    def fetch(max_age):
+        summary = api.prepaid_summary(phone_number,
+                                      refresh=max_age is not None)
+        return Reading(WEB, summary.balance, summary.expiry_date,
+                       summary.timestamp)
+
+    def last():
+        summary = api.last_summary(phone_number)
+        if summary is not None:
+            return Reading(WEB, summary.balance, summary.expiry_date,
+                           summary.timestamp)
+
+    return Backend(WEB, fetch, last, latency=latency, weight=weight)
+
+
+class ReadRouter(object):
+    """ Route balance and expiry reads to the cheapest healthy backend.
+    """
+
+    def __init__(self, backends, failure_threshold=ROUTER_FAILURE_THRESHOLD,
+                 cooldown=ROUTER_COOLDOWN, state_path=None):
+        """ Initialise the router.
+
+        :param backends: :class:`Backend` instances, such as from
+            :func:`web_backend` and :func:`ussd_backend`.  Equally cheap
+            backends are tried in this order.
+        :param failure_threshold: Consecutive failures after which a
+            backend is only tried once nothing else works.
+        :param cooldown: Seconds before such a backend is tried first
+            again.
+        :param state_path: JSON file to load each backend's latency and
+            error rate from, and save them to after every read, so they
+            carry over between runs.
+        """
+        self.backends = list(backends)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state_path = state_path
+        if state_path is not None:
+            self.restore()
+
+    def _load(self):
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def restore(self):
+        """ Load each backend's saved latency and error rate.
+        """
+        state = self._load()
+        for backend in self.backends:
+            saved = state.get(backend.name) or {}
+            backend.latency = saved.get('latency', backend.latency)
+            backend.error_rate = saved.get('error_rate', backend.error_rate)
+
+    def save(self):
+        """ Save each backend's latency and error rate, keeping those of
+        backends this router does not have.
+        """
+        # Imported here, as discovery loads the modem stack
+        from telstra.mobile.discovery import file_lock
+        with file_lock(self.state_path):
+            state = self._load()
+            for backend in self.backends:
+                state[backend.name] = {'latency': backend.latency,
+                                       'error_rate': backend.error_rate}
+            handle, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.state_path) or '.')
+            with os.fdopen(handle, 'w') as state_file:
+                json.dump(state, state_file, indent=2, sort_keys=True)
+            os.rename(temp_path, self.state_path)
+
+    def ranked(self):
+        """ Backends in the order they will be tried: healthy ones by
+        cost, then the rest by cost.
+        """
+        return sorted(self.backends, key=lambda backend: (
+            not backend.healthy(self.failure_threshold, self.cooldown),
+            backend.cost))
+
+    def read(self, max_age=None):
+        """ Obtain the balance and expiry date.
+
+        :param max_age: Seconds old a reading may be.  A reading any
+            backend already holds is returned without any I/O if it is
+            young enough.  ``None`` leaves freshness to each backend.
+        :rtype: :class:`Reading`
+        :raises ReadError: If every backend failed.
+        """
+        if max_age is not None:
+            held = [reading for reading in
+                    (backend.last() for backend in self.backends)
+                    if reading is not None and reading.age <= max_age]
+            if held:
+                return max(held, key=lambda reading: reading.timestamp)
+
+        errors = []
+        try:
+            for backend in self.ranked():
+                try:
+                    reading = backend.fetch(max_age)
+                except Exception as exc:
+                    log.warning('Reading from %s failed: %s' % (backend.name,
+                                                                exc))
+                    errors.append('%s: %s' % (
+                        backend.name, str(exc) or type(exc).__name__))
+                    continue
+                log.debug('Read from %s' % backend.name)
+                return reading
+        finally:
+            if self.state_path is not None:
+                self.save()
+        raise ReadError('Every backend failed (%s).' % '; '.join(errors))
+
+    def balance(self, max_age=None):
+        return self.read(max_age).balance
+
+    def expiry_date(self, max_age=None):
+        return self.read(max_age).expiry_date
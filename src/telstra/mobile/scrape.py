@@ -0,0 +1,311 @@
+""" Streaming parsers for HTML pages from Telstra's web services.
+
+Pages are parsed incrementally as chunks of the response body arrive, so
+records are available before the download finishes and only the table row
+being parsed is held in memory, however long the page is::
+
+    response = session.get(USAGE_URL, stream=True)
+    for record in iter_usage(response.iter_content(8192)):
+        print(record.kind, record.timestamp, record.cost)
+"""
+from collections import deque
+import codecs
+from datetime import datetime
+import re
+
+try:
+    from html.parser import HTMLParser
+except ImportError:
+    from HTMLParser import HTMLParser
+
+CALL = 'call'
+SMS = 'sms'
+DATA = 'data'
+OTHER = 'other'
+
+KIND_KEYWORDS = ((SMS, ('sms', 'mms', 'text', 'message')),
+                 (DATA, ('data', 'internet', 'browsing', 'gprs')),
+                 (CALL, ('call', 'voice', 'voicemail')))
+
+# Header keywords identifying each record field's column
+COLUMN_KEYWORDS = (('date', ('date',)),
+                   ('time', ('time',)),
+                   ('destination', ('number', 'destination', 'called', 'to')),
+                   ('quantity', ('duration', 'volume', 'usage', 'quantity',
+                                 'size')),
+                   ('cost', ('cost', 'charge', 'amount', 'price')),
+                   ('description', ('type', 'description', 'service',
+                                    'details')))
+DEFAULT_COLUMNS = {'date': 0, 'description': 1, 'destination': 2,
+                   'quantity': 3, 'cost': 4}
+
+DATE_FORMATS = ('%d/%m/%Y %I:%M %p', '%d/%m/%Y %I:%M:%S %p',
+                '%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S',
+                '%d %b %Y %I:%M %p', '%d %b %Y %H:%M', '%d/%m/%Y', '%d %b %Y')
+
+DURATION_UNITS = {'h': 3600, 'm': 60, 's': 1}
+VOLUME_UNITS = {'b': 1.0 / 1024, 'kb': 1, 'mb': 1024, 'gb': 1024 * 1024}
+
+
+def parse_timestamp(text):
+    """ Parse a usage date and time, or return ``None``.
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+
+
+def parse_duration(text):
+    """ Parse a call duration such as ``0:02:15`` or ``2m 15s`` to seconds.
+    """
+    if ':' in text:
+        seconds = 0
+        for part in text.split(':'):
+            if not part.strip().isdigit():
+                return None
+            seconds = seconds * 60 + int(part)
+        return seconds
+    parts = re.findall(r'(\d+)\s*([hms])', text.lower())
+    if parts:
+        return sum(int(value) * DURATION_UNITS[unit] for value, unit in parts)
+
+
+def parse_volume(text):
+    """ Parse a data volume such as ``1.5 MB`` to kilobytes.
+    """
+    match = re.search(r'([\d.]+)\s*([kmg]?b)\b', text.lower())
+    if match:
+        return float(match.group(1)) * VOLUME_UNITS[match.group(2)]
+
+
+def parse_cost(text):
+    """ Parse a charge such as ``$0.25`` or ``Free`` to dollars.
+
+    Refunds and credits, written ``-$1.50``, ``$-1.50`` or ``($1.50)``,
+    are negative.
+    """
+    if 'free' in text.lower() or 'included' in text.lower():
+        return 0.0
+    match = re.search(r'(\()?\s*(-)?\s*\$?\s*(-)?\s*(\d+(?:\.\d+)?)\s*(\))?',
+                      text.replace(',', ''))
+    if match:
+        opened, minus, inner_minus, value, closed = match.groups()
+        negative = bool(minus or inner_minus or (opened and closed))
+        return -float(value) if negative else float(value)
+
+
+def classify(description, quantity):
+    """ Determine the kind of a usage record from its description, falling
+    back to its quantity's units.
+    """
+    description = description.lower()
+    for kind, keywords in KIND_KEYWORDS:
+        if any(keyword in description for keyword in keywords):
+            return kind
+    if parse_volume(quantity) is not None:
+        return DATA
+    if parse_duration(quantity) is not None:
+        return CALL
+    return OTHER
+
+
+class UsageRecord(object):
+    """ One call, SMS, data session or other charge from usage history.
+
+    :attr:`quantity` is seconds for calls, kilobytes for data and the
+    number of messages for SMS, and :attr:`cost` is in dollars.  Either is
+    ``None`` if it could not be parsed; :attr:`cells` keeps the row's text.
+    """
+
+    def __init__(self, kind, timestamp, description, destination, quantity,
+                 cost, cells=None):
+        self.kind = kind
+        self.timestamp = timestamp
+        self.description = description
+        self.destination = destination
+        self.quantity = quantity
+        self.cost = cost
+        self.cells = cells
+
+    @classmethod
+    def from_cells(cls, cells, columns=DEFAULT_COLUMNS):
+        """ Build a record from a table row's cell text.
+
+        :param columns: Mapping of field names to cell indices.
+        """
+        def cell(field):
+            index = columns.get(field)
+            return cells[index] if index is not None and \
+                index < len(cells) else ''
+
+        when = ' '.join(filter(None, (cell('date'), cell('time'))))
+        description = cell('description')
+        quantity = cell('quantity')
+        kind = classify(description, quantity)
+        if kind == DATA:
+            amount = parse_volume(quantity)
+        elif kind == SMS:
+            amount = int(quantity) if quantity.isdigit() else 1
+        else:
+            amount = parse_duration(quantity)
+        return cls(kind, parse_timestamp(when), description,
+                   cell('destination') or None, amount,
+                   parse_cost(cell('cost')), cells)
+
+    def __repr__(self):
+        return '<UsageRecord %s %s %s>' % (self.kind, self.timestamp,
+                                           self.cost)
+
+
+def header_columns(cells):
+    """ Map record fields to column indices from a table's header cells.
+    """
+    columns = {}
+    for index, cell in enumerate(cells):
+        words = re.findall(r'\w+', cell.lower())
+        for field, keywords in COLUMN_KEYWORDS:
+            if field not in columns and \
+                    any(keyword in words for keyword in keywords):
+                columns[field] = index
+                break
+    return columns or DEFAULT_COLUMNS
+
+
+class TableRowParser(HTMLParser):
+    """ Incremental parser collecting the text of each table row.
+
+    Completed rows are queued on :attr:`rows` as ``(header, cells)``
+    pairs, where ``header`` is whether the row has ``th`` cells.
+    Unclosed cells and rows are closed by the next one or the end of the
+    table.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.rows = deque()
+        self._row = None
+        self._cell = None
+        self._header = False
+
+    def _close_cell(self):
+        if self._cell is not None:
+            self._row.append(' '.join(''.join(self._cell).split()))
+            self._cell = None
+
+    def _close_row(self):
+        if self._row is not None:
+            self._close_cell()
+            self.rows.append((self._header, self._row))
+            self._row = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._close_row()
+            self._row = []
+            self._header = False
+        elif tag in ('td', 'th') and self._row is not None:
+            self._close_cell()
+            self._cell = []
+            self._header = self._header or tag == 'th'
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th'):
+            if self._row is not None:
+                self._close_cell()
+        elif tag in ('tr', 'thead', 'tbody', 'table'):
+            self._close_row()
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+class PukParser(HTMLParser):
+    """ Incremental parser finding the text of ``<span class="puk">``.
+
+    :attr:`puk` is set as soon as the span closes.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.puk = None
+        self._text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'span' and self.puk is None and \
+                'puk' in (dict(attrs).get('class') or '').split():
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag == 'span' and self._text is not None:
+            self.puk = ''.join(self._text).strip()
+            self._text = None
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+
+def iter_text(chunks, encoding='utf-8'):
+    """ Decode an iterable of byte or text chunks incrementally.
+
+    Multi-byte characters split across chunks are decoded once complete.
+    """
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')('replace')
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_table_rows(chunks, encoding='utf-8'):
+    """ Parse table rows from chunks of HTML as they arrive.
+
+    :returns: Generator of ``(header, cells)`` pairs.
+    """
+    parser = TableRowParser()
+    for text in iter_text(chunks, encoding):
+        parser.feed(text)
+        while parser.rows:
+            yield parser.rows.popleft()
+    parser.close()
+    while parser.rows:
+        yield parser.rows.popleft()
+
+
+def iter_usage(chunks, encoding='utf-8'):
+    """ Parse the prepaid usage fragment into records as it downloads.
+
+    Columns are identified from the table's header row where there is one.
+    Rows with fewer than two cells, such as notes and totals, are skipped.
+
+    :param chunks: Iterable of byte or text chunks of the fragment.
+    :returns: Generator of :class:`UsageRecord`.
+    """
+    columns = DEFAULT_COLUMNS
+    for header, cells in iter_table_rows(chunks, encoding):
+        if header:
+            columns = header_columns(cells)
+        elif len([cell for cell in cells if cell]) >= 2:
+            yield UsageRecord.from_cells(cells, columns)
+
+
+def find_puk(chunks, encoding='utf-8'):
+    """ Find the PUK in chunks of the plan details page, reading no further
+    than the PUK itself.
+
+    :returns: The PUK, or ``None`` if the page has none.
+    """
+    parser = PukParser()
+    for text in iter_text(chunks, encoding):
+        parser.feed(text)
+        if parser.puk is not None:
+            return parser.puk
+    parser.close()
+    return parser.puk
@@ -1 +1,216 @@
 #
+import atexit
+import logging
+import os
+import sys
+
+from telstra.mobile.config import BROKER_SOCKET_PATH, DISCOVERY_CACHE_PATH, \
+    DISCOVERY_CACHE_TTL, MENU_MAP_PATH, ROUTER_STATE_PATH, STORE_PATH, \
+    WEB_SESSION_PATH
+from telstra.mobile import stats
+
+# Subsystems are imported where used, so a script only loads the modem,
+# broker or storage stacks that its options actually need.
+
+log = logging.getLogger(__name__)
+
+
+def add_account_arguments(parser):
+    """ Add the options shared by scripts for obtaining an account.
+    """
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=1,
+                        help='Number of serial ports to probe concurrently '
+                             'when auto-detecting the modem.')
+    parser.add_argument('--discovery-cache',
+                        nargs='?',
+                        const=DISCOVERY_CACHE_PATH,
+                        help='Remember which serial port holds each phone '
+                             'number in this file, optionally given.')
+    parser.add_argument('--discovery-ttl',
+                        type=int,
+                        default=DISCOVERY_CACHE_TTL,
+                        help='Seconds before a remembered serial port must '
+                             'be re-detected.')
+    parser.add_argument('-b', '--broker',
+                        nargs='?',
+                        const=BROKER_SOCKET_PATH,
+                        help='Use the account held by a running modem-broker '
+                             'on this socket, optionally given, rather than '
+                             'opening the modem directly.')
+    parser.add_argument('--menu-map',
+                        nargs='?',
+                        const=MENU_MAP_PATH,
+                        help='Jump straight to menu options using the #100# '
+                             'menu map in this file, optionally given.')
+    parser.add_argument('--crawl',
+                        action='store_true',
+                        help='Crawl the read-only branches of the #100# menu '
+                             'to create or replace the --menu-map file.')
+
+
+def add_stats_arguments(parser):
+    """ Add the option for dumping operation statistics.
+    """
+    parser.add_argument('--stats',
+                        nargs='?',
+                        const='-',
+                        help='Time modem and USSD operations and write the '
+                             'results in Prometheus text format to this '
+                             'file, or standard error if not given.')
+
+
+def add_store_arguments(parser):
+    """ Add the option for recording observations.
+    """
+    parser.add_argument('--store',
+                        nargs='?',
+                        const=STORE_PATH,
+                        help='Record balance and expiry observations in '
+                             'this SQLite database, optionally given.')
+
+
+def add_web_arguments(parser, password_options=('-p', '--password')):
+    """ Add the options for reading from Telstra's web services.
+    """
+    parser.add_argument(
+        '-u', '--user',
+        help='User ID to authenticate to Telstra\'s web services.')
+    parser.add_argument(
+        *password_options,
+        dest='password',
+        help='Account password for authentication to Telstra\'s web services.')
+    parser.add_argument(
+        '--web-session', nargs='?', const=WEB_SESSION_PATH,
+        help='Reuse the web login session stored in this file, optionally '
+             'given, logging in again only once it has expired.')
+    parser.add_argument(
+        '--router-state', nargs='?', const=ROUTER_STATE_PATH,
+        help='Keep measured web and modem read costs in this file, '
+             'optionally given, so later runs start from them.')
+
+
+def open_store(config):
+    """ Open the observation store if requested.
+
+    :rtype: :class:`telstra.mobile.store.ObservationStore` or ``None``
+    """
+    if not config.store:
+        return None
+    from telstra.mobile.store import ObservationStore
+    return ObservationStore(config.store)
+
+
+def enable_stats(config):
+    """ Enable statistics collection if requested, dumping them at exit.
+    """
+    if not config.stats:
+        return
+
+    collected = stats.enable()
+
+    def dump():
+        text = collected.prometheus()
+        if config.stats == '-':
+            # Keep standard output for the command's own results
+            sys.stderr.write(text)
+        else:
+            with open(config.stats, 'w') as stats_file:
+                stats_file.write(text)
+
+    atexit.register(dump)
+    return collected
+
+
+def load_account(config, phone_number=None):
+    """ Obtain the account for ``phone_number`` as the options direct.
+
+    :returns: Account ready for use with ``contextlib.closing``, or ``None``
+        if no suitable account could be found.
+    """
+    if config.broker:
+        from telstra.mobile.broker import BrokerClient
+        return BrokerClient(config.broker).account(
+            phone_number, max_age=getattr(config, 'max_age', None))
+
+    from telstra.mobile.account import autodetect_account
+    cache = None
+    if config.discovery_cache:
+        from telstra.mobile.discovery import DiscoveryCache
+        cache = DiscoveryCache(config.discovery_cache, config.discovery_ttl)
+    account = autodetect_account(phone_number=phone_number,
+                                 workers=config.workers,
+                                 cache=cache)
+
+    if account and config.menu_map:
+        from telstra.mobile.menu import MenuMap, crawl
+        if config.crawl:
+            log.info('Crawling #100# menu into %s' % config.menu_map)
+            account.menu_map = crawl(account)
+            account.menu_map.save(config.menu_map)
+        elif os.path.exists(config.menu_map):
+            account.menu_map = MenuMap.load(config.menu_map)
+        else:
+            log.warning('No menu map at %s; walking menus instead.  Pass '
+                        '--crawl to create it.' % config.menu_map)
+    return account
+
+
+def load_accounts(config, phone_numbers=None):
+    """ Obtain every account, or those for ``phone_numbers``, as the options
+    direct.
+
+    Modems are detected once, probing ``config.workers`` ports at a time.
+
+    :returns: List of accounts ready for use with ``contextlib.closing``.
+    """
+    if config.broker:
+        from telstra.mobile.broker import BrokerClient
+        client = BrokerClient(config.broker)
+        max_age = getattr(config, 'max_age', None)
+        return [client.account(phone_number, max_age=max_age)
+                for phone_number in client.accounts()
+                if not phone_numbers or phone_number in phone_numbers]
+    from telstra.mobile.account import autodetect_accounts
+    return autodetect_accounts(phone_numbers=phone_numbers,
+                               workers=config.workers)
+
+
+def load_router(config, phone_number=None, web_phone_number=None):
+    """ Build a read router over the web API, if a user is given, and the
+    account for ``phone_number``, which is only opened if it is read from.
+
+    :param web_phone_number: Service to read from the web API; the login's
+        default service if ``None``.
+
+    Backend latencies and error rates are kept in the ``--router-state``
+    file if given; otherwise every run starts from the initial estimates.
+    :returns: The :class:`telstra.mobile.router.ReadRouter` and a list of
+        the accounts it opened, for the caller to close.
+    """
+    from telstra.mobile.router import ReadRouter, ussd_backend, web_backend
+    backends = []
+    if config.user:
+        from telstra.mobile.web import TelstraWebApi, WebSessionStore
+        session_store = None
+        if config.web_session:
+            session_store = WebSessionStore(config.web_session)
+        try:
+            api = TelstraWebApi(config.user, config.password,
+                                session_store=session_store)
+        except Exception as exc:
+            log.warning('Could not log in to web services: %s' % exc)
+        else:
+            backends.append(web_backend(api, web_phone_number))
+
+    opened = []
+
+    def open_account():
+        account = load_account(config, phone_number)
+        if account:
+            opened.append(account)
+        return account
+
+    backends.append(ussd_backend(open_account))
+    return ReadRouter(backends, state_path=config.router_state), opened
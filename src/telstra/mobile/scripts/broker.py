@@ -0,0 +1,66 @@
+import argparse
+import logging
+
+from telstra.mobile.account import autodetect_accounts
+from telstra.mobile.broker import BrokerError, ModemBroker
+from telstra.mobile.config import LOG_FORMAT, BROKER_SOCKET_PATH, \
+    REFRESH_INTERVAL
+
+log = logging.getLogger(__name__)
+
+
+def main():
+    """ Keep all detected modems connected and serve them on a local socket.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-s', '--socket',
+                        default=BROKER_SOCKET_PATH,
+                        help='Unix-domain socket to listen on.')
+    parser.add_argument('-p', '--phone-number',
+                        action='append',
+                        help='Only serve this phone number. May be given '
+                             'multiple times; all accounts are served '
+                             'otherwise.')
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=1,
+                        help='Number of serial ports to probe concurrently '
+                             'when auto-detecting modems.')
+    parser.add_argument('-r', '--refresh-interval',
+                        type=int,
+                        nargs='?',
+                        const=REFRESH_INTERVAL,
+                        help='Refresh each account\'s balance and expiry '
+                             'snapshot in the background this often, in '
+                             'seconds, so readers using --max-age rarely '
+                             'see a stale one.')
+
+    # TODO Make logging configurable via verbosity
+    parser.add_argument('-v', '--verbose',
+                        action='count',
+                        default=0,
+                        help='Increase verbosity of logging.')
+
+    config = parser.parse_args()
+
+    log_level = logging.CRITICAL - config.verbose * 10
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+
+    accounts = autodetect_accounts(phone_numbers=config.phone_number,
+                                   workers=config.workers)
+    if not accounts:
+        log.critical("Couldn't detect any suitable modems or accounts.")
+        exit(1)
+
+    broker = ModemBroker(accounts, refresh_interval=config.refresh_interval)
+    try:
+        broker.serve(config.socket)
+    except KeyboardInterrupt:
+        pass
+    except BrokerError as exc:
+        log.critical(str(exc))
+        exit(1)
+    finally:
+        broker.close()
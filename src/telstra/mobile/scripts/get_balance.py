@@ -1,14 +1,79 @@
 import argparse
-from contextlib import closing
-from datetime import datetime, timedelta
+import csv
+import itertools
+import json
 import logging
-import os
+import sys
+import time
 
-from telstra.mobile import autodetect_account
 from telstra.mobile.config import LOG_FORMAT
+from telstra.mobile.poll import POLL_FIELDS, poll_accounts
+from telstra.mobile.scripts import add_account_arguments, \
+    add_stats_arguments, add_store_arguments, add_web_arguments, \
+    enable_stats, load_accounts, load_router, open_store
 
 log = logging.getLogger(__name__)
 
+RESULT_FIELDS = ('phone_number', 'port') + POLL_FIELDS + ('elapsed', 'error')
+
+
+def format_result(result, output_format):
+    """ Format a polling result as text, a JSON line or a CSV row.
+    """
+    result = dict((field, result.get(field)) for field in RESULT_FIELDS)
+    if result['expiry_date']:
+        result['expiry_date'] = result['expiry_date'].isoformat()
+    if output_format == 'json':
+        return json.dumps(result, sort_keys=True)
+    elif output_format == 'csv':
+        return [result[field] for field in RESULT_FIELDS]
+    elif result['error']:
+        return 'Failed to get balance for %s: %s' % (result['phone_number'],
+                                                     result['error'])
+    return 'Credit balance for %s is $%s.' % (result['phone_number'],
+                                              result['balance'])
+
+
+def poll(config, store=None):
+    """ Poll every requested account at once, printing each as it finishes.
+    """
+    accounts = load_accounts(config, config.phone_number)
+    if not accounts:
+        log.critical("Couldn't detect any suitable modems or accounts.")
+        exit(1)
+
+    writer = None
+    if config.format == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(RESULT_FIELDS)
+
+    detected = set(account.phone_number for account in accounts)
+    missing = [{'phone_number': phone_number, 'error': 'Not detected.'}
+               for phone_number in config.phone_number or []
+               if phone_number not in detected]
+
+    failed = bool(missing)
+    try:
+        for result in itertools.chain(missing, poll_accounts(accounts)):
+            failed = failed or bool(result['error'])
+            if store and not result['error']:
+                store.observe(result['phone_number'],
+                              balance=result['balance'],
+                              expiry_date=result['expiry_date'],
+                              source='broker' if config.broker else 'ussd')
+            line = format_result(result, config.format)
+            if writer:
+                writer.writerow(line)
+            else:
+                print(line)
+            sys.stdout.flush()
+    finally:
+        for account in accounts:
+            account.close()
+
+    if failed:
+        exit(1)
+
 
 def main():
     """ Get the balance of Telstra account.
@@ -17,9 +82,35 @@ def main():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument('-p', '--phone-number',
+                        action='append',
                         help='Get balance for this phone number. '
                              'This auto-detects the correct modem '
-                             ' to handle when multiple devices are installed.')
+                             ' to handle when multiple devices are installed. '
+                             'Give more than once to poll several numbers '
+                             'concurrently.')
+    parser.add_argument('-a', '--all',
+                        action='store_true',
+                        help='Poll balance and expiry of every account on '
+                             'every modem concurrently.')
+    parser.add_argument('-f', '--format',
+                        choices=('text', 'json', 'csv'),
+                        default='text',
+                        help='Output format.  JSON lines and CSV rows '
+                             'include the expiry date, and are written as '
+                             'each account finishes.')
+
+    parser.add_argument('-m', '--max-age',
+                        type=int,
+                        help='Answer at once from a balance seen within this '
+                             'many seconds.  With --broker, the broker\'s '
+                             'snapshot is used however old, and refreshed in '
+                             'the background if older than this; otherwise '
+                             'a recent enough --store observation is used.')
+
+    add_account_arguments(parser)
+    add_stats_arguments(parser)
+    add_store_arguments(parser)
+    add_web_arguments(parser, password_options=('--password',))
 
     # TODO Make logging configurable via verbosity
     parser.add_argument('-v', '--verbose',
@@ -31,17 +122,44 @@ def main():
 
     log_level = logging.CRITICAL - config.verbose * 10
     logging.basicConfig(level=log_level, format=LOG_FORMAT)
+    enable_stats(config)
+
+    store = open_store(config)
+    if config.all or len(config.phone_number or []) > 1 or \
+            config.format != 'text':
+        return poll(config, store)
+
+    phone_number = config.phone_number[0] if config.phone_number else None
+    if config.max_age is not None and store and phone_number and \
+            not config.broker:
+        from telstra.mobile.store import BALANCE
+        latest = store.latest(phone_number, BALANCE)
+        if latest and time.time() - latest[0] <= config.max_age:
+            print('Credit balance for %s is $%s.' % (phone_number, latest[1]))
+            return
 
-    # Automatically close modem after finishing
-    account = autodetect_account(phone_number=config.phone_number)
-    if not account:
-        log.critical("Couldn't detect a suitable modem or account.")
+    # Read from the web API or the modem, whichever is cheaper, closing the
+    # modem if it was opened
+    from telstra.mobile.router import USSD, ReadError
+    router, readers = load_router(config, phone_number, phone_number)
+    try:
+        reading = router.read(config.max_age)
+        # Identify the account while its modem is still open
+        if phone_number is None and readers:
+            phone_number = readers[0].phone_number
+    except ReadError as exc:
+        log.critical('Warning: failed to get balance. %s' % exc)
         exit(1)
+    finally:
+        for reader in readers:
+            reader.close()
 
-    with closing(account) as account_wrapped:
-        try:
-            balance = account_wrapped.balance
-            print('Credit balance for %s is $%s.' % (config.phone_number or account_wrapped.phone_number, balance))
-        except:
-            log.error('Warning: failed to get balance.')
-            raise
+    print('Credit balance for %s is $%s.' % (
+        phone_number or 'default service', reading.balance))
+    if store and phone_number:
+        source = reading.source
+        if source == USSD and config.broker:
+            source = 'broker'
+        store.observe(phone_number, balance=reading.balance,
+                      expiry_date=reading.expiry_date,
+                      timestamp=reading.timestamp, source=source)
@@ -1,11 +1,15 @@
 import argparse
 from contextlib import closing
+import csv
 from datetime import datetime, timedelta
 import logging
 import os
 
-from telstra.mobile import autodetect_account, TelstraWebApi
-from telstra.mobile.config import LOG_FORMAT
+from telstra.mobile.config import CREDITME2U_DAILY_LIMIT, LEDGER_PATH, \
+    LOG_FORMAT
+from telstra.mobile.scripts import add_account_arguments, \
+    add_stats_arguments, add_store_arguments, add_web_arguments, \
+    enable_stats, load_account, load_router, open_store
 
 log = logging.getLogger(__name__)
 
@@ -20,6 +24,22 @@ def exit_critical(message):
     exit(1)
 
 
+def parse_transfer(value):
+    """ Parse a ``NUMBER:AMOUNT`` transfer argument.
+    """
+    phone_number, _, amount = value.partition(':')
+    return phone_number.strip(), amount.strip() or 1
+
+
+def read_transfers(path):
+    """ Read ``number,amount`` transfers from a CSV file.
+    """
+    with open(path) as transfers_file:
+        return [(row[0].strip(), row[1].strip() if len(row) > 1 else 1)
+                for row in csv.reader(transfers_file)
+                if row and not row[0].startswith('#')]
+
+
 def main():
     """ Send credit to someone via Telstra's CreditMe2U service.
 
@@ -53,12 +73,7 @@ def main():
         '-d', '--date-limit', type=float,
         help='Send credit if target account\'s expiry is less than or equal '
              'to this many days away.')
-    responsive_parser.add_argument(
-        '-u', '--user',
-        help='User ID to authenticate to Telstra\'s web services.')
-    responsive_parser.add_argument(
-        '-p', '--password',
-        help='Account password for authentication to Telstra\'s web services.')
+    add_web_arguments(responsive_parser)
 
     # Options for time-based operation
     periodic_parser = subparsers.add_parser(
@@ -74,9 +89,23 @@ def main():
         '-t', '--datetime-format', default='%Y-%m-%dT%H:%M:%S.%f',
         help='Format of datetime object to use.')
 
+    # Options for sending to many recipients
+    batch_parser = subparsers.add_parser(
+        'batch',
+        help='send credit to many recipients in one session')
+    batch_parser.add_argument(
+        '-t', '--transfer', type=parse_transfer, action='append', default=[],
+        help='Transfer to send, as NUMBER:AMOUNT.  May be repeated.')
+    batch_parser.add_argument(
+        '-i', '--input',
+        help='CSV file of transfers to send, one NUMBER,AMOUNT per line.')
+    batch_parser.add_argument(
+        '-s', '--sent-today', type=int, default=0,
+        help='Dollars already transferred today, counted towards the '
+             '$%d daily limit.' % CREDITME2U_DAILY_LIMIT)
+
     # General options for sending creit
     parser.add_argument('-o', '--phone-number',
-                        required=True,
                         help='Phone number to send credit to.')
     parser.add_argument('-a', '--amount',
                         type=int,
@@ -86,6 +115,15 @@ def main():
                         help='Send credit from this phone number. '
                              'This auto-detects the correct modem '
                              ' to handle when multiple devices are installed.')
+    parser.add_argument('--ledger', nargs='?', const=LEDGER_PATH,
+                        help='Record transfers and balances in this ledger '
+                             'file, refusing transfers that would exceed '
+                             'the daily limit or balance before dialling. '
+                             'Without a path, %s is used.' % LEDGER_PATH)
+
+    add_account_arguments(parser)
+    add_stats_arguments(parser)
+    add_store_arguments(parser)
 
     # TODO Make logging configurable via verbosity
     parser.add_argument('-v', '--verbose',
@@ -94,30 +132,54 @@ def main():
                         help='Increase verbosity of logging.')
 
     config = parser.parse_args()
+    if config.mode == 'batch':
+        if config.input:
+            config.transfer += read_transfers(config.input)
+        if not config.transfer:
+            parser.error('batch mode requires --transfer or --input.')
+    elif not config.phone_number:
+        parser.error('argument -o/--phone-number is required.')
 
     log_level = logging.CRITICAL - config.verbose * 10
     logging.basicConfig(level=log_level, format=LOG_FORMAT)
+    enable_stats(config)
 
     if config.mode == 'immediate':
         # Just send credit right now regardless
         pass
     if config.mode == 'responsive':
-        # Check the specified command-line conditions
-        api = TelstraWebApi(config.user, config.password)
+        # Check the specified command-line conditions, reading the target
+        # service from the web API or, failing that, its own modem
+        from telstra.mobile.router import ReadError
+        store = open_store(config)
+        router, readers = load_router(config, config.phone_number)
+        try:
+            reading = router.read()
+        except ReadError as exc:
+            exit_critical('Could not read balance: %s' % exc)
+        finally:
+            for reader in readers:
+                reader.close()
+        if store:
+            store.observe(config.phone_number,
+                          balance=reading.balance,
+                          expiry_date=reading.expiry_date,
+                          timestamp=reading.timestamp,
+                          source=reading.source)
         if config.credit_limit:
-            balance = api.prepaid_balance()
+            balance = reading.balance
             if balance is None:
-                exit_critical('Online API is unavailable.')
+                exit_critical('Balance is unavailable.')
             elif balance > config.credit_limit:
                 exit_log('Credit balance of $%f exceeds $%f.' % (
                     balance, config.credit_limit))
 
         if config.date_limit:
             date_delta = timedelta(days=config.date_limit)
-            expiry = api.prepaid_expiry()
+            expiry = reading.expiry_date
             now = datetime.now()
             if expiry is None:
-                exit_critical('Online API is unavailable.')
+                exit_critical('Expiry date is unavailable.')
             elif (expiry - date_delta) > now:
                 exit_log('Expiry date of %s exceeds %s plus %s days.' % (
                     expiry, now, config.date_limit))
@@ -139,16 +201,39 @@ def main():
     log.info('Conditions passed. Auto-detecting account.')
 
     # Automatically close modem after finishing
-    account = autodetect_account(phone_number=config.from_number)
+    account = load_account(config, config.from_number)
     if not account:
         log.critical("Couldn't detect a suitable modem or account.")
         exit(1)
 
+    ledger = None
+    if config.ledger:
+        from telstra.mobile.ledger import TransferLedger
+        ledger = TransferLedger(config.ledger)
+
+    if config.mode == 'batch':
+        from telstra.mobile.transfer import FAILED, send_credits
+        with closing(account) as account_wrapped:
+            results = send_credits(account_wrapped, config.transfer,
+                                   sent_today=config.sent_today,
+                                   ledger=ledger)
+        for result in results:
+            print('%s $%d: %s (%s)' % (result.phone_number, result.amount,
+                                       result.status, result.message))
+        if any(result.status == FAILED for result in results):
+            exit_critical('Warning: failed to send credit to some phones.')
+        return
+
     with closing(account) as account_wrapped:
         log.info('Running send credit script...')
         try:
-            result = account_wrapped.creditme2u(config.phone_number,
-                                                amount=config.amount)
+            if ledger:
+                result = ledger.creditme2u(account_wrapped,
+                                           config.phone_number,
+                                           config.amount)
+            else:
+                result = account_wrapped.creditme2u(config.phone_number,
+                                                    amount=config.amount)
             # Write out the current date and time to prevent re-running
             if config.mode == 'periodic' and config.data_location:
                 now = datetime.now()
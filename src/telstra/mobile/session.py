@@ -0,0 +1,251 @@
+import logging
+import time
+
+from gsmmodem.exceptions import CommandError, InvalidStateException, \
+    TimeoutException
+
+from telstra.mobile.account import AccountSnapshot, CREDITME2U_LABELS, \
+    find_option
+from telstra.mobile.menu import shortcode
+
+log = logging.getLogger(__name__)
+
+HOME_LABELS = ('Home',)
+SESSION_IDLE_TIMEOUT = 60
+
+
+class SessionExpired(Exception):
+    """ The network ended the USSD session.
+    """
+
+
+class MenuSession(object):
+    """ Hold one ``#100#`` USSD session open and move between menu nodes.
+
+    Rather than cancelling and redialling ``#100#`` for every operation,
+    the session returns to the main menu via its ``Home`` option and
+    descends from there.  When the network has ended the session, either
+    because a reply failed or because it sat idle for longer than
+    ``idle_timeout`` seconds, a new session is opened transparently.
+
+    Use as a context manager to cancel the session when finished::
+
+        with MenuSession(account) as session:
+            balance = session.snapshot().balance
+            credits = session.query(['Bal Details', 'Call Cred Bal']).message
+    """
+
+    def __init__(self, account, idle_timeout=SESSION_IDLE_TIMEOUT):
+        """ Initialise the session.
+
+        :param account: :class:`telstra.mobile.account.TelstraAccount`
+        :param idle_timeout: Seconds after which an idle session is assumed
+            to have been ended by the network.
+        """
+        self.account = account
+        self.idle_timeout = idle_timeout
+        self.response = None
+        self.path = []
+        self.options = []
+        self.last_activity = None
+        self.sessions_opened = 0
+        self._creditme2u_code = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def active(self):
+        """ Whether the session is believed to still be open.
+        """
+        return self.response is not None and \
+            getattr(self.response, 'sessionActive', True) and \
+            time.time() - self.last_activity < self.idle_timeout
+
+    def close(self):
+        """ Cancel the USSD session.
+        """
+        if self.response is not None:
+            try:
+                self.response.cancel()
+            except (CommandError, InvalidStateException, TimeoutException):
+                pass
+        self.response = None
+        self.path = []
+        self.options = []
+
+    def _open(self, labels=()):
+        self.close()
+        self.response = self.account.navigate(labels) if labels \
+            else self.account.main_menu()
+        self.path = list(labels)
+        # Option numbers are only known for levels walked in this session
+        self.options = None if labels else []
+        self.last_activity = time.time()
+        self.sessions_opened += 1
+
+    def _open_shortcode(self, code, labels):
+        """ Open a session at a prompt by dialling its compound shortcode.
+
+        :returns: Whether the prompt was reached.
+        """
+        self.close()
+        try:
+            response = self.account.modem.sendUssd(code)
+        except (CommandError, TimeoutException):
+            return False
+        if self.account.parse_menu(response):
+            # A prompt has no options, so this landed somewhere else
+            try:
+                response.cancel()
+            except (CommandError, InvalidStateException, TimeoutException):
+                pass
+            return False
+        self.response = response
+        self.path = list(labels)
+        self.options = None
+        self.last_activity = time.time()
+        self.sessions_opened += 1
+        return True
+
+    def _reply(self, option):
+        try:
+            self.response = self.response.reply(option)
+        except (CommandError, InvalidStateException, TimeoutException) as exc:
+            self.response = None
+            raise SessionExpired(exc)
+        self.last_activity = time.time()
+
+    def home(self, refresh=False):
+        """ Return to the main menu, opening a session if needed.
+
+        :param refresh: Select Home even if already at the main menu, so
+            the network sends the menu again with current figures.
+        :returns: Main menu USSD response.
+        """
+        if not self.active:
+            self._open()
+        elif self.path or refresh:
+            option = find_option(self.account.parse_menu(self.response),
+                                 HOME_LABELS)
+            try:
+                if option is None:
+                    raise SessionExpired('No Home option available.')
+                self._reply(option)
+                self.path = []
+                self.options = []
+            except SessionExpired:
+                log.debug('Session ended; reopening main menu.')
+                self._open()
+        return self.response
+
+    def goto(self, labels):
+        """ Move to the menu node reached by ``labels`` from the main menu.
+
+        :param labels: As for
+            :meth:`telstra.mobile.account.TelstraAccount.navigate`.
+        :returns: USSD response for the node.
+
+        If the current node is on the way to the target, the session
+        descends from there; otherwise it returns Home first.  Without an
+        open session, a new one is opened straight at the target, with a
+        single compound shortcode when the account has a menu map.
+        """
+        labels = [alternatives if isinstance(alternatives, (tuple, list))
+                  else (alternatives,) for alternatives in labels]
+        labels = [tuple(alternatives) for alternatives in labels]
+
+        if not self.active:
+            self._open(labels)
+            return self.response
+        if labels[:len(self.path)] != self.path:
+            self.home()
+
+        try:
+            for alternatives in labels[len(self.path):]:
+                option = find_option(self.account.parse_menu(self.response),
+                                     alternatives)
+                if not option:
+                    raise ValueError('Could not detect %s as being available.'
+                                     % alternatives[0])
+                self._reply(option)
+                self.path.append(alternatives)
+                if self.options is not None:
+                    self.options.append(option)
+        except SessionExpired:
+            log.debug('Session ended; reopening at %s.' % (labels,))
+            self._open(labels)
+        return self.response
+
+    def back(self):
+        """ Move up one level towards the main menu.
+
+        :returns: USSD response for the parent node.
+        """
+        return self.goto(self.path[:-1])
+
+    def query(self, labels):
+        """ Move to the node reached by ``labels`` and return its response.
+
+        The session stays open on that node for further queries.  If the
+        response is replied to directly, call :meth:`home` before the next
+        query so the session knows where it is.
+        """
+        return self.goto(labels)
+
+    def snapshot(self):
+        """ Take a fresh main menu snapshot within this session.
+
+        The account's own snapshot is updated too, so its ``balance`` and
+        ``expiry_date`` read from it.
+
+        :rtype: :class:`telstra.mobile.account.AccountSnapshot`
+        """
+        snapshot = AccountSnapshot(self.home(refresh=True).message)
+        self.account.set_snapshot(snapshot)
+        return snapshot
+
+    def creditme2u(self, phone_number, amount):
+        """ Send CreditMe2U from within this session.
+
+        See :meth:`telstra.mobile.account.Prepaid.creditme2u`.  The option
+        numbers leading to the CreditMe2U prompt are learnt by the first
+        transfer and dialled as one compound shortcode (such as
+        ``#100*1*2#``) by later ones, so ``#100#`` is dialled at most once
+        per session.  Should the network keep the session open after a
+        transfer, the session stays open and returns Home instead.
+
+        :returns: Successful USSD response.
+        """
+        labels = [('Recharge',), tuple(CREDITME2U_LABELS)]
+        if not self.active and self._creditme2u_code is not None and \
+                not self._open_shortcode(self._creditme2u_code, labels):
+            log.info('Shortcode %s failed; walking menu instead.' %
+                     self._creditme2u_code)
+            self._creditme2u_code = None
+        if not self.active and self.account.menu_map is None:
+            # Walk from the main menu so the option numbers are learnt
+            self.home()
+        self.goto(labels)
+        if self._creditme2u_code is None and self.options:
+            self._creditme2u_code = shortcode(self.options)
+
+        try:
+            response = self.account.creditme2u(phone_number, amount,
+                                               response=self.response)
+        except Exception:
+            self.close()
+            raise
+        self.response = response
+        self.last_activity = time.time()
+        if self.active and find_option(self.account.parse_menu(response),
+                                       HOME_LABELS):
+            # Off the menu tree, so the next goto returns Home first
+            self.path = [(response.message,)]
+            self.options = None
+        else:
+            self.close()
+        return response
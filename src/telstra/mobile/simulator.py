@@ -0,0 +1,255 @@
+""" Simulated Telstra network and modems, for benchmarks and tests.
+
+A :class:`SimulatedModem` behaves like a connected ``GsmModem`` holding a
+Telstra prepaid SIM: it serves the ``#100#`` menu tree (including compound
+shortcodes), ``#150#`` and ``#125#``, with configurable latency and
+failure rates, and counts every round trip made to the network.
+"""
+import random
+import threading
+import time
+
+from gsmmodem.exceptions import CommandError, InvalidStateException, \
+    TimeoutException
+
+
+def default_menu():
+    """ Build a ``#100#`` menu tree resembling Telstra prepaid.
+
+    Nodes have a ``message`` and optional ``options`` mapping replies to
+    child nodes; the ``*`` option accepts any input.  Messages are
+    formatted with the SIM's details and the inputs given so far.
+    """
+    main = {'message': 'Bal:${balance:.2f} *\r\nExp {expiry}\r\n'
+                       '1. Recharge\r\n2. Bal Details\r\n3. My Offer\r\n'
+                       '4. PlusPacks\r\n5. History\r\n00. Home\r\n'
+                       '*charges can take 48hrs'}
+    home = {'00': main}
+
+    confirm = {'message': 'Send ${inputs[1]} to {inputs[0]}?\r\n'
+                          '1. Confirm\r\n00. Home',
+               'options': dict(home, **{'1': {
+                   'message': 'You have sent ${inputs[1]} to {inputs[0]}.'}})}
+    recharge = {'message': 'Recharge\r\n1. Voucher\r\n2. CredMe2U\r\n'
+                           '00. Home',
+                'options': dict(home, **{
+                    '1': {'message': 'Enter voucher PIN'},
+                    '2': {'message': 'Enter mobile number',
+                          'options': {'*': {
+                              'message': 'Enter amount',
+                              'options': {'*': confirm}}}}})}
+
+    credit_pages = {'message': 'Call Cred Bal: ${call_credits:.2f} \r\n'
+                               '1. More\r\n00. Home'}
+    page = credit_pages
+    for number in range(2, 6):
+        child = {'message': 'Call Cred Exp %d Jan 2030\r\n1. More\r\n'
+                            '00. Home' % number}
+        page['options'] = dict(home, **{'1': child})
+        page = child
+    page['message'] = 'No more call credits\r\n00. Home'
+    page['options'] = home
+
+    balances = {'message': 'Balances\r\n1. Main Bal\r\n2. Call Cred Bal\r\n'
+                           '00. Home',
+                'options': dict(home, **{
+                    '1': {'message': 'Main Bal: ${balance:.2f}'},
+                    '2': credit_pages})}
+    offer = {'message': 'My Offer: Prepaid Plus\r\n00. Home',
+             'options': home}
+    packs = {'message': 'No PlusPacks active\r\n00. Home', 'options': home}
+    history = {'message': 'No recent history\r\n00. Home', 'options': home}
+
+    main['options'] = dict(home, **{'1': recharge, '2': balances, '3': offer,
+                                    '4': packs, '5': history})
+    return main
+
+
+class SimulatedSim(object):
+    """ Account details held by a simulated SIM.
+    """
+
+    def __init__(self, phone_number='0412345678', account_number='123456789',
+                 imsi='505010000000001', balance=25.0, call_credits=5.0,
+                 expiry='12 Aug 2030', menu=None):
+        self.phone_number = phone_number
+        self.account_number = account_number
+        self.imsi = imsi
+        self.balance = balance
+        self.call_credits = call_credits
+        self.expiry = expiry
+        self.menu = menu or default_menu()
+
+
+class SimulatedUssd(object):
+
+    def __init__(self, modem, message, session_active):
+        self.modem = modem
+        self.message = message
+        self.sessionActive = session_active
+
+    def reply(self, message):
+        if not self.sessionActive:
+            raise InvalidStateException('USSD session is inactive')
+        return self.modem.sendUssd(message)
+
+    def cancel(self):
+        if self.sessionActive:
+            self.modem.cancel_session()
+
+
+class SimulatedModem(object):
+    """ Modem attached to a simulated Telstra network.
+
+    :param port: Serial port name.
+    :param sim: :class:`SimulatedSim`, or ``None`` for a port without a
+        working modem; connecting to it times out.
+    :param latency: Seconds each USSD round trip takes.
+    :param connect_latency: Seconds taken to connect and register.
+    :param failure_rate: Probability a USSD round trip fails with
+        ``CommandError``.
+    :param timeout_rate: Probability a USSD round trip times out, taking
+        ``timeout`` seconds.
+    :param seed: Seed for the failure randomness.
+    """
+
+    def __init__(self, port, sim=None, latency=0.0, connect_latency=0.0,
+                 failure_rate=0.0, timeout_rate=0.0, timeout=0.0, seed=None,
+                 **options):
+        self.port = port
+        self.sim = sim
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.failure_rate = failure_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.options = options
+        self.random = random.Random(seed)
+        self.node = None
+        self.inputs = []
+        self.dials = self.replies = self.cancels = 0
+        self.connected = False
+
+    @property
+    def round_trips(self):
+        """ Number of USSD requests that waited on the network.
+        """
+        return self.dials + self.replies
+
+    def connect(self, pin=None):
+        if self.sim is None:
+            time.sleep(self.timeout)
+            raise TimeoutException()
+        time.sleep(self.connect_latency)
+        self.connected = True
+
+    def close(self):
+        self.connected = False
+        self.node = None
+
+    @property
+    def imsi(self):
+        return self.sim.imsi
+
+    def _network(self):
+        if self.random.random() < self.timeout_rate:
+            time.sleep(self.timeout)
+            self.node = None
+            raise TimeoutException()
+        time.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            self.node = None
+            raise CommandError('+CUSD')
+
+    def _format(self, message):
+        sim = self.sim
+        return message.format(balance=sim.balance,
+                              call_credits=sim.call_credits,
+                              expiry=sim.expiry, inputs=self.inputs)
+
+    def _child(self, node, option):
+        options = node.get('options', {})
+        child = options.get(option, options.get('*'))
+        if child is None:
+            raise CommandError(option)
+        if option not in options:
+            self.inputs.append(option)
+        return child
+
+    def cancel_session(self):
+        self.cancels += 1
+        self.node = None
+
+    def sendUssd(self, code, responseTimeout=15):
+        if self.node is None or code.startswith('#'):
+            self.dials += 1
+        else:
+            self.replies += 1
+        self._network()
+
+        if code.startswith('#100'):
+            self.inputs = []
+            node = self.sim.menu
+            for option in code.strip('#').split('*')[1:]:
+                node = self._child(node, option)
+        elif self.node is not None:
+            node = self._child(self.node, code)
+        elif code == '#150#':
+            node = {'message': 'Your mobile number is:\r\n%s\r\n'
+                               'Your account number is:\r\n%s' % (
+                                   self.sim.phone_number,
+                                   self.sim.account_number)}
+        elif code == '#125#':
+            node = {'message': 'Bal:${balance:.2f}\r\nExp: {expiry}'}
+        else:
+            raise CommandError(code)
+
+        if node is self.sim.menu:
+            self.inputs = []
+        self.node = node if node.get('options') else None
+        return SimulatedUssd(self, self._format(node['message']),
+                             self.node is not None)
+
+
+class SimulatedNetwork(object):
+    """ Set of serial ports, some holding simulated SIMs.
+
+    Use :meth:`modem_cls` as a stand-in for ``GsmModem`` and
+    :meth:`enumerate` for ``enumerate_serial``; every modem created is kept
+    in :attr:`modems` so round trips can be totalled.
+    """
+
+    def __init__(self, sims, ports=None, **modem_options):
+        """ Initialise the network.
+
+        :param sims: Mapping of port names to :class:`SimulatedSim`.
+        :param ports: All port names, including those without modems.
+            Defaults to the ports in ``sims``.
+        :param modem_options: Keyword arguments for each
+            :class:`SimulatedModem`.
+        """
+        self.sims = sims
+        self.ports = list(ports if ports is not None else sorted(sims))
+        self.modem_options = modem_options
+        self.modems = []
+        self._lock = threading.Lock()
+
+    def enumerate(self):
+        return list(self.ports)
+
+    def modem_cls(self, port, **options):
+        modem = SimulatedModem(port, self.sims.get(port),
+                               **dict(self.modem_options, **options))
+        with self._lock:
+            self.modems.append(modem)
+        return modem
+
+    @property
+    def round_trips(self):
+        return sum(modem.round_trips for modem in self.modems)
+
+    def reset(self):
+        """ Forget all modems created so far.
+        """
+        with self._lock:
+            self.modems = []
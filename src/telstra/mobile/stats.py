@@ -0,0 +1,274 @@
+""" Latency and error instrumentation for modem and USSD operations.
+
+Instrumentation is disabled by default and costs nothing in that state:
+modems are only wrapped in :class:`InstrumentedModem` once :func:`enable`
+has been called, and :func:`timed` functions only check a module global.
+"""
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = 'telstra_mobile'
+
+# Longer numeric replies are free text, such as phone numbers and PINs
+MAX_OPTION_LENGTH = 2
+
+_stats = None
+
+
+def enable(stats=None):
+    """ Enable instrumentation, collecting into ``stats`` or a new instance.
+
+    :rtype: :class:`Stats`
+    """
+    global _stats
+    _stats = stats or Stats()
+    return _stats
+
+
+def disable():
+    """ Disable instrumentation.
+    """
+    global _stats
+    _stats = None
+
+
+def get_stats():
+    """ Obtain the active :class:`Stats`, or ``None`` if disabled.
+    """
+    return _stats
+
+
+def timed(operation):
+    """ Decorate a function so its calls are timed as ``operation``.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            stats = _stats
+            if stats is None:
+                return fn(*args, **kwargs)
+            with stats.timer(operation):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Histogram(object):
+    """ Latency histogram with fixed upper-bound buckets, in seconds.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def cumulative(self):
+        """ Yield ``(upper bound, cumulative count)`` pairs.
+        """
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Stats(object):
+    """ Collection of latency histograms and error counters.
+
+    Each observation is keyed by an operation name, such as ``dial`` or
+    ``reply``, and labels such as the ``modem`` port, USSD ``code`` and
+    menu ``path``.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(operation, labels):
+        return (operation,) + tuple(sorted(labels.items()))
+
+    def observe(self, operation, seconds, **labels):
+        """ Record that ``operation`` took ``seconds``.
+        """
+        key = self._key(operation, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def error(self, operation, error, **labels):
+        """ Count a failure of ``operation`` with the given ``error``.
+        """
+        key = self._key(operation, dict(labels, error=type(error).__name__))
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    @contextmanager
+    def timer(self, operation, **labels):
+        """ Time the enclosed block as ``operation``, counting any error.
+        """
+        start = time.time()
+        try:
+            yield
+        except Exception as exc:
+            self.error(operation, exc, **labels)
+            raise
+        finally:
+            self.observe(operation, time.time() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.errors.clear()
+
+    def summary(self):
+        """ Summarise all observations.
+
+        :returns: List of structures with ``operation``, ``labels``,
+            ``count``, ``sum``, ``mean`` and ``errors`` keys.
+        :rtype: list
+        """
+        with self._lock:
+            histograms = list(self.histograms.items())
+            errors = list(self.errors.items())
+
+        results = {}
+        for key, histogram in histograms:
+            results[key] = {'operation': key[0],
+                            'labels': dict(key[1:]),
+                            'count': histogram.count,
+                            'sum': histogram.sum,
+                            'mean': histogram.mean,
+                            'errors': {}}
+        for key, count in errors:
+            labels = dict(key[1:])
+            error = labels.pop('error')
+            result = results.get(self._key(key[0], labels))
+            if result is not None:
+                result['errors'][error] = count
+        return sorted(results.values(),
+                      key=lambda result: (result['operation'],
+                                          sorted(result['labels'].items())))
+
+    def prometheus(self):
+        """ Render all observations in the Prometheus text format.
+
+        :rtype: str
+        """
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            errors = sorted(self.errors.items())
+
+        name = '%s_operation_seconds' % METRIC_PREFIX
+        lines = ['# HELP %s Latency of modem and USSD operations.' % name,
+                 '# TYPE %s histogram' % name]
+        for key, histogram in histograms:
+            labels = key[1:]
+            for bound, count in histogram.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket%s %d' % (
+                    name, _format_labels(key[0], labels + (('le', le),)),
+                    count))
+            lines.append('%s_sum%s %r' % (name, _format_labels(key[0], labels),
+                                          histogram.sum))
+            lines.append('%s_count%s %d' % (
+                name, _format_labels(key[0], labels), histogram.count))
+
+        name = '%s_operation_errors_total' % METRIC_PREFIX
+        lines += ['# HELP %s Failed modem and USSD operations.' % name,
+                  '# TYPE %s counter' % name]
+        for key, count in errors:
+            lines.append('%s%s %d' % (name, _format_labels(key[0], key[1:]),
+                                      count))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(operation, labels):
+    pairs = (('operation', operation),) + tuple(labels)
+    return '{%s}' % ','.join(
+        '%s="%s"' % (label, str(value).replace('\\', '\\\\')
+                                       .replace('"', '\\"')
+                                       .replace('\n', '\\n'))
+        for label, value in pairs)
+
+
+def _path_step(path, message):
+    """ Label for one reply in a menu path: the option number, or ``*``
+    for free text such as a phone number, amount or PIN.
+
+    Replies after free text answer prompts rather than choose options, so
+    they are masked too.
+    """
+    if message.isdigit() and len(message) <= MAX_OPTION_LENGTH and \
+            '*' not in path.split('>')[1:]:
+        return message
+    return '*'
+
+
+class InstrumentedUssd(object):
+    """ Proxy for a USSD response that times replies and cancellation.
+    """
+
+    def __init__(self, ussd, modem, path):
+        self._ussd = ussd
+        self._modem = modem
+        self.path = path
+
+    def __getattr__(self, name):
+        return getattr(self._ussd, name)
+
+    def reply(self, message):
+        path = '%s>%s' % (self.path, _path_step(self.path, message))
+        with self._modem.stats.timer('reply', modem=self._modem.port,
+                                     path=path):
+            response = self._ussd.reply(message)
+        return InstrumentedUssd(response, self._modem, path)
+
+    def cancel(self):
+        with self._modem.stats.timer('cancel', modem=self._modem.port,
+                                     path=self.path):
+            return self._ussd.cancel()
+
+
+class InstrumentedModem(object):
+    """ Proxy for a modem that times connection and USSD operations.
+
+    Replies are labelled with the menu path taken from the original code,
+    such as ``#100#>1>7``, with free text such as phone numbers masked as
+    ``*``.
+    """
+
+    def __init__(self, modem, stats):
+        self._modem = modem
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._modem, name)
+
+    def connect(self, *args, **kwargs):
+        with self.stats.timer('connect', modem=self.port):
+            return self._modem.connect(*args, **kwargs)
+
+    def sendUssd(self, code, *args, **kwargs):
+        with self.stats.timer('dial', modem=self.port, code=code):
+            response = self._modem.sendUssd(code, *args, **kwargs)
+        return InstrumentedUssd(response, self, code)
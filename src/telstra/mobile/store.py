@@ -0,0 +1,230 @@
+""" Append-only store of timestamped balance and expiry observations.
+
+Observations live in a single SQLite table indexed by service, metric and
+time, so range, latest-value and downsampling queries only touch the rows
+they need and results are streamed from the database rather than loaded
+into memory::
+
+    with ObservationStore() as store:
+        store.observe('0412345678', balance=account.balance,
+                      expiry_date=account.expiry_date)
+        for bucket in store.downsample('0412345678', 'balance', DAY):
+            print(bucket)
+
+Values are floats.  Expiry dates are stored as Unix timestamps; use
+:func:`to_datetime` to convert them back.  Recharges are stored as
+:data:`RECHARGE` observations of their amount at the time they were made,
+so the latest one is the watermark for :func:`sync_recharges`.
+"""
+from datetime import datetime
+import os
+import sqlite3
+import threading
+import time
+
+from telstra.mobile.config import STORE_PATH
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+BALANCE = 'balance'
+EXPIRY = 'expiry'
+RECHARGE = 'recharge'
+
+# Rows read from the database at a time while streaming query results
+FETCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    service TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    value REAL NOT NULL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS observations_series
+    ON observations (service, metric, timestamp);
+"""
+
+
+def to_timestamp(value):
+    """ Convert a ``datetime`` to a Unix timestamp, passing numbers through.
+    """
+    if isinstance(value, datetime):
+        return time.mktime(value.timetuple()) + value.microsecond / 1e6
+    return value
+
+
+def to_datetime(timestamp):
+    """ Convert a stored Unix timestamp, such as an expiry, to ``datetime``.
+    """
+    return datetime.fromtimestamp(timestamp)
+
+
+class ObservationStore(object):
+    """ SQLite-backed time series of observations per service.
+
+    Each observation records a ``service`` (phone number), a ``metric``
+    such as :data:`BALANCE` or :data:`EXPIRY`, when it was made, its value
+    and its ``source``, such as ``ussd`` or ``web``.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        """ Open the store, creating it if needed.
+
+        :param path: Location of the SQLite database, or ``:memory:``.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def record(self, service, metric, value, timestamp=None, source=None):
+        """ Append one observation.
+        """
+        self.record_many([(service, metric, value, timestamp, source)])
+
+    def record_many(self, observations):
+        """ Append ``(service, metric, value, timestamp, source)`` tuples
+        in a single transaction.  A ``timestamp`` of ``None`` means now.
+        """
+        now = time.time()
+        rows = [(service, metric, to_timestamp(value),
+                 now if timestamp is None else to_timestamp(timestamp), source)
+                for service, metric, value, timestamp, source in observations
+                if value is not None]
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    'INSERT INTO observations '
+                    '(service, metric, value, timestamp, source) '
+                    'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def observe(self, service, balance=None, expiry_date=None,
+                timestamp=None, source=None):
+        """ Record a service's balance and expiry date, where known.
+        """
+        self.record_many([(service, BALANCE, balance, timestamp, source),
+                          (service, EXPIRY, expiry_date, timestamp, source)])
+
+    def _query(self, sql, params):
+        with self._lock:
+            cursor = self._connection.execute(sql, params)
+            rows = cursor.fetchmany(FETCH_SIZE)
+        while rows:
+            for row in rows:
+                yield row
+            with self._lock:
+                rows = cursor.fetchmany(FETCH_SIZE)
+
+    @staticmethod
+    def _window(start, end):
+        clauses = ''
+        params = []
+        if start is not None:
+            clauses += ' AND timestamp >= ?'
+            params.append(to_timestamp(start))
+        if end is not None:
+            clauses += ' AND timestamp < ?'
+            params.append(to_timestamp(end))
+        return clauses, params
+
+    def services(self):
+        """ List the services with observations.
+        """
+        return [row[0] for row in self._query(
+            'SELECT DISTINCT service FROM observations ORDER BY service', ())]
+
+    def range(self, service, metric, start=None, end=None):
+        """ Iterate over observations between ``start`` and ``end``.
+
+        :param start: Earliest time, inclusive, as a ``datetime`` or Unix
+            timestamp.  Unbounded by default.
+        :param end: Latest time, exclusive.  Unbounded by default.
+        :returns: Generator of ``(timestamp, value)`` pairs in time order.
+        """
+        clauses, params = self._window(start, end)
+        return self._query(
+            'SELECT timestamp, value FROM observations '
+            'WHERE service = ? AND metric = ?' + clauses +
+            ' ORDER BY timestamp', [service, metric] + params)
+
+    def latest(self, service, metric):
+        """ Obtain the most recent observation.
+
+        :returns: ``(timestamp, value)`` pair, or ``None`` if there are no
+            observations.
+        """
+        for row in self._query(
+                'SELECT timestamp, value FROM observations '
+                'WHERE service = ? AND metric = ? '
+                'ORDER BY timestamp DESC LIMIT 1', (service, metric)):
+            return row
+
+    def downsample(self, service, metric, interval, start=None, end=None):
+        """ Aggregate observations into fixed intervals.
+
+        :param interval: Width of each interval in seconds, such as
+            :data:`HOUR` or :data:`DAY`.  Intervals are aligned to the Unix
+            epoch.
+        :returns: Generator of ``(interval start, count, minimum, maximum,
+            mean)`` tuples for intervals with observations, in time order.
+        """
+        clauses, params = self._window(start, end)
+        return self._query(
+            'SELECT CAST(timestamp / ? AS INTEGER) * ? AS bucket, COUNT(*), '
+            'MIN(value), MAX(value), AVG(value) FROM observations '
+            'WHERE service = ? AND metric = ?' + clauses +
+            ' GROUP BY bucket ORDER BY bucket',
+            [interval, interval, service, metric] + params)
+
+
+def sync_recharges(api, store, phone_number=None):
+    """ Record recharges made since the last sync for ``phone_number``.
+
+    Only recharges newer than the latest one already stored are returned
+    and recorded, so repeated syncs store each recharge once and their
+    work grows with the number of new recharges.
+
+    :param api: :class:`telstra.mobile.web.TelstraWebApi` with access to
+        the service's recharge history.
+    :param store: :class:`ObservationStore` to record to.
+    :param phone_number: Service to sync.  If ``None``, the login's
+        default service is synced and recorded under the number of the
+        login's only service.
+    :returns: New ``(timestamp, amount)`` pairs in time order.
+    :rtype: list
+    :raises ValueError: if ``phone_number`` is ``None`` and the login has
+        several services, so the default service's number is unknown.
+    :raises telstra.mobile.web.ServiceListError: if ``phone_number`` is
+        ``None`` and the service list is unavailable.
+    """
+    service = phone_number
+    if service is None:
+        services = api.services()
+        if not services:
+            from telstra.mobile.web import ServiceListError
+            raise ServiceListError(
+                'Could not list the services under this login.')
+        elif len(services) > 1:
+            raise ValueError('The login has %d services; give the phone '
+                             'number to sync.' % len(services))
+        service = services[0]['phone_number']
+    watermark = store.latest(service, RECHARGE)
+    recharges = api.prepaid_recharge_history(
+        phone_number, since=watermark[0] if watermark else None)
+    store.record_many((service, RECHARGE, amount, timestamp, 'web')
+                      for timestamp, amount in recharges)
+    return recharges
@@ -33,3 +33,66 @@ def dummy_modem_cls(connect_raises=None, valid_ports=None):
             self.closed = True
 
     return DummyModem
+
+
+def dummy_menu_modem_cls(tree, codes=None):
+    """ Define a dummy modem that serves a tree of USSD menus.
+
+    tree: The ``#100#`` menu as a dict with a ``message`` and an optional
+        ``options`` dict mapping replies to child nodes.  The reply ``*``
+        matches any input, such as a phone number at a prompt.
+    codes: Dict of other USSD codes and their one-off response messages.
+
+    Compound shortcodes like ``#100*1*7#`` are resolved through the tree,
+    and every USSD string sent is recorded in ``dialled``.
+    """
+    from gsmmodem.exceptions import CommandError
+
+    class DummyMenuResponse(object):
+
+        def __init__(self, modem, node):
+            self.modem = modem
+            self.message = node['message']
+            self.sessionActive = bool(node.get('options'))
+
+        def reply(self, message):
+            if not self.sessionActive:
+                raise CommandError('USSD session is inactive')
+            return self.modem.sendUssd(message)
+
+        def cancel(self):
+            if self.sessionActive:
+                self.modem.node = None
+                self.sessionActive = False
+
+    class DummyMenuModem(dummy_modem_cls()):
+
+        def __init__(self, *args, **kwargs):
+            super(DummyMenuModem, self).__init__(*args, **kwargs)
+            self.node = None
+            self.dialled = []
+
+        def _child(self, node, option):
+            options = node.get('options', {})
+            child = options.get(option, options.get('*'))
+            if child is None:
+                raise CommandError(option)
+            return child
+
+        def sendUssd(self, code):
+            self.dialled.append(code)
+            if code.startswith('#100'):
+                node = tree
+                for option in code.strip('#').split('*')[1:]:
+                    node = self._child(node, option)
+            elif self.node is not None:
+                node = self._child(self.node, code)
+            elif codes and code in codes:
+                node = {'message': codes[code]}
+            else:
+                raise CommandError(code)
+
+            self.node = node if node.get('options') else None
+            return DummyMenuResponse(self, node)
+
+    return DummyMenuModem
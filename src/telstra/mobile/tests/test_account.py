@@ -2,6 +2,8 @@
 import datetime
 import unittest
 
+from gsmmodem.exceptions import TimeoutException
+
 from telstra.mobile.account import TelstraAccount
 from telstra.mobile.tests import dummy_modem_cls, dummy_enumerate_ports
 
@@ -133,3 +135,131 @@ class TestPrepaidAccount(TestAccount):
         account = self._autodetect_account()
         response = account.creditme2u('0499888777', 10)
     
+
+
+class CountingGsmModem(PrepaidAccountGsmModem):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingGsmModem, self).__init__(*args, **kwargs)
+        self.dialled = []
+
+    def sendUssd(self, code):
+        self.dialled.append(code)
+        return super(CountingGsmModem, self).sendUssd(code)
+
+
+class TestAccountSnapshot(unittest.TestCase):
+
+    def test_snapshot(self):
+        from telstra.mobile.account import AccountSnapshot
+        snapshot = AccountSnapshot(MENU)
+        self.assertEqual(snapshot.balance, 123.45)
+        self.assertEqual(snapshot.expiry_date,
+                         datetime.datetime(2007, 8, 12, 0, 0))
+        self.assertEqual(snapshot.menu['Recharge'], '1')
+        self.assertTrue(snapshot.age >= 0)
+
+    def test_single_dial(self):
+        """ Balance, expiry and menu share one #100# dial.
+        """
+        from telstra.mobile.account import Prepaid
+        account = Prepaid(CountingGsmModem('/dev/ttyS0'))
+        self.assertEqual(account.balance, 123.45)
+        self.assertEqual(account.expiry_date,
+                         datetime.datetime(2007, 8, 12, 0, 0))
+        self.assertEqual(account.main_menu_parsed()['Recharge'], '1')
+        self.assertEqual(account.modem.dialled, ['#100#'])
+
+    def test_refresh(self):
+        from telstra.mobile.account import Prepaid
+        account = Prepaid(CountingGsmModem('/dev/ttyS0'))
+        account.snapshot()
+        account.snapshot(refresh=True)
+        self.assertEqual(len(account.modem.dialled), 2)
+
+        account.invalidate_snapshot()
+        account.balance
+        self.assertEqual(len(account.modem.dialled), 3)
+
+    def test_no_reuse(self):
+        from telstra.mobile.account import Prepaid
+        account = Prepaid(CountingGsmModem('/dev/ttyS0'), snapshot_max_age=0)
+        account.balance
+        account.expiry_date
+        self.assertEqual(len(account.modem.dialled), 2)
+
+
+class UnreadyGsmModem(CountingGsmModem):
+    """ Modem whose network does not report its identity immediately.
+    """
+
+    @wrap_message_response
+    def sendUssd(self, code):
+        self.dialled.append(code)
+        if len(self.dialled) < 3:
+            return 'Service busy\r\nPlease try again later'
+        return 'Your mobile number is:\r\n0412345678\r\nAccount:\r\n987654'
+
+
+class TestIdentity(unittest.TestCase):
+
+    def test_single_dial(self):
+        account = TelstraAccount(CountingGsmModem('/dev/ttyS0'))
+        self.assertEqual(account.phone_number, '0412345678')
+        self.assertEqual(account.account_number, '0412345678')
+        self.assertEqual(account.modem.dialled, ['#150#'])
+
+    def test_retry_until_identified(self):
+        account = TelstraAccount(UnreadyGsmModem('/dev/ttyS0'))
+        identity = account.identity(timeout=1, interval=0.01)
+        self.assertEqual(identity, ('0412345678', '987654'))
+        self.assertEqual(account.modem.dialled, ['#150#'] * 3)
+        self.assertEqual(account.account_number, '987654')
+
+    def test_retry_deadline(self):
+        account = TelstraAccount(UnreadyGsmModem('/dev/ttyS0'))
+        self.assertRaises(TimeoutException, account.identity, timeout=0,
+                          interval=0.01)
+        self.assertEqual(account.modem.dialled, ['#150#'])
+
+
+PAGED = {'message': 'History\r\n1. Calls\r\n00. Home',
+         'options': {'1': {
+             'message': 'Call 1 $1.00 \r\n1. More',
+             'options': {'1': {
+                 'message': 'Call 2 $2.00 \r\n1. More\r\n00. Home',
+                 'options': {'1': {'message': 'Call 3 $3.00 \r\n'},
+                             '00': {'message': 'Home'}}}}}}}
+
+
+class TestPagination(unittest.TestCase):
+
+    def setUp(self):
+        from telstra.mobile.tests import dummy_menu_modem_cls
+        self.account = TelstraAccount(
+            dummy_menu_modem_cls(PAGED)('/dev/ttyS0'))
+
+    def test_process_response_more(self):
+        text = self.account.process_response_more(
+            self.account.navigate(['Calls']))
+        self.assertEqual(text.count('Call'), 3)
+        self.assertEqual(self.account.modem.dialled, ['#100#', '1', '1', '1'])
+
+    def test_iter_pages(self):
+        pages = self.account.iter_pages(self.account.navigate(['Calls']))
+        self.assertTrue(next(pages).message.startswith('Call 1'))
+        self.assertEqual(self.account.modem.dialled, ['#100#', '1'])
+
+    def test_search_pages_stops_early(self):
+        match = self.account.search_pages(self.account.navigate(['Calls']),
+                                          'Call 2 \\$(.*?)\\s')
+        self.assertEqual(match.groups()[0], '2.00')
+        self.assertEqual(self.account.modem.dialled, ['#100#', '1', '1'])
+        # Session was cancelled rather than left on page two
+        self.assertIsNone(self.account.modem.node)
+
+    def test_search_pages_no_match(self):
+        match = self.account.search_pages(self.account.navigate(['Calls']),
+                                          'Call 4')
+        self.assertIsNone(match)
+        self.assertEqual(len(self.account.modem.dialled), 4)
@@ -0,0 +1,175 @@
+import asyncio
+import datetime
+import unittest
+
+from gsmmodem.exceptions import TimeoutException
+
+from telstra.mobile import aio
+from telstra.mobile.tests import dummy_enumerate_ports
+from telstra.mobile.tests.test_account import MENU
+
+
+class DummySerialWriter(object):
+    """ Stand-in for a serial port, answering AT commands like a modem.
+
+    ``ussd`` maps USSD strings to the network's response message.
+    """
+
+    def __init__(self, reader, ussd):
+        self.reader = reader
+        self.ussd = ussd
+        self.written = []
+
+    def _respond(self, *lines):
+        for line in lines:
+            self.reader.feed_data(('%s\r\n' % line).encode('utf-8'))
+
+    def write(self, data):
+        command = data.decode('utf-8').strip()
+        self.written.append(command)
+        if command.startswith('AT+CUSD=1,'):
+            code = command.split('"')[1]
+            message = self.ussd.get(code)
+            if message is None:
+                self._respond('ERROR')
+            else:
+                # Multi-line responses, reported after the OK
+                self._respond('OK', '+CUSD: 1,"%s",15' % message)
+        elif command == 'AT+CPIN?':
+            self._respond('+CPIN: READY', 'OK')
+        else:
+            self._respond('OK')
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def dummy_open_connection(valid_ports, ussd):
+    async def open_connection(port, **options):
+        if port not in valid_ports:
+            raise OSError('No such port %s' % port)
+        reader = asyncio.StreamReader()
+        return reader, DummySerialWriter(reader, ussd)
+    return open_connection
+
+
+USSD = {'#100#': MENU,
+        '#125#': 'Bal:$123.45\r\nExp: 12 Aug 2007',
+        '#150#': 'Your mobile number is:\r\n0412345678\r\n'
+                 'Account:\r\n123456789'}
+
+
+class RecordingUssd(dict):
+    """ USSD responses that record each code requested.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingUssd, self).__init__(*args, **kwargs)
+        self.requested = []
+
+    def get(self, code, default=None):
+        self.requested.append(code)
+        return super(RecordingUssd, self).get(code, default)
+
+
+class TestAsyncAccount(unittest.TestCase):
+
+    def setUp(self):
+        self._open_connection = aio.AsyncModem.__dict__['open_connection']
+        self._enumerate = aio.enumerate_serial
+        aio.AsyncModem.open_connection = staticmethod(
+            dummy_open_connection(['/dev/ttyS1', '/dev/ttyS2'], USSD))
+        aio.enumerate_serial = dummy_enumerate_ports(['/dev/ttyS0',
+                                                      '/dev/ttyS1',
+                                                      '/dev/ttyS2'])
+
+    def tearDown(self):
+        aio.AsyncModem.open_connection = self._open_connection
+        aio.enumerate_serial = self._enumerate
+
+    def _run(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def test_autodetect_modem(self):
+        async def detect():
+            modem = await aio.autodetect_modem()
+            await modem.close()
+            return modem
+        self.assertEqual(self._run(detect()).port, '/dev/ttyS1')
+
+    def test_autodetect_account(self):
+        async def detect():
+            account = await aio.autodetect_account(phone_number='0412345678')
+            result = (account, await account.balance(),
+                      await account.expiry_date(),
+                      await account.account_number())
+            await account.close()
+            return result
+
+        account, balance, expiry, account_number = self._run(detect())
+        self.assertIsInstance(account, aio.AsyncPrepaid)
+        self.assertEqual(balance, 123.45)
+        self.assertEqual(expiry, datetime.datetime(2007, 8, 12, 0, 0))
+        self.assertEqual(account_number, '123456789')
+
+    def test_autodetect_account_missing(self):
+        self.assertIsNone(
+            self._run(aio.autodetect_account(phone_number='0400000000')))
+
+    def test_identity_wording(self):
+        ussd = RecordingUssd(USSD, **{'#150#': 'Phone number:\r\n0412345678'})
+        aio.AsyncModem.open_connection = staticmethod(
+            dummy_open_connection(['/dev/ttyS1'], ussd))
+
+        async def identify():
+            modem = await aio.probe_port('/dev/ttyS1')
+            identity = await aio.AsyncTelstraAccount(modem).identity(
+                timeout=5, interval=1)
+            await modem.close()
+            return identity
+
+        self.assertEqual(self._run(identify()), ('0412345678', '0412345678'))
+        self.assertEqual(ussd.requested, ['#150#'])
+
+    def test_identity_deadline(self):
+        ussd = RecordingUssd(USSD, **{'#150#': 'Service busy\r\nTry later'})
+        aio.AsyncModem.open_connection = staticmethod(
+            dummy_open_connection(['/dev/ttyS1'], ussd))
+
+        async def identify():
+            modem = await aio.probe_port('/dev/ttyS1')
+            try:
+                await aio.AsyncTelstraAccount(modem).identity(timeout=0)
+            finally:
+                await modem.close()
+
+        self.assertRaises(TimeoutException, self._run, identify())
+        self.assertEqual(ussd.requested, ['#150#'])
+
+    def test_main_menu_parsed(self):
+        async def menu():
+            modem = await aio.autodetect_modem()
+            menu = await aio.AsyncTelstraAccount(modem).main_menu_parsed()
+            await modem.close()
+            return menu
+
+        menu = self._run(menu())
+        self.assertEqual(len(menu), 9)
+        self.assertEqual(menu['Recharge'], '1')
+
+    def test_many_accounts_one_loop(self):
+        async def balances():
+            modems = await asyncio.gather(
+                *[aio.probe_port(port) for port in ['/dev/ttyS1',
+                                                    '/dev/ttyS2']])
+            accounts = [aio.AsyncPrepaid(modem) for modem in modems]
+            results = await asyncio.gather(
+                *[account.balance() for account in accounts])
+            for account in accounts:
+                await account.close()
+            return results
+
+        self.assertEqual(self._run(balances()), [123.45, 123.45])
@@ -0,0 +1,223 @@
+import asyncio
+import unittest
+
+from telstra.mobile import aioweb
+from telstra.mobile.web import ServiceListError
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+
+class FakeTelstraServer(object):
+    """ Local HTTP server answering like Telstra's web services.
+
+    Signing on sets a per-user session cookie; the credit summary redirects
+    to the login page unless the request carries the current cookie.
+    """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.balances = {'alice': 10.0, 'bob': 20.0, 'carol': 30.0}
+        self.tokens = {}
+        self.signons = []
+        self.summaries = 0
+        self.active = 0
+        self.peak = 0
+        self.service_list = [
+            {'serviceNumber': '0412 345 678', 'serviceId': 'S1'},
+            {'serviceNumber': '+61 498 765 432', 'serviceId': 'S2'}]
+        self.runner = None
+
+    async def home(self, request):
+        return web.Response(text='<html>Log in</html>',
+                            content_type='text/html')
+
+    async def signon(self, request):
+        form = await request.post()
+        username = form['username']
+        self.signons.append(username)
+        response = web.Response(text='Welcome', content_type='text/html')
+        if form['password'] == 'secret':
+            self.tokens[username] = '%s-%d' % (username, len(self.signons))
+            response.set_cookie('JSESSIONID', self.tokens[username])
+        return response
+
+    async def summary(self, request):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        username = self._user(request)
+        self.summaries += 1
+        # Each login's second service has a dollar more credit
+        balance = self.balances[username] + \
+            (request.query.get('serviceId') == 'S2')
+        return web.json_response({'creditAmount': {'value': balance},
+                                  'creditExpireDate': 1405250719000})
+
+    async def services(self, request):
+        self._user(request)
+        return web.json_response({'result': self.service_list})
+
+    async def plan_details(self, request):
+        self._user(request)
+        puk = '87654321' if request.query.get('serviceId') == 'S2' \
+            else '12345678'
+        return web.Response(text='<span class="puk">%s</span>' % puk,
+                            content_type='text/html')
+
+    def _user(self, request):
+        cookie = request.cookies.get('JSESSIONID')
+        for username, token in self.tokens.items():
+            if cookie == token:
+                return username
+        raise web.HTTPFound('/myaccount/home')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/myaccount/home', self.home)
+        app.router.add_post('/login', self.signon)
+        app.router.add_get('/myaccount/prepaid/getCreditSummaryData.json',
+                           self.summary)
+        app.router.add_get('/myaccount/getServiceList.json', self.services)
+        app.router.add_get('/myaccount/plan-details-pre-paid',
+                           self.plan_details)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        origin = 'http://127.0.0.1:%d' % port
+        return {'https://www.my.telstra.com.au': origin,
+                'https://signon.telstra.com.au': origin}
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class TestAsyncWebApi(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeTelstraServer()
+
+    def _run(self, test, **options):
+        async def run():
+            origins = await self.server.start()
+            try:
+                async with aioweb.AsyncWebPool(origins=origins,
+                                               **options) as pool:
+                    return await test(pool)
+            finally:
+                await self.server.stop()
+        return asyncio.run(run())
+
+    def _fetch_all(self, credentials, **options):
+        async def fetch(pool):
+            return [result async for result in
+                    pool.fetch_summaries(credentials)]
+        return self._run(fetch, **options)
+
+    def test_fetch_summaries(self):
+        results = self._fetch_all([('alice', 'secret'), ('bob', 'secret'),
+                                   ('carol', 'secret')])
+        balances = dict((result['username'], result['balance'])
+                        for result in results)
+        self.assertEqual(balances, self.server.balances)
+        self.assertTrue(all(result['expiry_date'] for result in results))
+        self.assertTrue(all(result['error'] is None for result in results))
+        # Logins and fetches ran concurrently
+        self.assertEqual(self.server.peak, 3)
+
+    def test_limit_per_host(self):
+        self._fetch_all([('alice', 'secret'), ('bob', 'secret'),
+                         ('carol', 'secret')], limit_per_host=1)
+        self.assertEqual(self.server.peak, 1)
+
+    def test_failure(self):
+        results = self._fetch_all([('alice', 'wrong'), ('bob', 'secret')])
+        results = dict((result['username'], result) for result in results)
+        self.assertEqual(results['alice']['error'],
+                         'Credit summary is unavailable.')
+        self.assertIsNone(results['alice']['balance'])
+        self.assertEqual(results['bob']['balance'], 20.0)
+
+    def test_cached(self):
+        async def read(pool):
+            api = pool.api('alice', 'secret')
+            balance = await api.prepaid_balance()
+            expiry = await api.prepaid_expiry()
+            api.invalidate()
+            await api.prepaid_balance()
+            return balance, expiry
+        balance, expiry = self._run(read)
+        self.assertEqual(balance, 10.0)
+        self.assertEqual(expiry.year, 2014)
+        self.assertEqual(self.server.summaries, 2)
+        self.assertEqual(self.server.signons, ['alice'])
+
+    def test_expired(self):
+        async def read(pool):
+            api = pool.api('alice', 'secret')
+            await api.prepaid_balance()
+            # The server forgets the session
+            self.server.tokens['alice'] = 'expired'
+            return await api.prepaid_summary(refresh=True)
+        summary = self._run(read)
+        self.assertEqual(summary.balance, 10.0)
+        self.assertEqual(self.server.signons, ['alice', 'alice'])
+
+    def test_services(self):
+        async def read(pool):
+            api = pool.api('alice', 'secret')
+            summaries = await api.prepaid_summaries()
+            second = await api.prepaid_summary('0498 765 432')
+            unknown = await api.prepaid_summary('0400000000')
+            return summaries, second, unknown
+        summaries, second, unknown = self._run(read)
+        self.assertEqual(list(summaries), ['0412345678', '0498765432'])
+        self.assertEqual(summaries['0412345678'].balance, 10.0)
+        self.assertEqual(second.balance, 11.0)
+        # Read from the index rather than fetched again
+        self.assertEqual(self.server.summaries, 2)
+        self.assertEqual(unknown.data, {})
+
+    def test_puk(self):
+        async def read(pool):
+            api = pool.api('alice', 'secret')
+            return (await api.prepaid_puk(),
+                    await api.prepaid_puk('0498765432'),
+                    await api.prepaid_puk('0400000000'))
+        self.assertEqual(self._run(read), ('12345678', '87654321', None))
+
+    def test_services_unavailable(self):
+        self.server.service_list = []
+
+        async def read(pool):
+            api = pool.api('alice', 'secret')
+            summary = await api.prepaid_summary('0412345678')
+            with self.assertRaises(ServiceListError):
+                await api.prepaid_puk('0412345678')
+            return summary
+        self.assertEqual(self._run(read).data, {})
+
+    def test_local_origin(self):
+        self.assertTrue(aioweb.is_local_origin('http://127.0.0.1:8080'))
+        self.assertTrue(aioweb.is_local_origin('http://localhost'))
+        self.assertTrue(aioweb.is_local_origin('http://proxy.test'))
+        self.assertFalse(aioweb.is_local_origin(
+            'https://www.my.telstra.com.au'))
+
+        async def jars(pool):
+            return pool.api('alice', 'secret').session.cookie_jar
+
+        async def default_jar():
+            async with aioweb.AsyncWebPool() as pool:
+                return await jars(pool)
+
+        self.assertTrue(self._run(jars)._unsafe)
+        self.assertFalse(asyncio.run(default_jar())._unsafe)
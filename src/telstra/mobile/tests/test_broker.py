@@ -0,0 +1,96 @@
+import datetime
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from telstra.mobile.account import Prepaid
+from telstra.mobile.broker import BrokerClient, BrokerError, ModemBroker
+from telstra.mobile.tests.test_account import PrepaidAccountGsmModem
+
+
+class TestBroker(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'broker.sock')
+        account = Prepaid(PrepaidAccountGsmModem('/dev/ttyS0'))
+        account.phone_number = '0412345678'
+        self.broker = ModemBroker([account])
+
+        self.thread = threading.Thread(target=self.broker.serve,
+                                       args=(self.path,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.assertTrue(self.broker.ready.wait(5))
+        self.client = BrokerClient(self.path)
+
+    def tearDown(self):
+        self.broker.close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_accounts(self):
+        self.assertEqual(self.client.accounts(), ['0412345678'])
+
+    def test_balance(self):
+        account = self.client.account('0412345678')
+        self.assertEqual(account.balance, 123.45)
+
+    def test_expiry_date(self):
+        account = self.client.account()
+        self.assertEqual(account.expiry_date,
+                         datetime.datetime(2007, 8, 12, 0, 0))
+
+    def test_snapshot(self):
+        account = self.client.account(max_age=60)
+        self.assertEqual(account.balance, 123.45)
+        snapshot = account.snapshot(max_age=60)
+        self.assertEqual(snapshot['expiry_date'],
+                         datetime.datetime(2007, 8, 12, 0, 0))
+        self.assertFalse(snapshot['stale'])
+        self.assertTrue(account.snapshot(max_age=-1)['stale'])
+
+    def test_unknown_account(self):
+        account = self.client.account('0400000000')
+        self.assertRaises(BrokerError, lambda: account.balance)
+
+    def test_account_closes_modem(self):
+        self.broker.close()
+        self.assertTrue(self.broker.accounts[0].modem.closed)
+
+    def test_socket_permissions(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_refuses_live_socket(self):
+        other = ModemBroker([])
+        self.assertRaises(BrokerError, other.serve, self.path)
+        self.assertEqual(self.client.accounts(), ['0412345678'])
+
+    def test_replaces_stale_socket(self):
+        path = os.path.join(self.directory, 'stale.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        other = ModemBroker([])
+        thread = threading.Thread(target=other.serve, args=(path,))
+        thread.daemon = True
+        thread.start()
+        self.assertTrue(other.ready.wait(5))
+        with self.assertRaises(BrokerError) as caught:
+            BrokerClient(path).accounts()
+        self.assertEqual(str(caught.exception), 'No accounts are available.')
+        other.close()
+        thread.join()
+
+    def test_refuses_other_owner(self):
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            self.assertRaises(BrokerError, self.client.accounts)
+            self.assertRaises(BrokerError, ModemBroker([]).serve, self.path)
+        finally:
+            os.getuid = getuid
+        self.assertEqual(self.client.accounts(), ['0412345678'])
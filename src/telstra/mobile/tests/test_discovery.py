@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from telstra.mobile.discovery import DiscoveryCache
+from telstra.mobile.tests import dummy_enumerate_ports
+from telstra.mobile.tests.test_account import PrepaidAccountGsmModem
+
+
+class ImsiGsmModem(PrepaidAccountGsmModem):
+
+    imsi = '505011234567890'
+    dialled = []
+
+    def sendUssd(self, code):
+        self.dialled.append((self.port, code))
+        return super(ImsiGsmModem, self).sendUssd(code)
+
+
+class TestDiscoveryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'discovery.json')
+        ImsiGsmModem.dialled = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _autodetect_account(self, cache, ports=['/dev/ttyS0']):
+        from telstra.mobile import modem
+        modem.GsmModem = ImsiGsmModem
+        modem.enumerate_serial = dummy_enumerate_ports(ports)
+        from telstra.mobile import autodetect_account
+        return autodetect_account(phone_number='0412345678', cache=cache)
+
+    def test_get_set(self):
+        cache = DiscoveryCache(self.path, ttl=60)
+        self.assertIsNone(cache.get('0412345678'))
+
+        cache.set('0412345678', '/dev/ttyS0', '505011234567890', True)
+        entry = cache.get('0412345678')
+        self.assertEqual(entry['port'], '/dev/ttyS0')
+        self.assertEqual(entry['imsi'], '505011234567890')
+        self.assertTrue(entry['prepaid'])
+
+        cache.remove('0412345678')
+        self.assertIsNone(cache.get('0412345678'))
+
+    def test_concurrent_writers(self):
+        # Separate instances share no thread lock, like separate processes
+        caches = [DiscoveryCache(self.path, ttl=60) for index in range(4)]
+        threads = [threading.Thread(
+            target=cache.set, args=('04%08d' % index, '/dev/ttyS0', None))
+            for index, cache in enumerate(caches * 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for index in range(len(threads)):
+            self.assertIsNotNone(caches[0].get('04%08d' % index))
+
+    def test_stale_entry(self):
+        cache = DiscoveryCache(self.path, ttl=-1)
+        cache.set('0412345678', '/dev/ttyS0', '505011234567890')
+        self.assertIsNone(cache.get('0412345678'))
+
+    def test_autodetect_populates_cache(self):
+        cache = DiscoveryCache(self.path, ttl=60)
+        account = self._autodetect_account(cache)
+        self.assertIsNotNone(account)
+        self.assertEqual(cache.get('0412345678')['port'], '/dev/ttyS0')
+
+    def test_autodetect_uses_cache(self):
+        """ A fresh cache entry avoids any USSD dialling.
+        """
+        cache = DiscoveryCache(self.path, ttl=60)
+        cache.set('0412345678', '/dev/ttyS1', '505011234567890', True)
+
+        account = self._autodetect_account(
+            cache, ports=['/dev/ttyS0', '/dev/ttyS1'])
+        self.assertEqual(account.modem.port, '/dev/ttyS1')
+        self.assertEqual(account.phone_number, '0412345678')
+        self.assertEqual(ImsiGsmModem.dialled, [])
+
+    def test_autodetect_rescans_wrong_sim(self):
+        cache = DiscoveryCache(self.path, ttl=60)
+        cache.set('0412345678', '/dev/ttyS0', '505019999999999', True)
+
+        account = self._autodetect_account(cache)
+        self.assertIsNotNone(account)
+        self.assertEqual(cache.get('0412345678')['imsi'], '505011234567890')
+        self.assertTrue(ImsiGsmModem.dialled)
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+import unittest
+
+import telstra.mobile
+
+
+def loaded_after(statement):
+    """ List the heavy modules loaded by ``statement`` in a fresh interpreter.
+    """
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys\n%s\nprint(" ".join(name for name in '
+        '("requests", "gsmmodem", "serial") if name in sys.modules))'
+        % statement])
+    return output.decode('utf-8').split()
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_package(self):
+        self.assertEqual(loaded_after('import telstra.mobile'), [])
+
+    def test_parsers(self):
+        self.assertEqual(
+            loaded_after('from telstra.mobile.parse import parse_balance'),
+            [])
+
+    def test_web(self):
+        self.assertEqual(
+            loaded_after('from telstra.mobile import TelstraWebApi'),
+            ['requests'])
+
+    def test_attributes(self):
+        from telstra.mobile.account import Prepaid
+        self.assertIs(telstra.mobile.Prepaid, Prepaid)
+        self.assertIn('autodetect_account', dir(telstra.mobile))
+        self.assertRaises(AttributeError, getattr, telstra.mobile, 'missing')
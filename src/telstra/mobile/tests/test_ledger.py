@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from telstra.mobile.account import Prepaid
+from telstra.mobile.ledger import TransferLedger, TransferRejected
+from telstra.mobile.simulator import SimulatedModem, SimulatedSim
+from telstra.mobile.transfer import DEFERRED, SENT, send_credits
+
+
+class RefusingAccount(object):
+    """ Account whose transfers the network refuses with ``message``.
+    """
+    phone_number = '0412345678'
+    balance = None
+
+    def __init__(self, message):
+        self.message = message
+        self.attempts = 0
+
+    def creditme2u(self, phone_number, amount):
+        self.attempts += 1
+        raise ValueError(self.message)
+
+
+class TestTransferLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'ledger.json')
+        self.ledger = TransferLedger(self.path)
+        self.modem = SimulatedModem('/dev/ttyS0', SimulatedSim(balance=8.0))
+        self.modem.connect()
+        self.account = Prepaid(self.modem)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_records_transfers(self):
+        self.ledger.creditme2u(self.account, '0499888777', 3)
+        self.ledger.creditme2u(self.account, '0499888777', 2)
+        self.assertEqual(self.ledger.sent_today('0412345678'), 5)
+        self.assertEqual(self.ledger.balance('0412345678'), 3.0)
+
+    def test_rejects_before_dialling(self):
+        self.ledger.creditme2u(self.account, '0499888777', 5)
+        round_trips = self.modem.round_trips
+        # Balance of $3 left
+        self.assertRaises(TransferRejected, self.ledger.creditme2u,
+                          self.account, '0499888777', 4)
+        self.ledger.record_balance('0412345678', 50.0)
+        # Daily limit of $10
+        self.assertRaises(TransferRejected, self.ledger.creditme2u,
+                          self.account, '0499888777', 6)
+        self.assertEqual(self.modem.round_trips, round_trips)
+
+    def test_concurrent_writers(self):
+        # Separate instances share no thread lock, like separate processes
+        ledgers = [TransferLedger(self.path) for index in range(4)]
+        threads = [threading.Thread(target=ledger.record_transfer,
+                                    args=('0412345678', '0499888777', 1))
+                   for ledger in ledgers * 5]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.ledger.entry('0412345678')['transfers']),
+                         20)
+
+    def test_previous_days_pruned(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as ledger_file:
+            json.dump({'0412345678': {'transfers': [
+                {'to': '0499888777', 'amount': 10,
+                 'timestamp': time.time() - 2 * 24 * 60 * 60}]}}, ledger_file)
+        self.assertEqual(self.ledger.sent_today('0412345678'), 0)
+        self.ledger.record_balance('0412345678', 20.0)
+        self.assertEqual(self.ledger.entry('0412345678')['transfers'], [])
+
+    def test_reconcile_transfer_limit(self):
+        account = RefusingAccount('You have reached your daily transfer '
+                                  'limit.')
+        account.balance = 20.0
+        self.assertRaises(ValueError, self.ledger.creditme2u, account,
+                          '0499888777', 2)
+        self.assertEqual(self.ledger.sent_today('0412345678'), 10)
+        self.assertRaises(TransferRejected, self.ledger.creditme2u, account,
+                          '0499888777', 1)
+        self.assertEqual(account.attempts, 1)
+
+    def test_reconcile_insufficient(self):
+        account = RefusingAccount('Insufficient credit account to send '
+                                  'credit.')
+        self.assertRaises(ValueError, self.ledger.creditme2u, account,
+                          '0499888777', 5)
+        self.assertRaises(TransferRejected, self.ledger.creditme2u, account,
+                          '0499888777', 6)
+        self.assertEqual(account.attempts, 1)
+        self.assertRaises(ValueError, self.ledger.creditme2u, account,
+                          '0499888777', 4)
+        self.assertEqual(account.attempts, 2)
+
+    def test_batch(self):
+        self.ledger.record_transfer('0412345678', '0499888777', 4)
+        results = send_credits(self.account, [('0411111111', 3),
+                                              ('0422222222', 4)],
+                               ledger=self.ledger)
+        self.assertEqual([result.status for result in results],
+                         [SENT, DEFERRED])
+        self.assertEqual(self.ledger.sent_today('0412345678'), 7)
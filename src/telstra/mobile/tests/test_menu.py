@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from telstra.mobile.account import Prepaid
+from telstra.mobile.menu import MenuMap, crawl, shortcode
+from telstra.mobile.tests import dummy_menu_modem_cls
+
+
+CONFIRM = {'message': 'Send $5 to 0499888777?\r\n1. Confirm\r\n00. Home',
+           'options': {'1': {'message': 'Credit sent.'}}}
+
+TREE = {
+    'message': 'Bal:$12.50 *\r\nExp 12 Aug 2027\r\n1. Recharge\r\n'
+               '2. Bal Details\r\n00. Home',
+    'options': {
+        '1': {'message': 'Recharge\r\n1. Voucher\r\n2. CredMe2U\r\n00. Home',
+              'options': {
+                  '1': {'message': 'Enter voucher PIN',
+                        'options': {'*': {'message': 'Invalid PIN'}}},
+                  '2': {'message': 'Enter mobile number',
+                        'options': {'*': {'message': 'Enter amount',
+                                          'options': {'*': CONFIRM}}}},
+              }},
+        '2': {'message': 'Balances\r\n1. Main Bal\r\n2. Call Cred Bal\r\n'
+                         '00. Home',
+              'options': {
+                  '1': {'message': 'Main Bal: $12.50'},
+                  '2': {'message': 'Call Cred Bal: $5.00 \r\n1. More',
+                        'options': {'1': {'message': 'Exp 01 Jan 2030'}}},
+              }},
+    },
+}
+
+
+class TestMenuMap(unittest.TestCase):
+
+    def setUp(self):
+        self.account = Prepaid(dummy_menu_modem_cls(TREE)('/dev/ttyS0'))
+
+    def test_shortcode(self):
+        self.assertEqual(shortcode(['2', '2']), '#100*2*2#')
+        self.assertEqual(shortcode([]), '#100#')
+
+    def test_crawl(self):
+        menu_map = crawl(self.account)
+        self.assertEqual(menu_map.lookup(['Recharge'])['path'], ['1'])
+        self.assertEqual(menu_map.lookup(['Recharge', 'CredMe2U'])['path'],
+                         ['1', '2'])
+        self.assertEqual(
+            menu_map.lookup(['Bal Details', ('Call Credits',
+                                             'Call Cred Bal')])['path'],
+            ['2', '2'])
+        self.assertIsNone(menu_map.lookup(['Home']))
+        self.assertTrue(menu_map.is_current(
+            self.account.main_menu_parsed(refresh=True)))
+
+    def test_crawl_read_only(self):
+        tree = dict(TREE, message=TREE['message'].replace(
+            '00. Home', '3. Data Pack\r\n00. Home'))
+        tree['options'] = dict(TREE['options'], **{'3': CONFIRM})
+        account = Prepaid(dummy_menu_modem_cls(tree)('/dev/ttyS0'))
+        menu_map = crawl(account)
+        self.assertIsNone(menu_map.lookup(['Data Pack']))
+        self.assertNotIn('3', account.modem.dialled)
+
+        menu_map = crawl(account, follow=None)
+        self.assertEqual(menu_map.lookup(['Data Pack'])['path'], ['3'])
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'maps', 'menu.json')
+            menu_map = crawl(self.account)
+            menu_map.save(path)
+            loaded = MenuMap.load(path)
+            self.assertEqual(loaded.version, menu_map.version)
+            self.assertEqual(loaded.nodes, menu_map.nodes)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_creditme2u_stepwise(self):
+        self.account.creditme2u('0499888777', 5)
+        self.assertEqual(self.account.modem.dialled,
+                         ['#100#', '1', '2', '0499888777', '5', '1'])
+
+    def test_creditme2u_shortcode(self):
+        self.account.menu_map = crawl(self.account)
+        self.account.modem.dialled = []
+        self.account.creditme2u('0499888777', 5)
+        self.assertEqual(self.account.modem.dialled,
+                         ['#100*1*2#', '0499888777', '5', '1'])
+
+    def test_call_credits_shortcode(self):
+        self.account.menu_map = crawl(self.account)
+        self.account.modem.dialled = []
+        self.assertEqual(self.account.balance_call_credits(), 5.0)
+        self.assertEqual(self.account.modem.dialled[0], '#100*2*2#')
+
+    def test_shortcode_fallback(self):
+        """ A shortcode landing on the wrong node falls back to walking.
+        """
+        menu_map = crawl(self.account)
+        menu_map.nodes['Recharge/CredMe2U']['path'] = ['2', '1']
+        self.account.menu_map = menu_map
+        self.account.modem.dialled = []
+
+        response = self.account.navigate(['Recharge', 'CredMe2U'])
+        self.assertEqual(response.message, 'Enter mobile number')
+        self.assertEqual(self.account.modem.dialled,
+                         ['#100*2*1#', '#100#', '1', '2'])
+        self.assertIsNotNone(self.account.menu_map)
+
+    def test_stale_map(self):
+        menu_map = crawl(self.account)
+        menu_map.nodes['Recharge/CredMe2U']['path'] = ['9']
+        menu_map.version = 'outdated'
+        self.account.menu_map = menu_map
+
+        self.account.navigate(['Recharge', 'CredMe2U'])
+        self.assertIsNone(self.account.menu_map)
+
+    def test_navigate_missing(self):
+        self.assertRaises(ValueError, self.account.navigate, ['PlusPacks'])
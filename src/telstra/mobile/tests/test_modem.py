@@ -1,3 +1,4 @@
+import time
 import unittest
 
 from gsmmodem.exceptions import TimeoutException
@@ -49,3 +50,54 @@ class TestModem(unittest.TestCase):
 
         result = modem.autodetect_modem()
         self.assertEqual(result.port, '/dev/ttyS2')
+
+    def test_autodetect_modem_concurrent(self):
+        """ Test concurrent probing matches the sequential result.
+        """
+        from telstra.mobile import modem
+        ports = ['/dev/ttyS0', '/dev/ttyS1', '/dev/ttyS2', '/dev/ttyS3']
+        modem.enumerate_serial = dummy_enumerate_ports(ports)
+
+        created = []
+
+        class TrackedModem(dummy_modem_cls(connect_raises=TimeoutException,
+                                           valid_ports=['/dev/ttyS1',
+                                                        '/dev/ttyS3'])):
+            def __init__(self, *args, **kwargs):
+                super(TrackedModem, self).__init__(*args, **kwargs)
+                self.closed = False
+                created.append(self)
+
+        modem.GsmModem = TrackedModem
+        sequential = modem.autodetect_modem()
+        self.assertEqual(sequential.port, '/dev/ttyS1')
+
+        del created[:]
+        result = modem.autodetect_modem(workers=4)
+        self.assertEqual(result.port, sequential.port)
+        self.assertFalse(result.closed)
+        # Every other probe that ran must have been closed, though losing
+        # probes may still be finishing in the background
+        deadline = time.time() + 5
+        while time.time() < deadline and not all(
+                other.closed for other in created if other is not result):
+            time.sleep(0.01)
+        for other in created:
+            if other is not result:
+                self.assertTrue(other.closed)
+
+    def test_autodetect_modem_concurrent_check_fn(self):
+        """ Test concurrent probing honours ``check_fn``.
+        """
+        from telstra.mobile import modem
+        modem.GsmModem = dummy_modem_cls()
+        modem.enumerate_serial = dummy_enumerate_ports(['/dev/ttyS0',
+                                                        '/dev/ttyS1',
+                                                        '/dev/ttyS2'])
+
+        result = modem.autodetect_modem(
+            check_fn=lambda m: m.port == '/dev/ttyS2', workers=2)
+        self.assertEqual(result.port, '/dev/ttyS2')
+
+        result = modem.autodetect_modem(check_fn=lambda m: False, workers=2)
+        self.assertIsNone(result)
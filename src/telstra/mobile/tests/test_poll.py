@@ -0,0 +1,80 @@
+import time
+import unittest
+
+from telstra.mobile import modem
+from telstra.mobile.account import autodetect_accounts
+from telstra.mobile.poll import poll_account, poll_accounts
+from telstra.mobile.simulator import SimulatedNetwork, SimulatedSim
+
+
+class TestPoll(unittest.TestCase):
+
+    def setUp(self):
+        self._modem_cls = modem.GsmModem
+        self._enumerate = modem.enumerate_serial
+        sims = dict(('/dev/ttyS%d' % number,
+                     SimulatedSim(phone_number='040000000%d' % number,
+                                  balance=number))
+                    for number in range(4))
+        self.network = SimulatedNetwork(sims, latency=0.1)
+        modem.GsmModem = self.network.modem_cls
+        modem.enumerate_serial = self.network.enumerate
+
+    def tearDown(self):
+        modem.GsmModem = self._modem_cls
+        modem.enumerate_serial = self._enumerate
+
+    def test_concurrent(self):
+        start = time.time()
+        accounts = autodetect_accounts(workers=4)
+        results = list(poll_accounts(accounts))
+        elapsed = time.time() - start
+
+        self.assertEqual(
+            sorted((result['phone_number'], result['balance'])
+                   for result in results),
+            [('0400000000', 0), ('0400000001', 1), ('0400000002', 2),
+             ('0400000003', 3)])
+        self.assertEqual(set(result['port'] for result in results),
+                         set(self.network.ports))
+        self.assertTrue(all(result['expiry_date'].year == 2030
+                            for result in results))
+        # Identity, type and snapshot cost three round trips per modem
+        self.assertLess(elapsed, 3 * 0.1 * 2)
+
+    def test_phone_numbers(self):
+        accounts = autodetect_accounts(phone_numbers=['0400000002'],
+                                       workers=4)
+        self.assertEqual([account.phone_number for account in accounts],
+                         ['0400000002'])
+        self.assertEqual(sum(1 for simulated in self.network.modems
+                             if simulated.connected), 1)
+
+    def test_error(self):
+        account = autodetect_accounts(phone_numbers=['0400000001'])[0]
+        account.modem.failure_rate = 1
+        result = poll_account(account)
+        self.assertEqual(result['balance'], None)
+        self.assertEqual(result['error'], '+CUSD')
+
+    def test_identify_failure(self):
+        modem_cls = self.network.modem_cls
+
+        def failing_modem_cls(port, **options):
+            simulated = modem_cls(port, **options)
+            if port == '/dev/ttyS1':
+                simulated.failure_rate = 1
+            return simulated
+        modem.GsmModem = failing_modem_cls
+
+        for workers in (None, 4):
+            accounts = autodetect_accounts(workers=workers)
+            self.assertEqual(
+                [account.phone_number for account in accounts],
+                ['0400000000', '0400000002', '0400000003'])
+            failed, = [simulated for simulated in self.network.modems
+                       if simulated.port == '/dev/ttyS1']
+            self.assertFalse(failed.connected)
+            for account in accounts:
+                account.close()
+            self.network.reset()
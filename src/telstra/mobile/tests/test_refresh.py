@@ -0,0 +1,56 @@
+import time
+import unittest
+
+from telstra.mobile.account import Prepaid
+from telstra.mobile.refresh import SnapshotRefresher
+from telstra.mobile.simulator import SimulatedModem, SimulatedSim
+
+
+class TestSnapshotRefresher(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SimulatedSim()
+        self.modem = SimulatedModem('/dev/ttyS0', self.sim, latency=0.2)
+        self.modem.connect()
+        self.account = Prepaid(self.modem)
+        self.account.phone_number = '0412345678'
+        self.refresher = SnapshotRefresher([self.account], interval=None)
+
+    def tearDown(self):
+        self.refresher.stop()
+
+    def test_first_read_waits(self):
+        snapshot = self.refresher.get('0412345678', max_age=60)
+        self.assertEqual(snapshot.balance, 25.0)
+        self.assertEqual(self.modem.dials, 1)
+
+    def test_stale_while_revalidate(self):
+        self.refresher.get('0412345678')
+        self.sim.balance = 20.0
+
+        start = time.time()
+        snapshot = self.refresher.get('0412345678', max_age=0)
+        self.assertLess(time.time() - start, 0.1)
+        self.assertEqual(snapshot.balance, 25.0)
+
+        # Further stale reads share the refresh already under way
+        thread = self.refresher.refresh_async('0412345678')
+        self.refresher.get('0412345678', max_age=0)
+        thread.join()
+        self.assertEqual(self.modem.dials, 2)
+        self.assertEqual(self.refresher.get('0412345678').balance, 20.0)
+
+    def test_fresh_enough(self):
+        self.refresher.get('0412345678')
+        self.refresher.get('0412345678', max_age=60)
+        self.assertEqual(self.modem.dials, 1)
+
+    def test_schedule(self):
+        self.modem.latency = 0
+        refresher = SnapshotRefresher([self.account], interval=0.1)
+        refresher.start()
+        try:
+            time.sleep(0.35)
+        finally:
+            refresher.stop()
+        self.assertTrue(3 <= self.modem.dials <= 5)
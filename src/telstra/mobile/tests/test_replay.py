@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from gsmmodem.exceptions import TimeoutException
+
+from telstra.mobile.account import Prepaid
+from telstra.mobile.replay import ReplayError, Transcript, \
+    recording_modem_cls, replay_modem_cls
+from telstra.mobile.tests import dummy_enumerate_ports, dummy_menu_modem_cls
+from telstra.mobile.tests.test_menu import TREE
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'transcript.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _record(self):
+        """ Record a balance and CreditMe2U flow against a dummy modem.
+        """
+        transcript = Transcript()
+        modem_cls = recording_modem_cls(dummy_menu_modem_cls(TREE),
+                                        transcript)
+        modem = modem_cls('/dev/ttyS0')
+        modem.connect()
+        account = Prepaid(modem)
+        account.balance
+        account.creditme2u('0499888777', 5)
+        transcript.save(self.path)
+        return transcript
+
+    def test_record(self):
+        transcript = self._record()
+        operations = [(event['op'], event['code'])
+                      for event in transcript.events]
+        self.assertEqual(operations, [('connect', None),
+                                      ('dial', '#100#'),
+                                      ('cancel', None),
+                                      ('dial', '#100#'),
+                                      ('reply', '1'),
+                                      ('reply', '2'),
+                                      ('reply', '0499888777'),
+                                      ('reply', '5'),
+                                      ('reply', '1')])
+        self.assertEqual(transcript.events[-1]['message'], 'Credit sent.')
+
+    def test_replay(self):
+        self._record()
+        modem = replay_modem_cls(Transcript.load(self.path), scale=0)(
+            '/dev/ttyS0', baudrate=9600)
+        modem.connect()
+        account = Prepaid(modem)
+        self.assertEqual(account.balance, 12.5)
+        response = account.creditme2u('0499888777', 5)
+        self.assertEqual(response.message, 'Credit sent.')
+
+    def test_replay_mismatch(self):
+        self._record()
+        modem = replay_modem_cls(Transcript.load(self.path), scale=0)(
+            '/dev/ttyS0')
+        modem.connect()
+        self.assertRaises(ReplayError, modem.sendUssd, '#150#')
+
+    def test_replay_latency(self):
+        transcript = Transcript()
+        transcript.record('/dev/ttyS0', 'connect', elapsed=0.2)
+        modem = replay_modem_cls(transcript, scale=0.25)('/dev/ttyS0')
+        start = time.time()
+        modem.connect()
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_replay_autodetect(self):
+        """ Replay autodetection across ports, including recorded failures.
+        """
+        transcript = Transcript()
+        transcript.record('/dev/ttyS0', 'connect', error='TimeoutException')
+        transcript.record('/dev/ttyS1', 'connect')
+        transcript.record('/dev/ttyS1', 'dial', code='#150#',
+                          message='Your mobile number is:\r\n0412345678',
+                          active=False)
+
+        from telstra.mobile import modem
+        modem.GsmModem = replay_modem_cls(transcript, scale=0)
+        modem.enumerate_serial = dummy_enumerate_ports(['/dev/ttyS0',
+                                                        '/dev/ttyS1',
+                                                        '/dev/ttyS2'])
+        from telstra.mobile.account import check_phone_number
+        result = modem.autodetect_modem(
+            check_fn=lambda m: check_phone_number(m, '0412345678'))
+        self.assertEqual(result.port, '/dev/ttyS1')
+
+    def test_recorded_error(self):
+        transcript = Transcript()
+        transcript.record('/dev/ttyS0', 'dial', code='#100#',
+                          error='TimeoutException')
+        modem = replay_modem_cls(transcript, scale=0)('/dev/ttyS0')
+        self.assertRaises(TimeoutException, modem.sendUssd, '#100#')
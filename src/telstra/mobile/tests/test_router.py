@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import requests
+
+from telstra.mobile.account import Prepaid
+from telstra.mobile.router import USSD, WEB, Backend, Reading, ReadError, \
+    ReadRouter, ussd_backend, web_backend
+from telstra.mobile.simulator import SimulatedModem, SimulatedSim
+from telstra.mobile.tests.test_web import FakeTelstraAdapter
+from telstra.mobile.web import TelstraWebApi
+
+
+class DummySource(object):
+    """ Backend fetch function returning readings or failing on demand.
+    """
+
+    def __init__(self, name, balance):
+        self.name = name
+        self.balance = balance
+        self.fail = False
+        self.calls = 0
+
+    def __call__(self, max_age):
+        self.calls += 1
+        if self.fail:
+            raise IOError('%s is down' % self.name)
+        return Reading(self.name, self.balance, None)
+
+
+class TestReadRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.web = DummySource(WEB, 10.0)
+        self.ussd = DummySource(USSD, 10.5)
+        self.web_backend = Backend(WEB, self.web, latency=1.0)
+        self.ussd_backend = Backend(USSD, self.ussd, latency=5.0, weight=2.0)
+        self.router = ReadRouter([self.ussd_backend, self.web_backend],
+                                 failure_threshold=2, cooldown=60)
+
+    def test_cheapest(self):
+        self.assertEqual(self.router.read().source, WEB)
+        self.assertEqual(self.ussd.calls, 0)
+
+    def test_measured(self):
+        # Measured latency overrides the initial estimates
+        self.web_backend.latency = 20.0
+        self.assertEqual(self.router.read().source, USSD)
+        self.assertTrue(self.ussd_backend.latency < 5.0)
+
+    def test_failover(self):
+        self.web.fail = True
+        reading = self.router.read()
+        self.assertEqual(reading.source, USSD)
+        self.assertEqual(reading.balance, 10.5)
+        self.assertEqual(self.web_backend.failures, 1)
+        self.assertTrue(self.web_backend.error_rate > 0)
+
+    def test_unhealthy(self):
+        self.web.fail = True
+        self.router.read()
+        self.router.read()
+        self.assertFalse(self.web_backend.healthy(2, 60))
+
+        # Skipped while cooling down, even once it has recovered
+        self.web.fail = False
+        self.assertEqual(self.router.read().source, USSD)
+        self.assertEqual(self.web.calls, 2)
+
+        self.web_backend.failed_at = time.time() - 61
+        self.assertEqual(self.router.read().source, WEB)
+        self.assertEqual(self.web_backend.failures, 0)
+
+    def test_last_resort(self):
+        self.web.fail = True
+        self.ussd.fail = True
+        self.assertRaises(ReadError, self.router.read)
+        self.assertRaises(ReadError, self.router.read)
+        # Every backend is unhealthy, but they are all still tried
+        self.ussd.fail = False
+        self.assertEqual(self.router.read().source, USSD)
+
+    def test_persisted(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'router.json')
+            self.web.fail = True
+            ReadRouter([self.ussd_backend, self.web_backend],
+                       state_path=path).read()
+
+            # A new run starts from the saved estimates
+            web_backend = Backend(WEB, self.web, latency=1.0)
+            router = ReadRouter([Backend(USSD, self.ussd, latency=5.0),
+                                 web_backend], state_path=path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(web_backend.error_rate,
+                         self.web_backend.error_rate)
+        self.assertEqual(router.backends[0].latency,
+                         self.ussd_backend.latency)
+        self.assertTrue(web_backend.error_rate > 0)
+
+    def test_empty_reading(self):
+        self.web.balance = None
+        self.assertEqual(self.router.read().source, USSD)
+        self.assertEqual(self.web_backend.failures, 1)
+
+    def test_held(self):
+        held = Reading(USSD, 9.0, None, timestamp=time.time() - 30)
+        self.ussd_backend._last = lambda: held
+        self.assertIs(self.router.read(max_age=60), held)
+        self.assertEqual(self.web.calls, 0)
+        # Too old, so the cheapest backend is read
+        self.assertEqual(self.router.read(max_age=10).source, WEB)
+
+
+class TestBackends(unittest.TestCase):
+
+    def _api(self):
+        session = requests.Session()
+        adapter = FakeTelstraAdapter(session)
+        session.mount('https://', adapter)
+        return TelstraWebApi('user', 'secret', session=session), adapter
+
+    def test_ussd_lazy(self):
+        opened = []
+
+        def load_account():
+            simulated = SimulatedModem('/dev/ttyS0', SimulatedSim())
+            simulated.connect()
+            opened.append(simulated)
+            return Prepaid(simulated)
+
+        api, adapter = self._api()
+        router = ReadRouter([ussd_backend(load_account), web_backend(api)])
+        self.assertEqual(router.read().source, WEB)
+        self.assertEqual(opened, [])
+
+        adapter.token += 1
+        api.logged_in = True
+        reading = router.read(max_age=0)
+        self.assertEqual(reading.source, USSD)
+        self.assertEqual(reading.balance, 25.0)
+        self.assertEqual(len(opened), 1)
+
+        # The snapshot just taken is held by the USSD backend
+        self.assertEqual(router.read(max_age=60).source, USSD)
+        self.assertEqual(opened[0].round_trips, 1)
+
+    def test_web_held(self):
+        api, adapter = self._api()
+        backend = web_backend(api)
+        self.assertIsNone(backend.last())
+        backend.fetch()
+        self.assertEqual(backend.last().balance, 12.5)
+
+    def test_no_account(self):
+        router = ReadRouter([ussd_backend(lambda: None)])
+        self.assertRaises(ReadError, router.read)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+import unittest
+
+from telstra.mobile import scrape
+
+FRAGMENT = u"""
+<div class="usage">
+<p>Usage for the last 30 days</p>
+<table>
+  <thead>
+    <tr><th>Date &amp; Time</th><th>Description</th><th>Number</th>
+        <th>Duration/Volume</th><th>Cost</th></tr>
+  </thead>
+  <tbody>
+    <tr><td>14/07/2014 10:31 AM</td><td>Call to mobile</td>
+        <td>0412 345 678</td><td>0:02:15</td><td>$1.20</td></tr>
+    <tr><td>14/07/2014 11:02 AM</td><td>SMS – national</td>
+        <td>0498 765 432</td><td>1</td><td>$0.25</td></tr>
+    <tr><td>15/07/2014 08:00 PM<td>Mobile data<td><td>1.5 MB<td>Included
+    <tr><td colspan="5">No further usage</td></tr>
+  </tbody>
+</table>
+</div>
+"""
+
+
+def chunked(text, size):
+    data = text.encode('utf-8')
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+
+class TestUsage(unittest.TestCase):
+
+    def test_records(self):
+        call, sms, data = list(scrape.iter_usage([FRAGMENT]))
+
+        self.assertEqual(call.kind, scrape.CALL)
+        self.assertEqual(call.timestamp, datetime(2014, 7, 14, 10, 31))
+        self.assertEqual(call.destination, '0412 345 678')
+        self.assertEqual(call.quantity, 135)
+        self.assertEqual(call.cost, 1.2)
+
+        self.assertEqual(sms.kind, scrape.SMS)
+        self.assertEqual(sms.description, u'SMS – national')
+        self.assertEqual(sms.quantity, 1)
+        self.assertEqual(sms.cost, 0.25)
+
+        # Unclosed cells and rows are closed by the next one
+        self.assertEqual(data.kind, scrape.DATA)
+        self.assertEqual(data.timestamp, datetime(2014, 7, 15, 20, 0))
+        self.assertIsNone(data.destination)
+        self.assertEqual(data.quantity, 1.5 * 1024)
+        self.assertEqual(data.cost, 0.0)
+
+    def test_chunked(self):
+        expected = [record.cells for record in scrape.iter_usage([FRAGMENT])]
+        # Single bytes split tags, entities and multi-byte characters
+        for size in (1, 7, 64):
+            records = scrape.iter_usage(chunked(FRAGMENT, size))
+            self.assertEqual([record.cells for record in records], expected)
+
+    def test_incremental(self):
+        row = '<tr><td>16/07/2014 09:00</td><td>Mobile data</td><td></td>' \
+              '<td>20 KB</td><td>$0.01</td></tr>'
+        html = FRAGMENT.replace('</tbody>', row * 1000 + '</tbody>')
+        chunks = chunked(html, 256)
+        consumed = []
+
+        def source():
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+
+        records = scrape.iter_usage(source())
+        next(records)
+        # The first record arrives before the rest of the fragment is read
+        self.assertTrue(len(consumed) < 5)
+        self.assertEqual(sum(1 for record in records), 1002)
+
+    def test_default_columns(self):
+        html = '<table><tr><td>14/07/2014</td><td>Voice call</td>' \
+               '<td>101</td><td>2m 5s</td><td>Free</td></tr></table>'
+        record, = scrape.iter_usage([html])
+        self.assertEqual(record.kind, scrape.CALL)
+        self.assertEqual(record.timestamp, datetime(2014, 7, 14))
+        self.assertEqual(record.quantity, 125)
+        self.assertEqual(record.cost, 0.0)
+
+    def test_parsers(self):
+        self.assertEqual(scrape.parse_duration('1:00:01'), 3601)
+        self.assertIsNone(scrape.parse_duration('n/a'))
+        self.assertEqual(scrape.parse_volume('512 KB'), 512)
+        self.assertEqual(scrape.parse_volume('1 GB'), 1024 * 1024)
+        self.assertEqual(scrape.parse_cost('$1,000.50'), 1000.5)
+        self.assertIsNone(scrape.parse_cost('-'))
+
+    def test_negative_cost(self):
+        self.assertEqual(scrape.parse_cost('-$1.50'), -1.5)
+        self.assertEqual(scrape.parse_cost('$-1.50'), -1.5)
+        self.assertEqual(scrape.parse_cost('- $0.25'), -0.25)
+        self.assertEqual(scrape.parse_cost('($1.50)'), -1.5)
+        self.assertEqual(scrape.parse_cost('$1.50'), 1.5)
+        html = '<table><tr><td>14/07/2014</td><td>Credit adjustment</td>' \
+               '<td></td><td></td><td>($2.00)</td></tr></table>'
+        record, = scrape.iter_usage([html])
+        self.assertEqual(record.cost, -2.0)
+        self.assertIsNone(scrape.parse_timestamp('yesterday'))
+
+
+class TestPuk(unittest.TestCase):
+
+    def test_find_puk(self):
+        page = '<div><span class="label">PUK</span>' \
+               '<span class="puk">12345678</span></div>' + 'x' * 10000
+        chunks = chunked(page, 10)
+        consumed = []
+
+        def source():
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+
+        self.assertEqual(scrape.find_puk(source()), '12345678')
+        # Reading stops at the PUK
+        self.assertTrue(len(consumed) < 10)
+
+    def test_missing(self):
+        self.assertIsNone(scrape.find_puk(['<html>No PUK here</html>']))
@@ -0,0 +1,92 @@
+import unittest
+
+from telstra.mobile.account import Prepaid
+from telstra.mobile.session import MenuSession
+from telstra.mobile.tests import dummy_menu_modem_cls
+
+
+def build_tree():
+    """ Build a menu tree where every menu has a working Home option.
+    """
+    main = {'message': 'Bal:$12.50 *\r\nExp 12 Aug 2027\r\n1. Recharge\r\n'
+                       '2. Bal Details\r\n3. PlusPacks\r\n00. Home'}
+    recharge = {'message': 'Recharge\r\n1. Voucher\r\n2. CredMe2U\r\n'
+                           '00. Home',
+                'options': {'1': {'message': 'Enter voucher PIN'},
+                            '2': {'message': 'Enter mobile number'},
+                            '00': main}}
+    credits = {'message': 'Call Cred Bal: $5.00 \r\n00. Home',
+               'options': {'00': main}}
+    balances = {'message': 'Balances\r\n1. Main Bal\r\n2. Call Cred Bal\r\n'
+                           '00. Home',
+                'options': {'1': {'message': 'Main Bal: $12.50'},
+                            '2': credits,
+                            '00': main}}
+    packs = {'message': 'No PlusPacks\r\n00. Home', 'options': {'00': main}}
+    main['options'] = {'1': recharge, '2': balances, '3': packs, '00': main}
+    return main
+
+
+class TestMenuSession(unittest.TestCase):
+
+    def setUp(self):
+        self.modem = dummy_menu_modem_cls(build_tree())('/dev/ttyS0')
+        self.account = Prepaid(self.modem)
+
+    def test_queries_share_session(self):
+        with MenuSession(self.account) as session:
+            self.assertEqual(session.snapshot().balance, 12.5)
+            self.assertEqual(self.account.balance, 12.5)
+            credits = session.query(['Bal Details', 'Call Cred Bal'])
+            self.assertTrue(credits.message.startswith('Call Cred Bal'))
+            packs = session.query(['PlusPacks'])
+            self.assertTrue(packs.message.startswith('No PlusPacks'))
+            self.assertEqual(session.snapshot().expiry_date.year, 2027)
+
+        self.assertEqual(session.sessions_opened, 1)
+        self.assertEqual(self.modem.dialled,
+                         ['#100#', '2', '2', '00', '3', '00'])
+        self.assertIsNone(self.modem.node)
+
+    def test_descend_from_current(self):
+        with MenuSession(self.account) as session:
+            session.query(['Bal Details'])
+            session.query(['Bal Details', 'Call Cred Bal'])
+            self.assertEqual(self.modem.dialled, ['#100#', '2', '2'])
+
+    def test_back(self):
+        with MenuSession(self.account) as session:
+            session.query(['Bal Details', 'Call Cred Bal'])
+            response = session.back()
+            self.assertTrue(response.message.startswith('Balances'))
+            self.assertEqual(session.path, [('Bal Details',)])
+
+    def test_leaf_reopens(self):
+        """ A node that ends the session causes the next query to reopen.
+        """
+        with MenuSession(self.account) as session:
+            session.query(['Bal Details', 'Main Bal'])
+            session.query(['PlusPacks'])
+        self.assertEqual(session.sessions_opened, 2)
+
+    def test_idle_timeout(self):
+        with MenuSession(self.account, idle_timeout=0) as session:
+            session.query(['Recharge'])
+            session.query(['PlusPacks'])
+        self.assertEqual(session.sessions_opened, 2)
+        self.assertEqual(self.modem.dialled, ['#100#', '1', '#100#', '3'])
+
+    def test_network_timeout(self):
+        """ A failed reply is treated as the network ending the session.
+        """
+        with MenuSession(self.account) as session:
+            session.query(['Recharge'])
+            # Network silently drops the session
+            self.modem.node = None
+            response = session.query(['PlusPacks'])
+            self.assertTrue(response.message.startswith('No PlusPacks'))
+        self.assertEqual(session.sessions_opened, 2)
+
+    def test_missing_label(self):
+        with MenuSession(self.account) as session:
+            self.assertRaises(ValueError, session.query, ['Tones&Extras'])
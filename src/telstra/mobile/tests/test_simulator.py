@@ -0,0 +1,66 @@
+import unittest
+
+from gsmmodem.exceptions import CommandError, TimeoutException
+
+from telstra.mobile import modem
+from telstra.mobile.account import Prepaid, autodetect_account
+from telstra.mobile.menu import crawl
+from telstra.mobile.simulator import SimulatedModem, SimulatedNetwork, \
+    SimulatedSim
+
+
+class TestSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self._modem_cls = modem.GsmModem
+        self._enumerate = modem.enumerate_serial
+
+    def tearDown(self):
+        modem.GsmModem = self._modem_cls
+        modem.enumerate_serial = self._enumerate
+
+    def _account(self, **options):
+        simulated = SimulatedModem('/dev/ttyS0', SimulatedSim(), **options)
+        simulated.connect()
+        return simulated, Prepaid(simulated)
+
+    def test_balance(self):
+        simulated, account = self._account()
+        self.assertEqual(account.balance, 25.0)
+        self.assertEqual(account.expiry_date.year, 2030)
+        self.assertEqual(simulated.round_trips, 1)
+
+    def test_identity(self):
+        simulated, account = self._account()
+        self.assertEqual(account.phone_number, '0412345678')
+        self.assertEqual(account.account_number, '123456789')
+
+    def test_creditme2u_round_trips(self):
+        simulated, account = self._account()
+        self.assertTrue(account.creditme2u('0499888777', 2))
+        stepwise = simulated.round_trips
+
+        simulated, account = self._account()
+        account.menu_map = crawl(account)
+        simulated.dials = simulated.replies = 0
+        self.assertTrue(account.creditme2u('0499888777', 2))
+        self.assertLess(simulated.round_trips, stepwise)
+
+    def test_failures(self):
+        simulated, account = self._account(failure_rate=1)
+        self.assertRaises(CommandError, account.main_menu)
+
+        dead = SimulatedModem('/dev/ttyS1')
+        self.assertRaises(TimeoutException, dead.connect)
+
+    def test_network_autodetect(self):
+        network = SimulatedNetwork(
+            {'/dev/ttyS2': SimulatedSim(phone_number='0400000002')},
+            ['/dev/ttyS0', '/dev/ttyS1', '/dev/ttyS2'])
+        modem.GsmModem = network.modem_cls
+        modem.enumerate_serial = network.enumerate
+
+        account = autodetect_account('0400000002')
+        self.assertEqual(account.modem.port, '/dev/ttyS2')
+        self.assertEqual(len(network.modems), 3)
+        self.assertEqual(network.round_trips, 2)
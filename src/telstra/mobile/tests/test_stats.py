@@ -0,0 +1,105 @@
+import unittest
+
+from gsmmodem.exceptions import TimeoutException
+
+from telstra.mobile import stats
+from telstra.mobile.account import Prepaid
+from telstra.mobile.tests import dummy_enumerate_ports, dummy_menu_modem_cls
+from telstra.mobile.tests.test_menu import TREE
+
+
+class DummyUssd(object):
+
+    def reply(self, message):
+        return self
+
+
+class DummyModem(object):
+    port = '/dev/ttyS0'
+
+    def __init__(self, stats):
+        self.stats = stats
+
+
+class TestStats(unittest.TestCase):
+
+    def tearDown(self):
+        stats.disable()
+
+    def test_histogram(self):
+        histogram = stats.Histogram(buckets=(1, 5))
+        for value in (0.5, 2, 2, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.mean, 3.625)
+        self.assertEqual(list(histogram.cumulative()),
+                         [(1, 1), (5, 3), (float('inf'), 4)])
+
+    def test_timer_errors(self):
+        collected = stats.Stats()
+
+        def fail():
+            with collected.timer('dial', code='#100#'):
+                raise TimeoutException()
+
+        self.assertRaises(TimeoutException, fail)
+        summary = collected.summary()
+        self.assertEqual(len(summary), 1)
+        self.assertEqual(summary[0]['count'], 1)
+        self.assertEqual(summary[0]['errors'], {'TimeoutException': 1})
+
+    def test_disabled(self):
+        from telstra.mobile import modem
+        modem.GsmModem = dummy_menu_modem_cls(TREE)
+        modem.enumerate_serial = dummy_enumerate_ports(['/dev/ttyS0'])
+        self.assertNotIsInstance(modem.autodetect_modem(),
+                                 stats.InstrumentedModem)
+        self.assertIsNone(stats.get_stats())
+
+    def test_instrumented_operations(self):
+        from telstra.mobile import modem
+        modem.GsmModem = dummy_menu_modem_cls(TREE)
+        modem.enumerate_serial = dummy_enumerate_ports(['/dev/ttyS0'])
+        collected = stats.enable()
+
+        detected = modem.autodetect_modem()
+        self.assertIsInstance(detected, stats.InstrumentedModem)
+        account = Prepaid(detected)
+        account.balance
+        account.navigate(['Recharge', 'CredMe2U']).cancel()
+
+        operations = dict(((result['operation'],
+                            result['labels'].get('code') or
+                            result['labels'].get('path')), result)
+                          for result in collected.summary())
+        self.assertIn(('connect', None), operations)
+        self.assertEqual(operations[('dial', '#100#')]['count'], 2)
+        self.assertIn(('reply', '#100#>1>2'), operations)
+        self.assertIn(('cancel', '#100#>1>2'), operations)
+        self.assertIn(('parse_balance', None), operations)
+        self.assertEqual(
+            operations[('dial', '#100#')]['labels']['modem'], '/dev/ttyS0')
+
+    def test_path_masks_free_text(self):
+        collected = stats.Stats()
+        ussd = stats.InstrumentedUssd(DummyUssd(), DummyModem(collected),
+                                      '#100#')
+        ussd.reply('1').reply('2').reply('0499888777').reply('5').reply('1')
+        paths = [result['labels']['path'] for result in collected.summary()]
+        self.assertIn('#100#>1>2', paths)
+        self.assertIn('#100#>1>2>*>*>*', paths)
+        self.assertFalse([path for path in paths if '0499888777' in path])
+
+    def test_prometheus(self):
+        collected = stats.Stats(buckets=(1,))
+        collected.observe('dial', 0.5, modem='/dev/ttyS0', code='#100#')
+        collected.error('dial', TimeoutException(), code='#100#')
+        text = collected.prometheus()
+        self.assertIn('# TYPE telstra_mobile_operation_seconds histogram',
+                      text)
+        self.assertIn('telstra_mobile_operation_seconds_bucket{operation='
+                      '"dial",code="#100#",modem="/dev/ttyS0",le="1"} 1',
+                      text)
+        self.assertIn('le="+Inf"} 1', text)
+        self.assertIn('telstra_mobile_operation_errors_total{operation='
+                      '"dial",code="#100#",error="TimeoutException"} 1', text)
@@ -0,0 +1,127 @@
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from telstra.mobile.store import BALANCE, DAY, EXPIRY, HOUR, RECHARGE, \
+    ObservationStore, sync_recharges, to_datetime
+from telstra.mobile.web import ServiceListError
+
+
+class DummyRechargeApi(object):
+    """ Web API stand-in serving a growing recharge history.
+    """
+
+    def __init__(self, history, services=('0412345678',)):
+        self.history = history
+        self._services = services
+        self.calls = []
+
+    def services(self):
+        return [{'phone_number': phone_number}
+                for phone_number in self._services]
+
+    def prepaid_recharge_history(self, phone_number=None, since=None):
+        self.calls.append((phone_number, since))
+        return [(timestamp, amount) for timestamp, amount in self.history
+                if since is None or timestamp > since]
+
+
+class TestObservationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'data', 'store.sqlite')
+        self.store = ObservationStore(self.path)
+        # Hourly balances over two days, dropping a dollar every hour
+        self.store.record_many(
+            ('0412345678', BALANCE, 48.0 - hour, DAY * 10 + hour * HOUR,
+             'ussd') for hour in range(48))
+        self.store.record('0499888777', BALANCE, 5.0, DAY * 10)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_range(self):
+        observations = list(self.store.range('0412345678', BALANCE,
+                                             start=DAY * 10 + HOUR,
+                                             end=DAY * 10 + 4 * HOUR))
+        self.assertEqual(observations, [(DAY * 10 + HOUR, 47.0),
+                                        (DAY * 10 + 2 * HOUR, 46.0),
+                                        (DAY * 10 + 3 * HOUR, 45.0)])
+        self.assertEqual(len(list(self.store.range('0412345678', BALANCE))),
+                         48)
+
+    def test_latest(self):
+        self.assertEqual(self.store.latest('0412345678', BALANCE),
+                         (DAY * 10 + 47 * HOUR, 1.0))
+        self.assertIsNone(self.store.latest('0412345678', EXPIRY))
+
+    def test_downsample(self):
+        buckets = list(self.store.downsample('0412345678', BALANCE, DAY))
+        self.assertEqual(buckets, [(DAY * 10, 24, 25.0, 48.0, 36.5),
+                                   (DAY * 11, 24, 1.0, 24.0, 12.5)])
+
+    def test_observe(self):
+        expiry = datetime(2030, 8, 12)
+        self.store.observe('0400000000', balance=12.5, expiry_date=expiry,
+                           source='web')
+        self.store.observe('0400000000', balance=None, expiry_date=expiry)
+        self.assertEqual(
+            to_datetime(self.store.latest('0400000000', EXPIRY)[1]), expiry)
+        self.assertEqual(len(list(self.store.range('0400000000', BALANCE))),
+                         1)
+        self.assertEqual(self.store.services(),
+                         ['0400000000', '0412345678', '0499888777'])
+
+    def test_persistent(self):
+        self.store.close()
+        self.store = ObservationStore(self.path)
+        self.assertEqual(self.store.latest('0499888777', BALANCE),
+                         (DAY * 10, 5.0))
+
+
+class TestSyncRecharges(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ObservationStore(':memory:')
+        self.api = DummyRechargeApi([(DAY, 10), (DAY * 2, 20)])
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_sync(self):
+        self.assertEqual(sync_recharges(self.api, self.store, '0412345678'),
+                         [(DAY, 10), (DAY * 2, 20)])
+        self.assertEqual(sync_recharges(self.api, self.store, '0412345678'),
+                         [])
+
+        self.api.history.append((DAY * 3, 30))
+        self.assertEqual(sync_recharges(self.api, self.store, '0412345678'),
+                         [(DAY * 3, 30)])
+        self.assertEqual(self.api.calls, [('0412345678', None),
+                                          ('0412345678', DAY * 2),
+                                          ('0412345678', DAY * 2)])
+        self.assertEqual(list(self.store.range('0412345678', RECHARGE)),
+                         [(DAY, 10), (DAY * 2, 20), (DAY * 3, 30)])
+
+    def test_per_service(self):
+        sync_recharges(self.api, self.store, '0412345678')
+        self.assertEqual(len(sync_recharges(self.api, self.store,
+                                            '0499888777')), 2)
+
+    def test_default_service(self):
+        self.assertEqual(len(sync_recharges(self.api, self.store)), 2)
+        self.assertEqual(self.api.calls, [(None, None)])
+        self.assertEqual(self.store.latest('0412345678', RECHARGE),
+                         (DAY * 2, 20))
+
+    def test_default_service_unknown(self):
+        self.api._services = ('0412345678', '0499888777')
+        self.assertRaises(ValueError, sync_recharges, self.api, self.store)
+        self.api._services = ()
+        self.assertRaises(ServiceListError, sync_recharges, self.api,
+                          self.store)
+        self.assertEqual(self.api.calls, [])
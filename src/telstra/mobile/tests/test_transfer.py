@@ -0,0 +1,105 @@
+import unittest
+
+from gsmmodem.exceptions import CommandError
+
+from telstra.mobile.account import Prepaid
+from telstra.mobile.broker import BrokerError
+from telstra.mobile.menu import crawl
+from telstra.mobile.simulator import SimulatedModem, SimulatedSim
+from telstra.mobile.transfer import DEFERRED, FAILED, SENT, plan_transfers, \
+    send_credits
+
+
+class TestPlanTransfers(unittest.TestCase):
+
+    def test_daily_limit(self):
+        today, deferred = plan_transfers(
+            [('0411111111', 5), ('0422222222', '$6'), ('0433333333', 4)])
+        self.assertEqual(today, [('0411111111', 5), ('0433333333', 4)])
+        self.assertEqual(deferred, [('0422222222', 6)])
+
+    def test_sent_today(self):
+        today, deferred = plan_transfers([('0411111111', 5)], sent_today=6)
+        self.assertEqual(today, [])
+        self.assertEqual(deferred, [('0411111111', 5)])
+
+    def test_invalid_amount(self):
+        self.assertRaises(ValueError, plan_transfers,
+                          [('0411111111', 5), ('0422222222', 11)])
+
+
+class TestSendCredits(unittest.TestCase):
+
+    def setUp(self):
+        self.modem = SimulatedModem('/dev/ttyS0', SimulatedSim())
+        self.modem.connect()
+        self.account = Prepaid(self.modem)
+
+    def test_batch(self):
+        results = send_credits(self.account, [('0411111111', 3),
+                                              ('0422222222', 8),
+                                              ('0433333333', 2)])
+        self.assertEqual([result.status for result in results],
+                         [SENT, DEFERRED, SENT])
+        self.assertIn('0433333333', results[2].message)
+        self.assertEqual(self.modem.node, None)
+
+    def test_main_menu_dialled_once(self):
+        dialled = []
+        send_ussd = self.modem.sendUssd
+
+        def record(code, *args, **kwargs):
+            dialled.append(code)
+            return send_ussd(code, *args, **kwargs)
+
+        self.modem.sendUssd = record
+        results = send_credits(self.account, [('0411111111', 2),
+                                              ('0422222222', 2),
+                                              ('0433333333', 2)])
+        self.assertEqual([result.status for result in results],
+                         [SENT, SENT, SENT])
+        self.assertEqual(dialled.count('#100#'), 1)
+        self.assertEqual(dialled.count('#100*1*2#'), 2)
+
+    def test_menu_map(self):
+        self.account.menu_map = crawl(self.account)
+        self.modem.dials = self.modem.replies = 0
+        send_credits(self.account, [('0411111111', 3), ('0422222222', 2)])
+        # One compound dial, then number, amount and confirmation each
+        self.assertEqual(self.modem.dials, 2)
+        self.assertEqual(self.modem.replies, 6)
+
+    def test_failure_continues(self):
+        results = send_credits(FlakyAccount(), [('0411111111', 3),
+                                                ('0499999999', 2),
+                                                ('0433333333', 2)])
+        self.assertEqual([result.status for result in results],
+                         [SENT, FAILED, SENT])
+        self.assertEqual(results[0].message, 'Sent.')
+
+    def test_broker_failure_continues(self):
+        results = send_credits(FlakyAccount(), [('0477777777', 3),
+                                                ('0433333333', 2)])
+        self.assertEqual([result.status for result in results],
+                         [FAILED, SENT])
+
+    def test_transfer_limit_defers_rest(self):
+        results = send_credits(FlakyAccount(), [('0411111111', 1),
+                                                ('0488888888', 1),
+                                                ('0433333333', 1)])
+        self.assertEqual([result.status for result in results],
+                         [SENT, DEFERRED, DEFERRED])
+
+
+class FlakyAccount(object):
+    """ Account that fails transfers to particular numbers.
+    """
+
+    def creditme2u(self, phone_number, amount):
+        if phone_number == '0499999999':
+            raise CommandError('+CUSD')
+        elif phone_number == '0477777777':
+            raise BrokerError('+CUSD')
+        elif phone_number == '0488888888':
+            raise ValueError('Daily transfer limit reached.')
+        return 'Sent.'
@@ -0,0 +1,326 @@
+import io
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from telstra.mobile.scrape import CALL
+from telstra.mobile.web import LOGIN_URL, PLAN_DETAILS_URL, \
+    RECHARGE_HISTORY_URL, SERVICES_URL, SIGNON_URL, USAGE_URL, \
+    ServiceListError, TelstraWebApi, WebSessionStore, normalise_phone_number
+
+SUMMARY_URL = 'https://www.my.telstra.com.au/myaccount/prepaid/' \
+    'getCreditSummaryData.json'
+
+USAGE = '<table><tr><th>Date</th><th>Description</th><th>Number</th>' \
+    '<th>Duration</th><th>Cost</th></tr>' \
+    '<tr><td>14/07/2014 10:31 AM</td><td>Call to mobile</td>' \
+    '<td>0412345678</td><td>0:01:00</td><td>$0.90</td></tr></table>'
+
+
+class FakeTelstraAdapter(BaseAdapter):
+    """ Transport adapter answering like Telstra's web services.
+
+    Signing on sets a session cookie; JSON end-points redirect to the login
+    page unless the request carries the current session cookie.
+    """
+
+    def __init__(self, session):
+        super(FakeTelstraAdapter, self).__init__()
+        self.session = session
+        self.token = 0
+        self.sent = []
+        self.usage_requests = []
+        self.summary = {'creditAmount': {'value': 12.5},
+                        'creditExpireDate': 1405250719000,
+                        'commercialOfferCode': {'value': 'CAP30'},
+                        'bundleGroupList': []}
+        self.services = [
+            {'serviceNumber': '0412 345 678', 'serviceId': 'S1',
+             'serviceType': 'PREPAID'},
+            {'serviceNumber': '+61 498 765 432', 'serviceId': 'S2',
+             'serviceType': 'PREPAID'}]
+        self.service_summaries = {'S1': {'creditAmount': {'value': 1.5}},
+                                  'S2': {'creditAmount': {'value': 2.5}}}
+
+    def _response(self, request, content, content_type, url=None):
+        response = requests.Response()
+        response.request = request
+        response.url = url or request.url
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict({'content-type': content_type})
+        response.raw = io.BytesIO(content.encode('utf-8'))
+        return response
+
+    def send(self, request, **kwargs):
+        self.sent.append(request.url)
+        if request.url == SIGNON_URL:
+            self.token += 1
+            self.session.cookies.set('JSESSIONID', str(self.token),
+                                     domain='.telstra.com.au', path='/')
+            return self._response(request, 'Welcome', 'text/html')
+        elif 'JSESSIONID=%d' % self.token in \
+                request.headers.get('Cookie', ''):
+            data = None
+            if request.url == SUMMARY_URL:
+                data = self.summary
+            elif request.url == SERVICES_URL:
+                data = {'result': self.services}
+            elif request.url.startswith(SUMMARY_URL + '?serviceId='):
+                data = self.service_summaries[request.url.split('=')[-1]]
+            elif request.url.startswith(RECHARGE_HISTORY_URL):
+                data = {'result': [
+                    {'date': 1405250719000, 'amount': {'value': 10}},
+                    {'date': 1404000000000, 'amount': {'value': 30}}]}
+            elif request.url.startswith(USAGE_URL):
+                self.usage_requests.append(request.url)
+                return self._response(request, USAGE, 'text/html')
+            elif request.url.startswith(PLAN_DETAILS_URL):
+                puk = '87654321' if request.url.endswith('=S2') \
+                    else '12345678'
+                return self._response(
+                    request, '<span class="puk">%s</span>' % puk,
+                    'text/html')
+            if data is not None:
+                return self._response(request, json.dumps(data),
+                                      'application/json;charset=UTF-8')
+        return self._response(request, '<html>Log in</html>', 'text/html',
+                              url=LOGIN_URL)
+
+    def close(self):
+        pass
+
+
+class TestWebSession(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'session.json')
+        self.store = WebSessionStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _api(self, adapter=None):
+        session = requests.Session()
+        if adapter is None:
+            adapter = FakeTelstraAdapter(session)
+        else:
+            adapter.session = session
+        session.mount('https://', adapter)
+        api = TelstraWebApi('user', 'secret', session_store=self.store,
+                            session=session)
+        return api, adapter
+
+    def test_reuse(self):
+        api, adapter = self._api()
+        self.assertEqual(api.prepaid_balance(), 12.5)
+        self.assertEqual(adapter.sent, [LOGIN_URL, SIGNON_URL, SUMMARY_URL])
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        del adapter.sent[:]
+        api, adapter = self._api(adapter)
+        self.assertFalse(api.logged_in)
+        self.assertEqual(api.prepaid_balance(), 12.5)
+        self.assertEqual(adapter.sent, [SUMMARY_URL])
+
+    def test_expired(self):
+        api, adapter = self._api()
+        # The server forgets the session
+        adapter.token += 1
+
+        del adapter.sent[:]
+        api, adapter = self._api(adapter)
+        self.assertEqual(api.prepaid_balance(), 12.5)
+        self.assertEqual(adapter.sent, [SUMMARY_URL, LOGIN_URL, SIGNON_URL,
+                                        SUMMARY_URL])
+        self.assertTrue(api.logged_in)
+
+    def test_history_expired(self):
+        api, adapter = self._api()
+        adapter.token += 1
+        api, adapter = self._api(adapter)
+        record, = api.prepaid_history()
+        self.assertEqual(record.kind, CALL)
+        self.assertEqual(record.quantity, 60)
+        self.assertTrue(api.logged_in)
+
+    def test_logout(self):
+        api, adapter = self._api()
+        api.logout()
+        self.assertFalse(self.store.load('user', requests.Session().cookies))
+
+
+class TestWebCache(unittest.TestCase):
+
+    def _api(self, cache_ttl=60):
+        session = requests.Session()
+        adapter = FakeTelstraAdapter(session)
+        session.mount('https://', adapter)
+        api = TelstraWebApi('user', 'secret', session=session,
+                            cache_ttl=cache_ttl)
+        return api, adapter
+
+    def test_single_fetch(self):
+        api, adapter = self._api()
+        self.assertEqual(api.prepaid_balance(), 12.5)
+        self.assertEqual(api.prepaid_expiry(),
+                         TelstraWebApi.java_time_to_python(1405250719000))
+        self.assertEqual(api.prepaid_offer(), 'CAP30')
+        self.assertEqual(api.prepaid_bonuspacks(), [])
+        self.assertEqual(adapter.sent.count(SUMMARY_URL), 1)
+
+    def test_summary(self):
+        api, adapter = self._api()
+        summary = api.prepaid_summary()
+        self.assertEqual(summary.balance, 12.5)
+        self.assertEqual(summary.offer, 'CAP30')
+        self.assertTrue(summary.age < 5)
+        self.assertEqual(api.prepaid_summary().timestamp, summary.timestamp)
+
+        adapter.summary['creditAmount']['value'] = 2.5
+        self.assertEqual(api.prepaid_summary(refresh=True).balance, 2.5)
+        self.assertEqual(adapter.sent.count(SUMMARY_URL), 2)
+
+    def test_invalidate(self):
+        api, adapter = self._api()
+        api.prepaid_balance()
+        adapter.summary['creditAmount']['value'] = 2.5
+        self.assertEqual(api.prepaid_balance(), 12.5)
+        api.invalidate(SUMMARY_URL)
+        self.assertEqual(api.prepaid_balance(), 2.5)
+        api.invalidate()
+        api.prepaid_balance()
+        self.assertEqual(adapter.sent.count(SUMMARY_URL), 3)
+
+    def test_expiry(self):
+        api, adapter = self._api(cache_ttl=0)
+        api.prepaid_balance()
+        api.prepaid_balance()
+        self.assertEqual(adapter.sent.count(SUMMARY_URL), 2)
+
+    def test_failure_not_cached(self):
+        api, adapter = self._api()
+        adapter.token += 1
+        api.logged_in = True
+        self.assertIsNone(api.prepaid_balance())
+        api.login()
+        self.assertEqual(api.prepaid_balance(), 12.5)
+
+
+class TestWebServices(unittest.TestCase):
+
+    def setUp(self):
+        session = requests.Session()
+        self.adapter = FakeTelstraAdapter(session)
+        session.mount('https://', self.adapter)
+        self.api = TelstraWebApi('user', 'secret', session=session)
+
+    def _summary_requests(self):
+        return [url for url in self.adapter.sent
+                if url.startswith(SUMMARY_URL + '?')]
+
+    def test_normalise_phone_number(self):
+        self.assertEqual(normalise_phone_number('+61 412 345 678'),
+                         '0412345678')
+        self.assertEqual(normalise_phone_number('0412-345-678'),
+                         '0412345678')
+        self.assertEqual(normalise_phone_number(None), '')
+
+    def test_services(self):
+        self.assertEqual(self.api.services(), [
+            {'phone_number': '0412345678', 'service_id': 'S1',
+             'type': 'PREPAID'},
+            {'phone_number': '0498765432', 'service_id': 'S2',
+             'type': 'PREPAID'}])
+
+    def test_prepaid_summaries(self):
+        summaries = self.api.prepaid_summaries()
+        self.assertEqual(list(summaries), ['0412345678', '0498765432'])
+        self.assertEqual(summaries['0498765432'].balance, 2.5)
+        self.assertEqual(len(self._summary_requests()), 2)
+
+    def test_index_lookup(self):
+        self.assertEqual(self.api.prepaid_balance('0412 345 678'), 1.5)
+        # The first lookup fetched every service
+        self.assertEqual(len(self._summary_requests()), 2)
+        self.assertEqual(self.api.prepaid_balance('+61498765432'), 2.5)
+        self.assertEqual(self.api.prepaid_balance('0412345678'), 1.5)
+        self.assertEqual(len(self._summary_requests()), 2)
+        self.assertEqual(self.adapter.sent.count(SERVICES_URL), 1)
+
+    def test_refresh_one(self):
+        self.api.prepaid_summaries()
+        self.adapter.service_summaries['S1']['creditAmount']['value'] = 9.0
+        summary = self.api.prepaid_summary('0412345678', refresh=True)
+        self.assertEqual(summary.balance, 9.0)
+        self.assertEqual(self._summary_requests()[-1],
+                         SUMMARY_URL + '?serviceId=S1')
+        self.assertEqual(len(self._summary_requests()), 3)
+
+    def test_stale_index(self):
+        self.api.cache_ttl = 0
+        self.api.prepaid_summaries()
+        self.api.prepaid_balance('0412345678')
+        self.assertEqual(len(self._summary_requests()), 3)
+
+    def test_unknown(self):
+        self.assertIsNone(self.api.prepaid_balance('0400000000'))
+        self.assertIsNone(self.api.prepaid_balance('0400000000'))
+        # Unknown numbers check the cached service list again
+        self.assertEqual(len(self._summary_requests()), 2)
+
+    def test_history(self):
+        record, = self.api.prepaid_history('0498 765 432')
+        self.assertEqual(record.cost, 0.9)
+        self.assertEqual(self.adapter.usage_requests, [USAGE_URL + 'S2'])
+
+    def test_puk(self):
+        self.assertEqual(self.api.prepaid_puk(), '12345678')
+
+    def test_puk_service(self):
+        self.assertEqual(self.api.prepaid_puk('0498765432'), '87654321')
+        self.assertEqual(self.adapter.sent[-1], PLAN_DETAILS_URL +
+                         '?serviceId=S2')
+        sent = len(self.adapter.sent)
+        self.assertIsNone(self.api.prepaid_puk('0400000000'))
+        self.assertFalse([url for url in self.adapter.sent[sent:]
+                          if url.startswith(PLAN_DETAILS_URL)])
+
+    def test_recharge_history(self):
+        self.assertEqual(self.api.prepaid_recharge_history(),
+                         [(1404000000.0, 30), (1405250719.0, 10)])
+        self.assertEqual(
+            self.api.prepaid_recharge_history('0412345678',
+                                              since=1404000000.0),
+            [(1405250719.0, 10)])
+        self.assertEqual(self.adapter.sent[-1],
+                         RECHARGE_HISTORY_URL + '?serviceId=S1')
+
+    def test_recharge_history_unknown(self):
+        self.assertEqual(
+            self.api.prepaid_recharge_history('0400000000'), [])
+        self.assertFalse([url for url in self.adapter.sent
+                          if url.startswith(RECHARGE_HISTORY_URL)])
+
+    def test_history_unknown(self):
+        self.assertEqual(list(self.api.prepaid_history('0400000000')), [])
+        self.assertEqual(self.adapter.usage_requests, [])
+
+    def test_services_unavailable(self):
+        self.adapter.services = []
+        self.assertIsNone(self.api.prepaid_balance('0412345678'))
+        self.assertRaises(ServiceListError,
+                          self.api.prepaid_recharge_history, '0412345678')
+        self.assertRaises(ServiceListError, list,
+                          self.api.prepaid_history('0412345678'))
+        self.assertRaises(ServiceListError, self.api.prepaid_puk,
+                          '0412345678')
+        # The default service needs no service list
+        self.assertEqual(self.api.prepaid_puk(), '12345678')
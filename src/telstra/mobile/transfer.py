@@ -0,0 +1,145 @@
+""" Batch CreditMe2U transfers to many recipients.
+
+Transfers are planned against the CreditMe2U daily limit before anything is
+sent, then sent one after another within a single
+:class:`telstra.mobile.session.MenuSession`.  The network ends the USSD
+session after each transfer, so the option numbers leading to the
+CreditMe2U prompt are resolved from ``#100#`` once, and later transfers dial
+straight to the prompt with a compound shortcode::
+
+    results = send_credits(account, [('0411111111', 5), ('0422222222', 5)])
+    for result in results:
+        print(result.phone_number, result.status, result.message)
+"""
+import functools
+import logging
+
+from gsmmodem.exceptions import CommandError, InvalidStateException, \
+    TimeoutException
+
+from telstra.mobile.broker import BrokerError
+from telstra.mobile.parse import parse_amount
+from telstra.mobile.config import CREDITME2U_DAILY_LIMIT
+from telstra.mobile.session import MenuSession
+
+log = logging.getLogger(__name__)
+
+SENT = 'sent'
+DEFERRED = 'deferred'
+FAILED = 'failed'
+
+
+class TransferResult(object):
+    """ Outcome of one transfer in a batch.
+
+    :attr:`status` is one of :data:`SENT`, :data:`DEFERRED` when the daily
+    limit did not allow it today, or :data:`FAILED`, and :attr:`message`
+    is the network's confirmation or the reason for the failure.
+    """
+
+    def __init__(self, phone_number, amount, status, message=None):
+        self.phone_number = phone_number
+        self.amount = amount
+        self.status = status
+        self.message = message
+
+    @property
+    def sent(self):
+        return self.status == SENT
+
+    def __repr__(self):
+        return '<TransferResult %s $%d %s>' % (self.phone_number, self.amount,
+                                               self.status)
+
+
+def plan_transfers(transfers, sent_today=0, limit=CREDITME2U_DAILY_LIMIT):
+    """ Split transfers into those allowed today and those that must wait.
+
+    Transfers keep their order.  One too large for what is left of today's
+    allowance is deferred, but smaller ones after it may still fit.
+
+    :param transfers: Iterable of ``(phone_number, amount)`` pairs.
+    :param sent_today: Dollars already transferred today.
+    :param limit: Dollars that may be transferred per day.
+    :returns: Tuple of ``(today, deferred)`` lists of pairs, with amounts
+        as integers.
+    :raises ValueError: If any amount is invalid, before anything is sent.
+    """
+    remaining = limit - sent_today
+    today = []
+    deferred = []
+    for phone_number, amount in transfers:
+        amount = int(parse_amount(amount))
+        if amount <= remaining:
+            today.append((phone_number, amount))
+            remaining -= amount
+        else:
+            deferred.append((phone_number, amount))
+    return today, deferred
+
+
+def send_credits(account, transfers, sent_today=0,
+                 limit=CREDITME2U_DAILY_LIMIT, ledger=None):
+    """ Send CreditMe2U to several recipients.
+
+    :param account: :class:`telstra.mobile.account.Prepaid` account, or any
+        account with a ``creditme2u`` method, such as a broker account.
+    :param transfers: Iterable of ``(phone_number, amount)`` pairs.
+    :param sent_today: Dollars already transferred today.
+    :param limit: Dollars that may be transferred per day.
+    :param ledger: :class:`telstra.mobile.ledger.TransferLedger` to plan
+        from and record to.  Transfers it refuses are never dialled.
+    :returns: List of :class:`TransferResult`, in the order of
+        ``transfers``.
+
+    A failed transfer does not stop the batch.  If the network reports
+    that the transfer limit has been reached, the remaining transfers are
+    deferred rather than attempted.
+    """
+    transfers = list(transfers)
+    if ledger is not None:
+        source = account.phone_number
+        sent_today = max(sent_today, ledger.sent_today(source))
+    today, deferred = plan_transfers(transfers, sent_today, limit)
+
+    results = {}
+    if hasattr(account, 'navigate'):
+        session = MenuSession(account)
+        send = session.creditme2u
+    else:
+        session = None
+        send = account.creditme2u
+    if ledger is not None:
+        send = functools.partial(ledger.creditme2u, account, send=send)
+
+    limit_reached = False
+    try:
+        for phone_number, amount in today:
+            if limit_reached:
+                result = TransferResult(phone_number, amount, DEFERRED,
+                                        'Transfer limit reached.')
+            else:
+                try:
+                    response = send(phone_number, amount)
+                    message = getattr(response, 'message', response)
+                    result = TransferResult(phone_number, amount, SENT,
+                                            message)
+                except (ValueError, BrokerError, CommandError,
+                        InvalidStateException, TimeoutException) as exc:
+                    log.warning('Failed to send $%d to %s: %s' % (
+                        amount, phone_number, exc))
+                    limit_reached = 'transfer limit' in str(exc)
+                    status = DEFERRED if limit_reached else FAILED
+                    result = TransferResult(phone_number, amount, status,
+                                            str(exc))
+            results.setdefault((phone_number, amount), []).append(result)
+    finally:
+        if session is not None:
+            session.close()
+
+    for phone_number, amount in deferred:
+        results.setdefault((phone_number, amount), []).append(TransferResult(
+            phone_number, amount, DEFERRED, 'Exceeds the daily limit.'))
+
+    return [results[phone_number, int(parse_amount(amount))].pop(0)
+            for phone_number, amount in transfers]
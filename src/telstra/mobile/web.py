@@ -1,56 +1,267 @@
+from collections import OrderedDict
 from datetime import datetime
+import json
 import re
 import logging
+import os
+import tempfile
+import threading
+import time
 
 import requests
 
+from telstra.mobile.config import WEB_CACHE_TTL, WEB_SESSION_PATH
+from telstra.mobile.scrape import find_puk, iter_usage
+
 LOGIN_URL = 'https://www.my.telstra.com.au/myaccount/home'
+SIGNON_URL = 'https://signon.telstra.com.au/login'
+LOGOUT_URL = 'https://www.my.telstra.com.au/myaccount/log-out'
+CREDIT_SUMMARY_URL = 'https://www.my.telstra.com.au/myaccount/prepaid/' \
+    'getCreditSummaryData.json'
+# The service list end-point and its response structure are assumed from
+# the portal's service selector; only the credit summary is confirmed.
+SERVICES_URL = 'https://www.my.telstra.com.au/myaccount/getServiceList.json'
+CONTACT_DETAILS_URL = 'https://www.my.telstra.com.au/myaccount/contactdetail.json'
+PLAN_DETAILS_URL = 'https://www.my.telstra.com.au/myaccount/plan-details-pre-paid'
+RECHARGE_HISTORY_URL = 'https://www.my.telstra.com.au/myaccount/prepaid/' \
+    'getPrepaidRechargeHistory.json'
+USAGE_URL = 'https://www.my.telstra.com.au/myaccount/data-usage-pre-paid/' \
+    'prepaid-usage-fragment?serviceId='
+STREAM_CHUNK_SIZE = 8192
 log = logging.getLogger(__file__)
 
 
+class WebSessionStore(object):
+    """ On-disk store of web session cookies, keyed by username.
+
+    The file and its directory are only accessible to the current user,
+    and writes replace the file atomically.
+    """
+
+    def __init__(self, path=WEB_SESSION_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as session_file:
+                return json.load(session_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        directory = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        # mkstemp creates the file readable and writable by its owner only
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'w') as session_file:
+            json.dump(entries, session_file, indent=2, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    def load(self, username, cookies):
+        """ Load the stored cookies for ``username`` into a cookie jar.
+
+        :returns: Whether any cookies were stored.
+        :rtype: bool
+        """
+        stored = self._load().get(username) or []
+        for cookie in stored:
+            cookies.set(cookie['name'], cookie['value'],
+                        domain=cookie['domain'], path=cookie['path'],
+                        expires=cookie['expires'], secure=cookie['secure'])
+        return bool(stored)
+
+    def save(self, username, cookies):
+        """ Store the cookies in a cookie jar for ``username``.
+        """
+        with self._lock:
+            entries = self._load()
+            entries[username] = [{'name': cookie.name,
+                                  'value': cookie.value,
+                                  'domain': cookie.domain,
+                                  'path': cookie.path,
+                                  'expires': cookie.expires,
+                                  'secure': cookie.secure}
+                                 for cookie in cookies]
+            self._save(entries)
+
+    def remove(self, username):
+        """ Forget the stored session for ``username``.
+        """
+        with self._lock:
+            entries = self._load()
+            if entries.pop(username, None) is not None:
+                self._save(entries)
+
+
+def login_form(username, password):
+    """ Build the sign-on form submitted to :data:`SIGNON_URL`.
+    """
+    return {
+        'encoded': 'false',
+        'goto': 'https://www.my.telstra.com.au/myaccount/overview',
+        'gotoOnFail': 'https://www.my.telstra.com.au/myaccount/home/error?flag=EMAIL',
+        'gx_charset': 'UTF-8',
+        'password': password,
+        'username': username
+    }
+
+
+def normalise_phone_number(number):
+    """ Reduce a phone number to its digits in national format.
+
+    ``+61 412 345 678`` and ``0412 345 678`` both become ``0412345678``.
+    """
+    digits = re.sub(r'\D', '', number or '')
+    if digits.startswith('61') and len(digits) == 11:
+        digits = '0' + digits[2:]
+    return digits
+
+
+def java_time_to_python(milliseconds):
+    """ Convert System.currentTimeMillis() into a ``datetime``.
+    """
+    return datetime.fromtimestamp(milliseconds/1000.0)
+
+
+class ServiceListError(Exception):
+    """ The services under a login could not be listed.
+    """
+
+
+class PrepaidSummary(object):
+    """ Balance, expiry, offer and bonus packs from one credit summary.
+
+    Every prepaid credit question is answered by the same JSON document, so
+    one summary answers them all without fetching it again.
+    """
+
+    def __init__(self, data, timestamp=None):
+        """ Initialise a summary from the credit summary JSON.
+
+        :param data: Decoded credit summary; empty if it was unavailable.
+        :param timestamp: Unix time the summary was fetched; defaults to
+            now.
+        """
+        self.data = data
+        self.timestamp = time.time() if timestamp is None else timestamp
+        credit_amount = data.get('creditAmount')
+        self.balance = credit_amount['value'] if credit_amount else None
+        expiry = data.get('creditExpireDate')
+        self.expiry_date = java_time_to_python(expiry) if expiry else None
+        offer = data.get('commercialOfferCode')
+        self.offer = offer['value'] if offer else None
+        self.bonuspacks = data.get('bundleGroupList')
+
+    @property
+    def age(self):
+        """ Seconds since this summary was fetched.
+        """
+        return time.time() - self.timestamp
+
+
 class TelstraWebApi(object):
     """ API for accessing Telstra mobile information via a web interface.
 
     This could deserve its own package eventually, though since the methods
     here are specific to Telstra mobiles, it lives here for now.
 
-    Authenticate using your telstra.com username and password.
+    Authenticate using your telstra.com username and password.  Given a
+    :class:`WebSessionStore`, the cookies from a previous login are reused
+    and the client only logs in again once that session has expired.
+
+    JSON responses are cached for ``cache_ttl`` seconds, so asking for the
+    balance, expiry and offer in turn makes a single request.  Call
+    :meth:`invalidate` after anything that changes the account, such as a
+    recharge.
 
     **Caution**: all methods use undocumented end-points and are liable
     to break or change at any time!
     """
 
-    def __init__(self, username, password):
-        self.session = requests.Session()
+    def __init__(self, username, password, session_store=None, session=None,
+                 cache_ttl=WEB_CACHE_TTL):
+        """ Initialise the API, logging in unless a stored session exists.
+
+        :param session_store: Optional :class:`WebSessionStore` used to
+            reuse and save login cookies.
+        :param session: Optional ``requests.Session`` to use.
+        :param cache_ttl: Seconds to reuse a JSON response for.  ``0``
+            disables caching.
+        """
+        self.username = username
+        self.password = password
+        self.session_store = session_store
+        self.session = session or requests.Session()
+        self.cache_ttl = cache_ttl
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self.index = {}
+        self._service_ids = {}
+        self.logged_in = False
+        if not (session_store and
+                session_store.load(username, self.session.cookies)):
+            self.login()
+
+    def login(self):
+        """ Log in to Telstra's web services, saving the session cookies.
+        """
         login_page = self.session.get(LOGIN_URL)
         login_page.raise_for_status()
-        login_data = {
-            'encoded': 'false',
-            'goto': 'https://www.my.telstra.com.au/myaccount/overview',
-            'gotoOnFail': 'https://www.my.telstra.com.au/myaccount/home/error?flag=EMAIL',
-            'gx_charset': 'UTF-8',
-            'password': password,
-            'username': username
-        }
-        login_response = \
-            self.session.post('https://signon.telstra.com.au/login',
-                              data=login_data)
+        login_response = self.session.post(
+            SIGNON_URL, data=login_form(self.username, self.password))
         login_response.raise_for_status()
+        self.logged_in = True
+        if self.session_store:
+            self.session_store.save(self.username, self.session.cookies)
 
-    @staticmethod
-    def java_time_to_python(milliseconds):
-        """ Convert System.currentTimeMillis() into a Unix timestamp.
-        """
-        return datetime.fromtimestamp(milliseconds/1000.0)
+    java_time_to_python = staticmethod(java_time_to_python)
 
     def logout(self):
-        self.session.get('https://www.my.telstra.com.au/myaccount/log-out')
+        self.session.get(LOGOUT_URL)
+        self.invalidate()
+        if self.session_store:
+            self.session_store.remove(self.username)
+
+    def invalidate(self, url=None):
+        """ Discard the cached response for ``url``, or all of them.
+        """
+        with self._cache_lock:
+            if url is None:
+                self._cache.clear()
+                self.index.clear()
+            else:
+                self._cache.pop(url, None)
+
+    def _get_cached_json(self, url, refresh=False):
+        """ Obtain ``url`` as JSON, reusing a response younger than
+        ``cache_ttl``.
+
+        :returns: ``(timestamp, data)`` pair of when the data was fetched.
+        """
+        with self._cache_lock:
+            cached = self._cache.get(url)
+        if cached and not refresh and time.time() - cached[0] < self.cache_ttl:
+            return cached
+        timestamp = time.time()
+        data = self._get_json(url)
+        # Failures are not cached, so the next call tries again
+        if data and self.cache_ttl:
+            with self._cache_lock:
+                self._cache[url] = (timestamp, data)
+        return timestamp, data
 
     def _get_json(self, url):
         response = self.session.get(url)
-        content_type = response.headers.get('content-type')
+        content_type = response.headers.get('content-type') or ''
         if response.url == url and 'json' in content_type:
             return response.json()
+        elif not self.logged_in:
+            # A redirect or HTML page means the stored session has expired
+            log.info('Stored web session expired; logging in again.')
+            self.login()
+            return self._get_json(url)
         else:
             log.critical('Could not retrieve service metadata. '
                          'Content type is %s.' % content_type)
@@ -60,23 +271,112 @@ class TelstraWebApi(object):
     def _prepaid_metadata(self, phone_number=None):
         """ Obtain account and service metadata for a prepaid service.
         """
-        url = 'https://www.my.telstra.com.au/myaccount/prepaid/getCreditSummaryData.json'
-        return self._get_json(url)
+        return self._get_cached_json(CREDIT_SUMMARY_URL)[1]
+
+    def services(self, refresh=False):
+        """ List the services under this login.
+
+        :returns: Structures with ``phone_number``, in national format,
+            ``service_id`` and ``type`` keys.
+        :rtype: list
+        """
+        data = self._get_cached_json(SERVICES_URL, refresh=refresh)[1]
+        if isinstance(data, dict):
+            data = data.get('result') or []
+        return [{'phone_number': normalise_phone_number(
+                     service.get('serviceNumber')),
+                 'service_id': service.get('serviceId'),
+                 'type': service.get('serviceType')}
+                for service in data]
+
+    def _service_summary(self, service_id, refresh=False):
+        timestamp, data = self._get_cached_json(
+            '%s?serviceId=%s' % (CREDIT_SUMMARY_URL, service_id),
+            refresh=refresh)
+        return PrepaidSummary(data, timestamp)
+
+    def prepaid_summaries(self, refresh=False):
+        """ Fetch the credit summary of every service under this login.
+
+        The results also replace :attr:`index`, so that later
+        :meth:`prepaid_summary` calls for these numbers are dictionary
+        reads until their summaries are ``cache_ttl`` seconds old.
+
+        :returns: Mapping of phone numbers to :class:`PrepaidSummary`.
+        :rtype: collections.OrderedDict
+        """
+        services = self.services(refresh=refresh)
+        summaries = OrderedDict()
+        for service in services:
+            summaries[service['phone_number']] = self._service_summary(
+                service['service_id'], refresh=refresh)
+        self._service_ids = dict(
+            (service['phone_number'], service['service_id'])
+            for service in services)
+        # Failed fetches are left out, so the next lookup tries again
+        self.index = dict((phone_number, summary)
+                          for phone_number, summary in summaries.items()
+                          if summary.data)
+        return summaries
+
+    def prepaid_summary(self, phone_number=None, refresh=False):
+        """ Obtain the balance, expiry, offer and bonus packs together.
+
+        :param phone_number: Service to summarise, in any format.  The
+            login's default service is used if ``None``.
+        :param refresh: Fetch a new summary even if one is cached.
+        :rtype: :class:`PrepaidSummary`
+        """
+        if phone_number is None:
+            timestamp, data = self._get_cached_json(CREDIT_SUMMARY_URL,
+                                                    refresh=refresh)
+            return PrepaidSummary(data, timestamp)
+
+        phone_number = normalise_phone_number(phone_number)
+        summary = self.index.get(phone_number)
+        if summary is not None and not refresh and \
+                summary.age < self.cache_ttl:
+            return summary
+        if phone_number not in self._service_ids:
+            # Unknown or new number: list and fetch every service at once
+            summary = self.prepaid_summaries().get(phone_number)
+            if summary is not None and not refresh:
+                return summary
+        service_id = self._service_ids.get(phone_number)
+        if not self._service_ids:
+            log.error('Could not list the services under this login.')
+            return PrepaidSummary({})
+        elif service_id is None:
+            log.warning('No service %s under this login.' % phone_number)
+            return PrepaidSummary({})
+        summary = self._service_summary(service_id, refresh=refresh)
+        if summary.data:
+            self.index[phone_number] = summary
+        return summary
+
+    def last_summary(self, phone_number=None):
+        """ Most recent credit summary, however old, without fetching.
+
+        :rtype: :class:`PrepaidSummary` or ``None``
+        """
+        if phone_number is not None:
+            return self.index.get(normalise_phone_number(phone_number))
+        with self._cache_lock:
+            cached = self._cache.get(CREDIT_SUMMARY_URL)
+        if cached:
+            return PrepaidSummary(cached[1], cached[0])
 
     def prepaid_expiry(self, phone_number=None):
-        timestamp = self._prepaid_metadata.get('creditExpireDate')
-        return self.java_time_to_python(timestamp) if timestamp else None
+        return self.prepaid_summary(phone_number).expiry_date
 
     def prepaid_balance(self, phone_number=None):
-        credit_amount = self._prepaid_metadata.get('creditAmount')
-        return credit_amount['value'] if credit_amount else None
+        return self.prepaid_summary(phone_number).balance
 
     def prepaid_offer(self, phone_number=None):
-        offer = self._prepaid_metadata.get('commercialOfferCode')
-        return offer['value'] if offer else None
+        return self.prepaid_summary(phone_number).offer
 
     def prepaid_bonuspacks(self, phone_number=None):
-        return self._prepaid_metadata.get('bundleGroupList')
+        return self.prepaid_summary(phone_number).bonuspacks
 
     def contact_details(self):
         """ Obtains account holder contact details on file.
@@ -86,9 +386,9 @@ class TelstraWebApi(object):
          "homeNumber":null,
          "firstName":"John"}
         """
-        return self._get_json('https://www.my.telstra.com.au/myaccount/contactdetail.json')
+        return self._get_json(CONTACT_DETAILS_URL)
 
-    def prepaid_recharge_history(self, phone_number=None):
+    def prepaid_recharge_history(self, phone_number=None, since=None):
         """ Access and process recharge history for a prepaid service.
 
         [{'date': 1405250719000,
@@ -97,25 +397,119 @@ class TelstraWebApi(object):
 
         There's other information in the JSON structure, but it is all
         redundant.
+
+        :param phone_number: Service to read; the login's default service
+            if ``None``.  Nothing is returned for a number not under this
+            login.
+        :param since: Unix timestamp; only recharges after it are returned.
+        :returns: ``(timestamp, amount)`` pairs in time order, with Unix
+            timestamps as used by :mod:`telstra.mobile.store`.
+        :rtype: list
+        :raises ServiceListError: if ``phone_number`` is given and the
+            service list is unavailable.
+        """
+        url = RECHARGE_HISTORY_URL
+        if phone_number is not None:
+            service_id = self._service_id(phone_number)
+            if service_id is None:
+                # Never fall back to the default service's history
+                log.warning('No service %s under this login.' % phone_number)
+                return []
+            url += '?serviceId=%s' % service_id
+        data = self._get_json(url)
+        recharges = []
+        for recharge in data.get('result') or []:
+            timestamp = recharge['date'] / 1000.0
+            if since is None or timestamp > since:
+                recharges.append((timestamp, recharge['amount']['value']))
+        recharges.sort()
+        return recharges
+
+    def _get_stream(self, url):
+        """ Start streaming the response body of ``url``, logging in again
+        if the stored session has expired.  The caller closes the response.
         """
-        data = self._get_json('https://www.my.telstra.com.au/myaccount/prepaid/getPrepaidRechargeHistory.json')
-        if 'result' in data:
-            for recharge in data['result']:
-                print(self.java_time_to_python(recharge['date'],
-                                               recharge['amount']['value']))
+        response = self.session.get(url, stream=True)
+        if response.url != url and not self.logged_in:
+            # A redirect means the stored session has expired
+            response.close()
+            log.info('Stored web session expired; logging in again.')
+            self.login()
+            response = self.session.get(url, stream=True)
+        response.raise_for_status()
+        return response
+
+    def _service_id(self, phone_number):
+        """ Look up the service ID of ``phone_number``.
+
+        :returns: The service ID, or ``None`` for a number not under this
+            login.
+        :raises ServiceListError: if the service list is unavailable.
+        """
+        phone_number = normalise_phone_number(phone_number)
+        if phone_number not in self._service_ids:
+            services = self.services()
+            if not services:
+                raise ServiceListError(
+                    'Could not list the services under this login.')
+            self._service_ids = dict(
+                (service['phone_number'], service['service_id'])
+                for service in services)
+        return self._service_ids.get(phone_number)
 
     def prepaid_history(self, phone_number=None):
         """ Access the last 30 days of call and service records.
 
-        Processing of this response requires screen scraping HTML.
+        The usage fragment is parsed as it downloads, so records are
+        yielded before the whole page has arrived and memory use does not
+        grow with the length of the history.
+
+        :param phone_number: Service to read; the login's default service
+            if ``None``.  Nothing is yielded for a number not under this
+            login.
+        :returns: Generator of :class:`telstra.mobile.scrape.UsageRecord`.
+        :raises ServiceListError: if ``phone_number`` is given and the
+            service list is unavailable.
         """
-        response = self.session.get('https://www.my.telstra.com.au/myaccount/data-usage-pre-paid/prepaid-usage-fragment?serviceId=')
-        print(response.content)
+        url = USAGE_URL
+        if phone_number is not None:
+            service_id = self._service_id(phone_number)
+            if service_id is None:
+                # Never fall back to the default service's usage
+                log.warning('No service %s under this login.' % phone_number)
+                return
+            url += service_id
+        response = self._get_stream(url)
+        try:
+            for record in iter_usage(
+                    response.iter_content(STREAM_CHUNK_SIZE),
+                    response.encoding):
+                yield record
+        finally:
+            response.close()
 
     def prepaid_puk(self, phone_number=None):
         """ Get the PUK for the given account via scraping HTML.
+
+        The page is only read as far as the PUK.
+
+        :param phone_number: Service whose SIM's PUK to read; the login's
+            default service if ``None``.  ``None`` is returned for a number
+            not under this login.
+        :raises ServiceListError: if ``phone_number`` is given and the
+            service list is unavailable.
         """
-        response = self.session.get('https://www.my.telstra.com.au/myaccount/plan-details-pre-paid')
-        match = re.search('<span class="puk">(.*?)</span>', response.content)
-        if match:
-            return match.groups()[0]
+        url = PLAN_DETAILS_URL
+        if phone_number is not None:
+            service_id = self._service_id(phone_number)
+            if service_id is None:
+                # Never return the default service's SIM's PUK
+                log.warning('No service %s under this login.' % phone_number)
+                return None
+            url += '?serviceId=%s' % service_id
+        response = self._get_stream(url)
+        try:
+            return find_puk(response.iter_content(STREAM_CHUNK_SIZE),
+                            response.encoding)
+        finally:
+            response.close()